@@ -0,0 +1,201 @@
+import os
+import sys
+import logging
+import json
+import datetime
+import urllib.parse
+import boto3
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from pprint import pprint
+import aux
+import aux_api
+import pagination
+import instrumentation
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Globals.
+# ---------------------------------------------------------------------------------------------------------------------
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+
+ENV_RFQ_REQUEST_TABLE_NAME = "RFQ_REQUEST_TABLE_NAME"
+ENV_RFQ_REQUEST_INDEX_NAME = "RFQ_REQUEST_INDEX_NAME"
+
+QSP_CUSTOMER_ID = "customer-id"
+QSP_FROM = "from"
+QSP_TO = "to"
+
+# Only the summary of each RFQ goes into the list, the details are available via the RFQ status resource.
+RFQ_SUMMARY_ATTRIBUTES = ["customer-id", "correlation-id", "from-location", "to-location", "submitted-at", "timeout-at"]
+# Pages are queried from the submitted-at index, its cursors carry the index keys besides the table keys.
+RFQ_REQUEST_INDEX_KEYS = ["customer-id", "correlation-id", "submitted-at"]
+
+BAD_REQUEST_NO_CUSTOMER_ID = "Query string parameter 'customer-id' is required."
+BAD_REQUEST_INVALID_PARAMETERS = "Query string parameters are invalid."
+INTERNAL_SERVER_ERROR_QUERY_FAILED = "Rfqs couldn't be queried, please retry."
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Query one page of RFQs of a customer, optionally within a time range.
+# ---------------------------------------------------------------------------------------------------------------------
+
+@instrumentation.stage("query_rfqs")
+def query_rfqs(customer_id, from_timestamp, to_timestamp, limit, exclusive_start_key):
+    LOGGER.debug("Query RFQs from the database.")
+    table_name = os.environ.get(ENV_RFQ_REQUEST_TABLE_NAME)
+    LOGGER.debug("table_name: %s", table_name)
+    index_name = os.environ.get(ENV_RFQ_REQUEST_INDEX_NAME)
+    LOGGER.debug("index_name: %s", index_name)
+
+    key_condition = Key("customer-id").eq(customer_id)
+    if from_timestamp is not None or to_timestamp is not None:
+        # The index is sorted by submission time, so the time range is a range on its sort key. It covers the RFQs
+        # from before time-ordered correlation IDs, too.
+        key_condition = key_condition & Key("submitted-at").between(
+            (from_timestamp or datetime.datetime.min).isoformat(),
+            (to_timestamp or datetime.datetime.max).isoformat()
+        )
+
+    query_args = {
+        "IndexName": index_name,
+        "KeyConditionExpression": key_condition,
+        "ProjectionExpression": ", ".join("#a" + str(index) for index in range(len(RFQ_SUMMARY_ATTRIBUTES))),
+        "ExpressionAttributeNames": { "#a" + str(index): name for index, name in enumerate(RFQ_SUMMARY_ATTRIBUTES) },
+        # Latest RFQs first.
+        "ScanIndexForward": False,
+        "Limit": limit
+    }
+    if exclusive_start_key is not None:
+        query_args["ExclusiveStartKey"] = exclusive_start_key
+
+    dynamodb = boto3.resource("dynamodb")
+    table = dynamodb.Table(table_name)
+    response = table.query(**query_args)
+    LOGGER.debug("RFQs successfully queried.")
+    LOGGER.debug("response: %s", response)
+    return response["Items"], response.get("LastEvaluatedKey")
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Create links for the list resource and its entries.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def create_link_base_url(event):
+    link_protocol = event["headers"]["X-Forwarded-Proto"]
+    LOGGER.debug("link_protocol: %s", link_protocol)
+
+    link_host = event["headers"]["Host"]
+    LOGGER.debug("link_host: %s", link_host)
+
+    link_stage = event["requestContext"]["stage"]
+    LOGGER.debug("link_stage: %s", link_stage)
+
+    link_base_url = link_protocol + "://" + link_host
+
+    request_context_path = event["requestContext"]["path"]
+    if request_context_path.startswith("/" + link_stage):
+        # We need to include the stage in constructed resource URLs.
+        link_base_url += "/" + link_stage
+
+    link_base_url += "/api/user"
+    LOGGER.debug("link_base_url: %s", link_base_url)
+    return link_base_url
+
+def create_list_link(link_base_url, query_string_parameters, cursor):
+    parameters = dict(query_string_parameters)
+    parameters.pop(pagination.QSP_CURSOR, None)
+    if cursor is not None:
+        parameters[pagination.QSP_CURSOR] = cursor
+    return link_base_url + "/list-rfqs?" + urllib.parse.urlencode(parameters)
+
+def create_rfq_status_link(link_base_url, customer_id, correlation_id):
+    return link_base_url + "/retrieve-rfq-status?" + urllib.parse.urlencode({
+        "customer-id": customer_id,
+        "correlation-id": correlation_id
+    })
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Respond to a query that failed - throttled, for instance.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def create_query_failed_response():
+    return {
+        "statusCode": 500,
+        "body": json.dumps({ "error-message": INTERNAL_SERVER_ERROR_QUERY_FAILED }),
+        "headers": {
+            "Content-Type": "application/json"
+        }
+    }
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Lambda handler.
+# ---------------------------------------------------------------------------------------------------------------------
+
+@instrumentation.instrument_handler(LOGGER)
+def lambda_handler(event, context):
+
+    # If the environment advises on a specific debug level, set it accordingly.
+    aux.update_log_level(LOGGER, event, context)
+    # Log environment details.
+    aux.log_env_details(LOGGER)
+    # Log request details.
+    aux.log_event_and_context(LOGGER, event, context)
+    # Publish Lambda event to the respective event logging topic.
+    with instrumentation.stage("publish_lambda_event"):
+        aux_api.publish_apigw_lambda_event(LOGGER, event)
+
+    # Extract and check the query string parameters.
+    query_string_parameters = event.get("queryStringParameters") or {}
+    customer_id = query_string_parameters.get(QSP_CUSTOMER_ID)
+    LOGGER.debug("customer_id: %s", customer_id)
+    if not customer_id:
+        return aux_api.bad_request(LOGGER, event, BAD_REQUEST_NO_CUSTOMER_ID, None)
+    try:
+        from_timestamp = pagination.extract_timestamp(query_string_parameters, QSP_FROM)
+        LOGGER.debug("from_timestamp: %s", from_timestamp)
+        to_timestamp = pagination.extract_timestamp(query_string_parameters, QSP_TO)
+        LOGGER.debug("to_timestamp: %s", to_timestamp)
+        # DynamoDB rejects a range whose lower bound is above its upper bound.
+        if from_timestamp is not None and to_timestamp is not None and from_timestamp > to_timestamp:
+            raise ValueError("'" + QSP_FROM + "' must not be after '" + QSP_TO + "'.")
+        limit = pagination.extract_limit(query_string_parameters)
+        LOGGER.debug("limit: %d", limit)
+        exclusive_start_key = pagination.decode_cursor(query_string_parameters.get(pagination.QSP_CURSOR), RFQ_REQUEST_INDEX_KEYS)
+        LOGGER.debug("exclusive_start_key: %s", exclusive_start_key)
+        if exclusive_start_key is not None and exclusive_start_key["customer-id"] != customer_id:
+            raise ValueError("Cursor doesn't belong to this customer.")
+    except ValueError as ex:
+        LOGGER.exception(BAD_REQUEST_INVALID_PARAMETERS)
+        return aux_api.bad_request(LOGGER, event, BAD_REQUEST_INVALID_PARAMETERS, ex)
+
+    # Query one page of RFQs.
+    try:
+        rfqs, last_evaluated_key = query_rfqs(customer_id, from_timestamp, to_timestamp, limit, exclusive_start_key)
+    except ClientError as ex:
+        LOGGER.exception("Something went wrong with querying the RFQs.")
+        LOGGER.exception(ex)
+        return create_query_failed_response()
+
+    # Create the resource representation with links to each RFQ and to the next page.
+    link_base_url = create_link_base_url(event)
+    for rfq in rfqs:
+        rfq["links"] = { "self": create_rfq_status_link(link_base_url, rfq["customer-id"], rfq["correlation-id"]) }
+    links = { "self": create_list_link(link_base_url, query_string_parameters, query_string_parameters.get(pagination.QSP_CURSOR)) }
+    cursor = pagination.encode_cursor(last_evaluated_key)
+    if cursor is not None:
+        links["next"] = create_list_link(link_base_url, query_string_parameters, cursor)
+
+    data = {
+        "links": links,
+        "rfqs": pagination.convert_decimals(rfqs)
+    }
+
+    return {
+        "statusCode": 200,
+        "body": json.dumps(data),
+        "headers": {
+            "Content-Type": "application/json"
+        }
+    }
+
+# ---------------------------------------------------------------------------------------------------------------------
@@ -9,6 +9,8 @@ import boto3
 from boto3.dynamodb.conditions import Key
 from botocore.exceptions import ClientError
 from pprint import pprint
+import unicorn_stats
+import instrumentation
 
 # ---------------------------------------------------------------------------------------------------------------------
 # "Global variables" - what is the correct term for these things in Python?
@@ -21,6 +23,7 @@ ENV_LOG_LEVEL = "LOG_LEVEL"
 
 ENV_RFQ_REQUEST_TABLE_NAME = "RFQ_REQUEST_TABLE_NAME"
 ENV_RFQ_RESPONSE_TABLE_NAME = "RFQ_RESPONSE_TABLE_NAME"
+ENV_UNICORN_STATS_TABLE_NAME = "UNICORN_STATS_TABLE_NAME"
 
 STR_NONE = "NONE"
 
@@ -66,6 +69,7 @@ def log_event_and_context(event, context):
 # Assemble the current RFQ status details.
 # ---------------------------------------------------------------------------------------------------------------------
 
+@instrumentation.stage("fetch_rfq_request")
 def fetch_rfq_request(customer_id, correlation_id):
     try:
         LOGGER.debug("Fetch RFQ request details from the database.")
@@ -88,6 +92,7 @@ def fetch_rfq_request(customer_id, correlation_id):
         LOGGER.exception(ex)
         return STR_NONE
 
+@instrumentation.stage("fetch_rfq_responses")
 def fetch_rfq_responses(correlation_id):
     try:
         LOGGER.debug("Fetch RFQ responses from the database.")
@@ -118,6 +123,47 @@ def fetch_rfq_responses(correlation_id):
         LOGGER.exception(ex)
         return 0
 
+# ---------------------------------------------------------------------------------------------------------------------
+# Record the winner of a finished RFQ in the unicorn statistics (exactly once per RFQ).
+# ---------------------------------------------------------------------------------------------------------------------
+
+@instrumentation.stage("record_rfq_winner")
+def record_rfq_winner(customer_id, correlation_id, rfq_request, rfq_responses):
+    try:
+        if rfq_request == STR_NONE or not rfq_responses:
+            return 0
+        now = datetime.datetime.utcnow()
+        if now <= datetime.datetime.fromisoformat(rfq_request["timeout-at"]):
+            # Still running, the winner isn't known yet.
+            return 0
+        winner_unicorn_id = min(rfq_responses, key=lambda rfq_response: rfq_response["price"])["unicorn-id"]
+        LOGGER.debug("winner_unicorn_id: %s", winner_unicorn_id)
+
+        # The result may be retrieved many times, only the first retrieval gets to record the win.
+        dynamodb = boto3.resource("dynamodb")
+        table = dynamodb.Table(os.environ.get(ENV_RFQ_REQUEST_TABLE_NAME))
+        table.update_item(
+            Key = { "customer-id": customer_id, "correlation-id": correlation_id },
+            UpdateExpression = "SET #winner = :winner",
+            ConditionExpression = "attribute_not_exists(#winner)",
+            ExpressionAttributeNames = { "#winner": "winner-unicorn-id" },
+            ExpressionAttributeValues = { ":winner": winner_unicorn_id }
+        )
+    except ClientError as error:
+        if error.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            LOGGER.debug("RFQ winner already recorded.")
+            return 0
+        LOGGER.exception("Something went wrong with recording the RFQ winner.")
+        LOGGER.exception(error)
+        return 0
+    except Exception as ex:
+        LOGGER.exception("Something went wrong with recording the RFQ winner.")
+        LOGGER.exception(ex)
+        return 0
+
+    table_name = os.environ.get(ENV_UNICORN_STATS_TABLE_NAME)
+    return unicorn_stats.record_rfq_win(LOGGER, table_name, winner_unicorn_id, now)
+
 # ---------------------------------------------------------------------------------------------------------------------
 # Create self link for RFQ result resource.
 # ---------------------------------------------------------------------------------------------------------------------
@@ -148,6 +194,7 @@ def create_self_link(event, customer_id, correlation_id):
 # Main.
 # ---------------------------------------------------------------------------------------------------------------------
 
+@instrumentation.instrument_handler(LOGGER)
 def lambda_handler(event, context):
 
     # If the environment advises on a specific debug level, set it accordingly.
@@ -169,6 +216,9 @@ def lambda_handler(event, context):
     rfq_request = fetch_rfq_request(customer_id, correlation_id)
     rfq_responses = fetch_rfq_responses(correlation_id)
 
+    # Once the RFQ is over, let the unicorn statistics know who won.
+    record_rfq_winner(customer_id, correlation_id, rfq_request, rfq_responses)
+
     # Create self link for the resource representation.
     self_link = create_self_link(event, customer_id, correlation_id)
 
@@ -9,6 +9,7 @@ import boto3
 from boto3.dynamodb.conditions import Key
 from botocore.exceptions import ClientError
 from pprint import pprint
+import instrumentation
 
 # ---------------------------------------------------------------------------------------------------------------------
 # "Global variables" - what is the correct term for these things in Python?
@@ -76,6 +77,7 @@ def log_event_and_context(event, context):
 # Assemble the current RFQ status details.
 # ---------------------------------------------------------------------------------------------------------------------
 
+@instrumentation.stage("fetch_rfq_request")
 def fetch_rfq_request(customer_id, correlation_id):
     try:
         LOGGER.debug("Fetch RFQ request details from the database.")
@@ -96,6 +98,7 @@ def fetch_rfq_request(customer_id, correlation_id):
         LOGGER.exception(ex)
         return STR_NONE
 
+@instrumentation.stage("fetch_rfq_response_count")
 def fetch_rfq_response_count(correlation_id):
     try:
         LOGGER.debug("Fetch RFQ response count from the database.")
@@ -214,6 +217,7 @@ def create_rfq_result_link(event, customer_id, correlation_id):
 # Main.
 # ---------------------------------------------------------------------------------------------------------------------
 
+@instrumentation.instrument_handler(LOGGER)
 def lambda_handler(event, context):
 
     # If the environment advises on a specific debug level, set it accordingly.
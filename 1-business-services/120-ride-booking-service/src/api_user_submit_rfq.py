@@ -7,6 +7,14 @@ import uuid
 import boto3
 from botocore.exceptions import ClientError
 from pprint import pprint
+import rfq_filters
+import unicorn_stats
+import time_ordered_ids
+import instrumentation
+import profiling
+import request_validation
+import request_schemas
+import value_objects
 
 # ---------------------------------------------------------------------------------------------------------------------
 # "Global variables".
@@ -28,11 +36,18 @@ ENV_RFQ_RESPONSE_TABLE_NAME = "RFQ_RESPONSE_TABLE_NAME"
 ENV_RFQ_RESPONSE_QUEUE_NAME = "RFQ_RESPONSE_QUEUE_NAME"
 ENV_RFQ_RESPONSE_QUEUE_URL = "RFQ_RESPONSE_QUEUE_URL"
 
+ENV_UNICORN_STATS_TABLE_NAME = "UNICORN_STATS_TABLE_NAME"
+ENV_RFQ_MAX_INVITED_UNICORNS = "RFQ_MAX_INVITED_UNICORNS"
+ENV_RFQ_EXPLORATION_SHARE = "RFQ_EXPLORATION_SHARE"
+
 STR_NONE = "NONE"
 
 LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.DEBUG)
 
+# Compiled once per container, so validating a request is just a few function calls.
+RFQ_VALIDATOR = request_validation.compile_schema(request_schemas.SUBMIT_RFQ_SCHEMA)
+
 # ---------------------------------------------------------------------------------------------------------------------
 # If the environment advises on a specific debug level, set it accordingly.
 # ---------------------------------------------------------------------------------------------------------------------
@@ -60,10 +75,11 @@ def log_env_details():
 
 # ---------------------------------------------------------------------------------------------------------------------
 # Create (and log) a correlation ID for this specific request.
+# The ID is time-ordered, so the RFQs of a customer can be range-queried by time on the table's sort key.
 # ---------------------------------------------------------------------------------------------------------------------
 
-def create_correlation_id():
-    correlation_id = str(uuid.uuid4())
+def create_correlation_id(submitted_at):
+    correlation_id = time_ordered_ids.create_time_ordered_id(submitted_at)
     LOGGER.debug("correlation_id: %s", correlation_id)
     return correlation_id
 
@@ -87,10 +103,11 @@ def log_event_and_context(event, context):
     LOGGER.debug("context: %s", context)
 
 # ---------------------------------------------------------------------------------------------------------------------
-# Persist the incoming ride details.
+# Persist the incoming RFQ details.
 # ---------------------------------------------------------------------------------------------------------------------
 
-def persist_rfq(customer_id, correlation_id, from_location, to_location, submitted_at, timeout_in_secs, timeout_at, rfq_details):
+@instrumentation.stage("persist_rfq")
+def persist_rfq(rfq):
     try:
         LOGGER.debug("Persist the incoming RFQ details.")
         table_name = os.environ.get(ENV_RFQ_REQUEST_TABLE_NAME, STR_NONE)
@@ -100,14 +117,15 @@ def persist_rfq(customer_id, correlation_id, from_location, to_location, submitt
         response = ddb_client.put_item(
             TableName = table_name,
             Item = {
-                "customer-id"    : { "S": customer_id },
-                "correlation-id" : { "S": correlation_id },
-                "from-location"  : { "S": from_location },
-                "to-location"    : { "S": to_location },
-                "submitted-at"   : { "S": submitted_at.isoformat() },
-                "timeout-in-secs": { "N": str(timeout_in_secs) },
-                "timeout-at"     : { "S": timeout_at.isoformat() },
-                "rfq-details"    : { "S": json.dumps(rfq_details) }
+                "customer-id"    : { "S": rfq.customer_id },
+                "correlation-id" : { "S": rfq.correlation_id },
+                "from-location"  : { "S": rfq.from_location },
+                "to-location"    : { "S": rfq.to_location },
+                "submitted-at"   : { "S": rfq.submitted_at },
+                "timeout-in-secs": { "N": str(rfq.timeout_in_secs) },
+                "timeout-at"     : { "S": rfq.timeout_at },
+                # Encoded once, the very same JSON is published below.
+                "rfq-details"    : { "S": rfq.to_json() }
             }
         )
     except Exception as ex:
@@ -119,11 +137,30 @@ def persist_rfq(customer_id, correlation_id, from_location, to_location, submitt
         LOGGER.debug("DDB response: %s", response)
         return 1
 
+# ---------------------------------------------------------------------------------------------------------------------
+# Select the unicorns to invite to the RFQ based on their past responsiveness and win rate.
+# ---------------------------------------------------------------------------------------------------------------------
+
+@instrumentation.stage("select_invited_unicorns")
+def select_invited_unicorns():
+    LOGGER.debug("Select the unicorns to invite to the RFQ.")
+    max_invited_unicorns = int(os.environ.get(ENV_RFQ_MAX_INVITED_UNICORNS, "0"))
+    LOGGER.debug("max_invited_unicorns: %d", max_invited_unicorns)
+    if max_invited_unicorns <= 0:
+        # Selection is switched off, so every unicorn is invited.
+        return None
+    exploration_share = float(os.environ.get(ENV_RFQ_EXPLORATION_SHARE, "0.1"))
+    LOGGER.debug("exploration_share: %f", exploration_share)
+
+    stats = unicorn_stats.fetch_unicorn_stats(LOGGER, os.environ.get(ENV_UNICORN_STATS_TABLE_NAME))
+    return unicorn_stats.select_unicorns(LOGGER, stats, max_invited_unicorns, exploration_share)
+
 # ---------------------------------------------------------------------------------------------------------------------
 # Publish RFQ to RFQ request topic.
 # ---------------------------------------------------------------------------------------------------------------------
 
-def publish_rfq(customer_id, correlation_id, from_location, to_location, submitted_at, timeout_in_secs, timeout_at, rfq_details):
+@instrumentation.stage("publish_rfq")
+def publish_rfq(rfq, rfq_constraints, invited_unicorns):
     try:
         LOGGER.debug("Publish ride details to ride completion topic.")
         topic_arn = os.environ.get(ENV_RFQ_REQUEST_TOPIC_ARN, STR_NONE)
@@ -131,29 +168,34 @@ def publish_rfq(customer_id, correlation_id, from_location, to_location, submitt
         # Determine correlation ID key and value.
         msg_meta_correlation_id_key = os.environ.get(ENV_MSG_META_CORRELATION_ID_KEY)
         LOGGER.debug("Correlation ID key: %s", msg_meta_correlation_id_key)
-        msg_meta_correlation_id_value = correlation_id
+        msg_meta_correlation_id_value = rfq.correlation_id
         LOGGER.debug("Correlation ID value: %s", msg_meta_correlation_id_value)
         # Determine return address key and value.
         msg_meta_return_address_key = os.environ.get(ENV_MSG_META_RETURN_ADDRESS_KEY)
         LOGGER.debug("Return address key: %s", msg_meta_return_address_key)
         msg_meta_return_address_value = os.environ.get(ENV_RFQ_RESPONSE_QUEUE_URL)
         LOGGER.debug("Return address value: %s", msg_meta_return_address_value)
+        # Next to correlation ID and return address, other data may also be interesting for message filtering.
+        message_attributes = {
+            msg_meta_correlation_id_key: { "DataType": "String", "StringValue": msg_meta_correlation_id_value },
+            msg_meta_return_address_key: { "DataType": "String", "StringValue": msg_meta_return_address_value },
+            "customer-id": { "DataType": "String", "StringValue": rfq.customer_id },
+            "from-location": { "DataType": "String", "StringValue": rfq.from_location },
+            "to-location": { "DataType": "String", "StringValue": rfq.to_location },
+            "timeout_in_secs": { "DataType": "Number", "StringValue": str(rfq.timeout_in_secs) }
+        }
+        # The RFQ constraints go into meta data as well, so unicorns that can't satisfy them are filtered out by SNS.
+        message_attributes.update(rfq_filters.create_constraint_message_attributes(LOGGER, rfq_constraints))
+        # Only the invited unicorns' subscriptions let the RFQ through.
+        message_attributes.update(rfq_filters.create_invitation_message_attributes(LOGGER, invited_unicorns))
 
         sns_client = boto3.client("sns")
         response = sns_client.publish(
             TargetArn = topic_arn,
-            # The message body contains just the RFQ details.
-            Message = json.dumps({'default': json.dumps(rfq_details)}),
-            MessageStructure = "json",
-            # Next to correlation ID and return address, other data may also be interesting for message filtering.
-            MessageAttributes = {
-                msg_meta_correlation_id_key: { "DataType": "String", "StringValue": msg_meta_correlation_id_value },
-                msg_meta_return_address_key: { "DataType": "String", "StringValue": msg_meta_return_address_value },
-                "customer-id": { "DataType": "String", "StringValue": customer_id },
-                "from-location": { "DataType": "String", "StringValue": from_location },
-                "to-location": { "DataType": "String", "StringValue": to_location },
-                "timeout_in_secs": { "DataType": "Number", "StringValue": str(timeout_in_secs) }
-            }
+            # The message body contains just the RFQ details. Without a message structure, SNS delivers the message
+            # as is to every protocol, so there is no need to wrap (and encode) the RFQ details once more.
+            Message = rfq.to_json(),
+            MessageAttributes = message_attributes
         )
     except Exception as ex:
         LOGGER.exception("Something went wrong with publishing the RFQ details.")
@@ -168,6 +210,7 @@ def publish_rfq(customer_id, correlation_id, from_location, to_location, submitt
 # Create the self link URL for the new RFQ status resource.
 # ---------------------------------------------------------------------------------------------------------------------
 
+@instrumentation.stage("create_rfq_status_link")
 def create_rfq_status_link(event, customer_id, correlation_id):
 
     LOGGER.debug("Create the self link URL for the new RFQ status resource.")
@@ -202,6 +245,7 @@ def create_rfq_status_link(event, customer_id, correlation_id):
 # Main.
 # ---------------------------------------------------------------------------------------------------------------------
 
+@instrumentation.instrument_handler(LOGGER)
 def lambda_handler(event, context):
 
     # If the environment advises on a specific debug level, set it accordingly.
@@ -210,14 +254,18 @@ def lambda_handler(event, context):
     # Capture the current timestamp as the one where the ride completion was submitted.    
     submitted_at = create_submitted_at()
     # Create a unique correlation ID for this specific ride completion submission.
-    correlation_id = create_correlation_id()
+    correlation_id = create_correlation_id(submitted_at)
+    profiling.annotate_correlation_id(correlation_id)
     # Log environment details.
     log_env_details()
     # Log request details.
     log_event_and_context(event, context)
 
-    # Extract ride details as JSON object.
-    rfq_details = json.loads(event["body"])
+    # Validate the RFQ details before doing anything with them.
+    with instrumentation.stage("validate_request"):
+        rfq_details, violations = request_validation.parse_and_validate(RFQ_VALIDATOR, event.get("body"))
+    if violations:
+        return request_validation.create_bad_request_response(LOGGER, violations)
     # Add additional info also to the original RFQ details.
     rfq_details.update({"submitted-at": submitted_at.isoformat()})
     rfq_details.update({"correlation-id": correlation_id})
@@ -238,12 +286,19 @@ def lambda_handler(event, context):
     LOGGER.debug("timeout_at: %s", timeout_at)
     # Add the concrete timeout timestamp also to the RFQ details.
     rfq_details.update({"timeout-at": timeout_at.isoformat()})
+    # Extract the optional RFQ constraints (max price, required goodies, unicorn class) from RFQ details.
+    rfq_constraints = rfq_filters.extract_rfq_constraints(LOGGER, rfq_details)
+    # From here on, the RFQ details don't change anymore.
+    rfq = value_objects.Rfq.from_fields(rfq_details)
 
     # Persist RFQ details.
-    persist_rfq(customer_id, correlation_id, from_location, to_location, submitted_at, timeout_in_secs, timeout_at, rfq_details)
+    persist_rfq(rfq)
+
+    # Select the unicorns that are invited to the RFQ.
+    invited_unicorns = select_invited_unicorns()
 
     # Publish RFQ details to the RFQ topic.
-    publish_rfq(customer_id, correlation_id, from_location, to_location, submitted_at, timeout_in_secs, timeout_at, rfq_details)
+    publish_rfq(rfq, rfq_constraints, invited_unicorns)
 
     # Prepare self link for the new RFQ status resource.
     rfq_status_link = create_rfq_status_link(event, customer_id, correlation_id)
@@ -7,6 +7,10 @@ import uuid
 import boto3
 from botocore.exceptions import ClientError
 from pprint import pprint
+import unicorn_stats
+import instrumentation
+import profiling
+import value_objects
 
 # ---------------------------------------------------------------------------------------------------------------------
 # "Global variables" - what is the correct term for these things in Python?
@@ -20,6 +24,7 @@ ENV_LOG_LEVEL = "LOG_LEVEL"
 ENV_MSG_META_CORRELATION_ID_KEY = "MSG_META_CORRELATION_ID_KEY"
 
 ENV_RFQ_RESPONSE_TABLE_NAME = "RFQ_RESPONSE_TABLE_NAME"
+ENV_UNICORN_STATS_TABLE_NAME = "UNICORN_STATS_TABLE_NAME"
 
 STR_NONE = "NONE"
 
@@ -91,7 +96,8 @@ def extract_unicorn_id(message_attributes):
 # Store incoming RFQ response.
 # ---------------------------------------------------------------------------------------------------------------------
 
-def store_rfq_response(rfq_response, correlation_id, unicorn_id):
+@instrumentation.stage("store_rfq_response")
+def store_rfq_response(quote, correlation_id, unicorn_id):
     try:
         LOGGER.debug("Store incoming RFQ response.")
         table_name = os.environ.get(ENV_RFQ_RESPONSE_TABLE_NAME)
@@ -104,7 +110,8 @@ def store_rfq_response(rfq_response, correlation_id, unicorn_id):
             Item = {
                 "correlation-id": { "S": correlation_id },
                 "unicorn-id"    : { "S": unicorn_id },
-                "rfq-response"  : { "S": json.dumps(rfq_response) }
+                # Stored as received, there is no need to decode and encode it again.
+                "rfq-response"  : { "S": quote.to_json() }
             }
         )
     except Exception as ex:
@@ -116,10 +123,49 @@ def store_rfq_response(rfq_response, correlation_id, unicorn_id):
         LOGGER.debug("DDB response: %s", response)
         return 1
 
+# ---------------------------------------------------------------------------------------------------------------------
+# Update the statistics of the unicorn with how fast (and in time) it answered the RFQ.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def parse_utc_timestamp(text):
+    # Naive UTC, whether the timestamp comes with an offset, a "Z" (which fromisoformat doesn't take before
+    # Python 3.11) or without any.
+    if text.endswith("Z"):
+        text = text[:-1] + "+00:00"
+    timestamp = datetime.datetime.fromisoformat(text)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+@instrumentation.stage("update_unicorn_stats")
+def update_unicorn_stats(record, quote, unicorn_id):
+    # Unicorns echo the RFQ timestamps in their response, older responses just don't count.
+    if not quote.submitted_at or not quote.timeout_at:
+        LOGGER.debug("RFQ response doesn't carry the RFQ timestamps, skipping unicorn statistics.")
+        return 0
+    try:
+        submitted_at = parse_utc_timestamp(quote.submitted_at)
+        timeout_at = parse_utc_timestamp(quote.timeout_at)
+        # The time SQS accepted the response is the time the unicorn answered, no matter how long it queued.
+        answered_at = datetime.datetime.utcfromtimestamp(int(record["attributes"]["SentTimestamp"]) / 1000)
+    except Exception as ex:
+        # The timestamps come from the unicorn - a response we can't make sense of doesn't count, but it doesn't fail
+        # the batch either (which would store the other responses and count their statistics once more).
+        LOGGER.exception("Something went wrong with the RFQ timestamps of unicorn %s.", unicorn_id)
+        LOGGER.exception(ex)
+        return 0
+    latency_ms = (answered_at - submitted_at).total_seconds() * 1000
+    is_late = answered_at > timeout_at
+    LOGGER.debug("Unicorn %s answered after %d ms (late: %s).", unicorn_id, latency_ms, is_late)
+
+    table_name = os.environ.get(ENV_UNICORN_STATS_TABLE_NAME)
+    return unicorn_stats.record_rfq_response(LOGGER, table_name, unicorn_id, answered_at, latency_ms, is_late)
+
 # ---------------------------------------------------------------------------------------------------------------------
 # Lambda handler.
 # ---------------------------------------------------------------------------------------------------------------------
 
+@instrumentation.instrument_handler(LOGGER)
 def lambda_handler(event, context):
 
     # If the environment advises on a specific debug level, set it accordingly.
@@ -135,16 +181,20 @@ def lambda_handler(event, context):
         count += 1
         LOGGER.debug("Looking into record #%d:", count)
 
-        rfq_response = json.loads(record["body"])
-        LOGGER.debug("rfq_response: %s", rfq_response)
+        # The RFQ response is only decoded once somebody needs one of its fields.
+        quote = value_objects.Quote.from_json(record["body"])
+        LOGGER.debug("quote: %s", quote)
         message_attributes = record["messageAttributes"]
         LOGGER.debug("message_attributes: %s", message_attributes)
         correlation_id = extract_correlation_id(message_attributes)
+        profiling.annotate_correlation_id(correlation_id)
         LOGGER.debug("correlation_id: %s", correlation_id)
         unicorn_id = extract_unicorn_id(message_attributes)
         LOGGER.debug("unicorn_id: %s", unicorn_id)
         
         # Memorize the RFQ response in the RFQ database.
-        store_rfq_response(rfq_response, correlation_id, unicorn_id)
+        store_rfq_response(quote, correlation_id, unicorn_id)
+        # Keep track of the unicorn's responsiveness for selecting unicorns in future RFQs.
+        update_unicorn_stats(record, quote, unicorn_id)
 
 # ---------------------------------------------------------------------------------------------------------------------
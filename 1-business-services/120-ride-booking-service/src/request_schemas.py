@@ -0,0 +1 @@
+../../../lib/request_schemas.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../../lib/request_validation.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../../lib/time_ordered_ids.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../../lib/unicorn_stats.py
\ No newline at end of file
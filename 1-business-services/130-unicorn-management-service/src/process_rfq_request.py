@@ -11,6 +11,9 @@ import random
 import aux
 import aux_processing
 import ride_goodies
+import rfq_filters
+import instrumentation
+import profiling
 
 # ---------------------------------------------------------------------------------------------------------------------
 # Globals.
@@ -24,6 +27,11 @@ ENV_MSG_META_RETURN_ADDRESS_KEY = "MSG_META_RETURN_ADDRESS_KEY"
 
 ENV_UNICORN_ID = "UNICORN_ID"
 
+# Let's assume that 20.00 klebs are the minimum fare and unicorns don't charge more than 99.99 klebs.
+# The minimum fare is also what the subscription filter policies in the template are generated from.
+MIN_FARE = 20.00
+MAX_FARE = 99.99
+
 # ---------------------------------------------------------------------------------------------------------------------
 # Retrieve unicorn ID from environment.
 # ---------------------------------------------------------------------------------------------------------------------
@@ -63,6 +71,7 @@ def extract_return_address(message_attributes):
 # Send RFQ response to RFQ response queue.
 # ---------------------------------------------------------------------------------------------------------------------
 
+@instrumentation.stage("send_rfq_response")
 def send_rfq_response(return_address, correlation_id, unicorn_id, rfq_response):
     LOGGER.debug("Send RFQ response to RFQ response queue.")
     LOGGER.debug("return_address: %s", return_address)
@@ -92,9 +101,13 @@ def send_rfq_response(return_address, correlation_id, unicorn_id, rfq_response):
 # Randomly generate a price for the ride.
 # ---------------------------------------------------------------------------------------------------------------------
 
-def calculate_offered_fare(unicorn_id):
-    # Let's assume that 20.00 klebs are the minimum fare and unicorns don't charge more than 99.99 klebs.
-    fare = round(random.uniform(20.00, 99.99), 2)
+def calculate_offered_fare(unicorn_id, rfq_constraints):
+    # Never offer more than the customer is willing to pay, the subscription filter policy ensures MIN_FARE fits.
+    max_fare = MAX_FARE
+    max_price = rfq_constraints.get(rfq_filters.RFQ_KEY_MAX_PRICE)
+    if max_price is not None:
+        max_fare = max(MIN_FARE, min(MAX_FARE, max_price))
+    fare = round(random.uniform(MIN_FARE, max_fare), 2)
     LOGGER.debug("Calculated fare that %s will offer is %d.", unicorn_id, fare)
     return fare
 
@@ -102,6 +115,7 @@ def calculate_offered_fare(unicorn_id):
 # Lambda handler.
 # ---------------------------------------------------------------------------------------------------------------------
 
+@instrumentation.instrument_handler(LOGGER)
 def lambda_handler(event, context):
 
     # If the environment advises on a specific debug level, set it accordingly.
@@ -111,7 +125,8 @@ def lambda_handler(event, context):
     # Log request details.
     aux.log_event_and_context(LOGGER, event, context)
     # Publish Lambda event to the respective event logging topic.
-    aux_processing.publish_sns_lambda_event(LOGGER, event)
+    with instrumentation.stage("publish_lambda_event"):
+        aux_processing.publish_sns_lambda_event(LOGGER, event)
 
     # Retrieve unicorn ID from environment.
     unicorn_id = retrieve_unicorn_id()
@@ -145,6 +160,7 @@ def lambda_handler(event, context):
 
         # Extract correlation ID from message meta data.
         correlation_id = extract_correlation_id(message_attributes)
+        profiling.annotate_correlation_id(correlation_id)
         LOGGER.debug("correlation_id: %s", correlation_id)
         # Extract customer ID from RFQ.
         customer_id = rfq_details["customer-id"]
@@ -153,10 +169,14 @@ def lambda_handler(event, context):
         return_address = extract_return_address(message_attributes)
         LOGGER.debug("return_address: %s", return_address)
         
+        # Extract the optional RFQ constraints that made it through the subscription filter policy.
+        rfq_constraints = rfq_filters.extract_rfq_constraints(LOGGER, rfq_details)
+
         # Calculate the fare for the offer.
-        offered_fare = calculate_offered_fare(unicorn_id)
-        # Calculate goodies for the offer.
-        offered_goodies = ride_goodies.calculate_offered_goodies(LOGGER, unicorn_id)
+        offered_fare = calculate_offered_fare(unicorn_id, rfq_constraints)
+        # Calculate goodies for the offer, always including the ones the customer requires.
+        offered_goodies = set(ride_goodies.calculate_offered_goodies(LOGGER, unicorn_id))
+        offered_goodies.update(rfq_constraints[rfq_filters.RFQ_KEY_REQUIRED_GOODIES])
 
         # Create a random RFQ response.
         rfq_response = {
@@ -165,7 +185,10 @@ def lambda_handler(event, context):
             # "price": 2.95,
             # "goodies": [ "FREE_DRINKS_NON_ALC", "FREE_DRINKS_ALC" ]
             "price": offered_fare,
-            "goodies": list(offered_goodies)
+            "goodies": list(offered_goodies),
+            # Echo the RFQ timestamps, so the ride booking service can tell how fast we answered.
+            "submitted-at": rfq_details.get("submitted-at"),
+            "timeout-at": rfq_details.get("timeout-at")
         }        
         LOGGER.debug("rfq_response: %s", rfq_response)
 
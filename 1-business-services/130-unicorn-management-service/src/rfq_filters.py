@@ -0,0 +1 @@
+../../../lib/rfq_filters.py
\ No newline at end of file
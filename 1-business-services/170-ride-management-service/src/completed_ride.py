@@ -1 +0,0 @@
-../../../lib/completed_ride.py
\ No newline at end of file
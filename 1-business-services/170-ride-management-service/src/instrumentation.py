@@ -0,0 +1 @@
+../../../lib/instrumentation.py
\ No newline at end of file
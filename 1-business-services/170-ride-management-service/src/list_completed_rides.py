@@ -0,0 +1,209 @@
+import os
+import sys
+import logging
+import json
+import datetime
+import urllib.parse
+import boto3
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from pprint import pprint
+import aux
+import aux_api
+import pagination
+import instrumentation
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Globals.
+# ---------------------------------------------------------------------------------------------------------------------
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+
+ENV_RIDES_STORE_TABLE_NAME = "RIDES_STORE_TABLE_NAME"
+
+QSP_CUSTOMER_ID = "customer-id"
+QSP_FROM = "from"
+QSP_TO = "to"
+QSP_DESCENDING = "descending"
+
+# Only the summary of each ride goes into the list, the full ride details are available via the ride resource.
+RIDE_SUMMARY_ATTRIBUTES = ["customer-id", "submitted-at", "unicorn-id", "ride-id", "fare", "distance"]
+RIDES_STORE_TABLE_KEYS = ["customer-id", "submitted-at"]
+
+BAD_REQUEST_NO_CUSTOMER_ID = "Query string parameter 'customer-id' is required."
+BAD_REQUEST_INVALID_PARAMETERS = "Query string parameters are invalid."
+INTERNAL_SERVER_ERROR_QUERY_FAILED = "Completed rides couldn't be queried, please retry."
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Extract the sort order from the query string parameters.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def extract_descending(query_string_parameters):
+    value = query_string_parameters.get(QSP_DESCENDING, "false").lower()
+    if value not in ("true", "false"):
+        raise ValueError("'" + QSP_DESCENDING + "' must be 'true' or 'false'.")
+    return value == "true"
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Query one page of completed rides of a customer - exactly one DynamoDB query per page.
+# ---------------------------------------------------------------------------------------------------------------------
+
+@instrumentation.stage("query_completed_rides")
+def query_completed_rides(customer_id, from_timestamp, to_timestamp, descending, limit, exclusive_start_key):
+    LOGGER.debug("Query completed rides from the database.")
+    table_name = os.environ.get(ENV_RIDES_STORE_TABLE_NAME)
+    LOGGER.debug("table_name: %s", table_name)
+
+    # The sort key holds ISO 8601 timestamps, which compare just fine as strings.
+    key_condition = Key("customer-id").eq(customer_id)
+    if from_timestamp is not None and to_timestamp is not None:
+        key_condition = key_condition & Key("submitted-at").between(from_timestamp.isoformat(), to_timestamp.isoformat())
+    elif from_timestamp is not None:
+        key_condition = key_condition & Key("submitted-at").gte(from_timestamp.isoformat())
+    elif to_timestamp is not None:
+        key_condition = key_condition & Key("submitted-at").lte(to_timestamp.isoformat())
+
+    query_args = {
+        "KeyConditionExpression": key_condition,
+        "ProjectionExpression": ", ".join("#a" + str(index) for index in range(len(RIDE_SUMMARY_ATTRIBUTES))),
+        "ExpressionAttributeNames": { "#a" + str(index): name for index, name in enumerate(RIDE_SUMMARY_ATTRIBUTES) },
+        "ScanIndexForward": not descending,
+        "Limit": limit
+    }
+    if exclusive_start_key is not None:
+        query_args["ExclusiveStartKey"] = exclusive_start_key
+
+    dynamodb = boto3.resource("dynamodb")
+    table = dynamodb.Table(table_name)
+    response = table.query(**query_args)
+    LOGGER.debug("Completed rides successfully queried.")
+    LOGGER.debug("response: %s", response)
+    return response["Items"], response.get("LastEvaluatedKey")
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Create links for the list resource and its entries.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def create_link_base_url(event):
+    link_protocol = event["headers"]["X-Forwarded-Proto"]
+    LOGGER.debug("link_protocol: %s", link_protocol)
+
+    link_host = event["headers"]["Host"]
+    LOGGER.debug("link_host: %s", link_host)
+
+    link_stage = event["requestContext"]["stage"]
+    LOGGER.debug("link_stage: %s", link_stage)
+
+    link_base_url = link_protocol + "://" + link_host
+
+    request_context_path = event["requestContext"]["path"]
+    if request_context_path.startswith("/" + link_stage):
+        # We need to include the stage in constructed resource URLs.
+        link_base_url += "/" + link_stage
+
+    link_base_url += "/api/user"
+    LOGGER.debug("link_base_url: %s", link_base_url)
+    return link_base_url
+
+def create_list_link(link_base_url, query_string_parameters, cursor):
+    parameters = dict(query_string_parameters)
+    parameters.pop(pagination.QSP_CURSOR, None)
+    if cursor is not None:
+        parameters[pagination.QSP_CURSOR] = cursor
+    return link_base_url + "/list-completed-rides?" + urllib.parse.urlencode(parameters)
+
+def create_completed_ride_link(link_base_url, ride):
+    return link_base_url + "/retrieve-completed-ride?" + urllib.parse.urlencode({
+        "unicorn-id": ride.get("unicorn-id", aux.STR_NONE),
+        "customer-id": ride["customer-id"],
+        "submitted-at": ride["submitted-at"]
+    })
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Respond to a query that failed - throttled, for instance.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def create_query_failed_response():
+    return {
+        "statusCode": 500,
+        "body": json.dumps({ "error-message": INTERNAL_SERVER_ERROR_QUERY_FAILED }),
+        "headers": {
+            "Content-Type": "application/json"
+        }
+    }
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Lambda handler.
+# ---------------------------------------------------------------------------------------------------------------------
+
+@instrumentation.instrument_handler(LOGGER)
+def lambda_handler(event, context):
+
+    # If the environment advises on a specific debug level, set it accordingly.
+    aux.update_log_level(LOGGER, event, context)
+    # Log environment details.
+    aux.log_env_details(LOGGER)
+    # Log request details.
+    aux.log_event_and_context(LOGGER, event, context)
+    # Publish Lambda event to the respective event logging topic.
+    with instrumentation.stage("publish_lambda_event"):
+        aux_api.publish_apigw_lambda_event(LOGGER, event)
+
+    # Extract and check the query string parameters.
+    query_string_parameters = event.get("queryStringParameters") or {}
+    customer_id = query_string_parameters.get(QSP_CUSTOMER_ID)
+    LOGGER.debug("customer_id: %s", customer_id)
+    if not customer_id:
+        return aux_api.bad_request(LOGGER, event, BAD_REQUEST_NO_CUSTOMER_ID, None)
+    try:
+        from_timestamp = pagination.extract_timestamp(query_string_parameters, QSP_FROM)
+        LOGGER.debug("from_timestamp: %s", from_timestamp)
+        to_timestamp = pagination.extract_timestamp(query_string_parameters, QSP_TO)
+        LOGGER.debug("to_timestamp: %s", to_timestamp)
+        # DynamoDB rejects a range whose lower bound is above its upper bound.
+        if from_timestamp is not None and to_timestamp is not None and from_timestamp > to_timestamp:
+            raise ValueError("'" + QSP_FROM + "' must not be after '" + QSP_TO + "'.")
+        descending = extract_descending(query_string_parameters)
+        LOGGER.debug("descending: %s", descending)
+        limit = pagination.extract_limit(query_string_parameters)
+        LOGGER.debug("limit: %d", limit)
+        exclusive_start_key = pagination.decode_cursor(query_string_parameters.get(pagination.QSP_CURSOR), RIDES_STORE_TABLE_KEYS)
+        LOGGER.debug("exclusive_start_key: %s", exclusive_start_key)
+        if exclusive_start_key is not None and exclusive_start_key["customer-id"] != customer_id:
+            raise ValueError("Cursor doesn't belong to this customer.")
+    except ValueError as ex:
+        LOGGER.exception(BAD_REQUEST_INVALID_PARAMETERS)
+        return aux_api.bad_request(LOGGER, event, BAD_REQUEST_INVALID_PARAMETERS, ex)
+
+    # Query one page of completed rides.
+    try:
+        rides, last_evaluated_key = query_completed_rides(customer_id, from_timestamp, to_timestamp, descending, limit, exclusive_start_key)
+    except ClientError as ex:
+        LOGGER.exception("Something went wrong with querying the completed rides.")
+        LOGGER.exception(ex)
+        return create_query_failed_response()
+
+    # Create the resource representation with links to each ride and to the next page.
+    link_base_url = create_link_base_url(event)
+    for ride in rides:
+        ride["links"] = { "self": create_completed_ride_link(link_base_url, ride) }
+    links = { "self": create_list_link(link_base_url, query_string_parameters, query_string_parameters.get(pagination.QSP_CURSOR)) }
+    cursor = pagination.encode_cursor(last_evaluated_key)
+    if cursor is not None:
+        links["next"] = create_list_link(link_base_url, query_string_parameters, cursor)
+
+    data = {
+        "links": links,
+        "rides": pagination.convert_decimals(rides)
+    }
+
+    return {
+        "statusCode": 200,
+        "body": json.dumps(data),
+        "headers": {
+            "Content-Type": "application/json"
+        }
+    }
+
+# ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1 @@
+../../../lib/log_shipper.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../../lib/outbox.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../../lib/pagination.py
\ No newline at end of file
@@ -7,6 +7,8 @@ import uuid
 import boto3
 from botocore.exceptions import ClientError
 from pprint import pprint
+import instrumentation
+import profiling
 
 # ---------------------------------------------------------------------------------------------------------------------
 # "Global variables" - what is the correct term for these things in Python?
@@ -101,6 +103,7 @@ def extract_return_address(message_attributes):
 # Send RFQ response to RFQ response queue.
 # ---------------------------------------------------------------------------------------------------------------------
 
+@instrumentation.stage("send_rfq_response")
 def send_rfq_response(return_address, correlation_id, unicorn_id, rfq_response):
     LOGGER.debug("Send RFQ response to RFQ response queue.")
     LOGGER.debug("return_address: %s", return_address)
@@ -130,6 +133,7 @@ def send_rfq_response(return_address, correlation_id, unicorn_id, rfq_response):
 # Main.
 # ---------------------------------------------------------------------------------------------------------------------
 
+@instrumentation.instrument_handler(LOGGER)
 def lambda_handler(event, context):
 
     # If the environment advises on a specific debug level, set it accordingly.
@@ -172,6 +176,7 @@ def lambda_handler(event, context):
 
         # Extract correlation ID from message meta data.
         correlation_id = extract_correlation_id(message_attributes)
+        profiling.annotate_correlation_id(correlation_id)
         LOGGER.debug("correlation_id: %s", correlation_id)
         # Extract customer ID from RFQ.
         customer_id = rfq_details["customer-id"]
@@ -0,0 +1,144 @@
+import os
+import sys
+import logging
+import json
+import datetime
+import boto3
+from botocore.exceptions import ClientError
+from pprint import pprint
+import aux
+import outbox
+import value_objects
+import metrics
+import instrumentation
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Globals.
+# ---------------------------------------------------------------------------------------------------------------------
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+
+ENV_RIDES_STORE_TABLE_NAME = "RIDES_STORE_TABLE_NAME"
+ENV_RIDE_COMPLETION_TOPIC_ARN = "RIDE_COMPLETION_TOPIC_ARN"
+ENV_RIDE_COMPLETION_TOPIC_NAME = "RIDE_COMPLETION_TOPIC_NAME"
+ENV_OUTBOX_MAX_RIDES_PER_SWEEP = "OUTBOX_MAX_RIDES_PER_SWEEP"
+
+# SNS PublishBatch takes up to 10 messages per call.
+MAX_MESSAGES_PER_BATCH = 10
+DEFAULT_MAX_RIDES_PER_SWEEP = 1000
+# Stop picking up new batches when the invocation is about to time out, the next sweep carries on.
+MIN_REMAINING_MILLIS = 2000
+
+METRIC_RIDES_PUBLISHED = "Rides published"
+METRIC_RIDE_PUBLISH_FAILURES = "Ride publish failures"
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Create the SNS batch entry for a pending ride.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def create_batch_entry(entry_id, completed_ride):
+    return {
+        "Id": entry_id,
+        # The message body contains just the ride details, as they were persisted.
+        "Message": completed_ride.to_json(),
+        # Certain data from the ride details could be interesting for message filtering, hence go into meta data.
+        "MessageAttributes": {
+            "unicorn-id": { "DataType": "String", "StringValue": completed_ride.get_unicorn_id() },
+            "customer-id": { "DataType": "String", "StringValue": completed_ride.get_customer_id() },
+            "fare": { "DataType": "Number", "StringValue": completed_ride.get_fare_as_string() },
+            "distance": { "DataType": "Number", "StringValue": completed_ride.get_distance_as_string() },
+            "correlation-id": { "DataType": "String", "StringValue": completed_ride.get_correlation_id() }
+        }
+    }
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Publish a batch of pending rides to the ride completion topic and settle their outbox markers.
+# ---------------------------------------------------------------------------------------------------------------------
+
+@instrumentation.stage("publish_batch")
+def publish_batch(sns_client, ddb_client, table_name, topic_arn, items, now):
+    entries = {}
+    for index, item in enumerate(items):
+        completed_ride = value_objects.CompletedRide.from_json(item["ride-details"]["S"])
+        entries[str(index)] = (item, create_batch_entry(str(index), completed_ride))
+
+    try:
+        response = sns_client.publish_batch(
+            TopicArn = topic_arn,
+            PublishBatchRequestEntries = [ entry for _, entry in entries.values() ]
+        )
+        failed_ids = set(failed["Id"] for failed in response.get("Failed", []))
+        for failed in response.get("Failed", []):
+            LOGGER.warning("Publishing ride failed: %s", failed)
+    except Exception as ex:
+        LOGGER.exception("Something went wrong with publishing the ride details.")
+        LOGGER.exception(ex)
+        failed_ids = set(entries.keys())
+
+    published = 0
+    for entry_id, (item, _) in entries.items():
+        key = { "customer-id": item["customer-id"], "submitted-at": item["submitted-at"] }
+        try:
+            if entry_id in failed_ids:
+                outbox.mark_failed_attempt(LOGGER, ddb_client, table_name, key, item, now)
+            else:
+                outbox.mark_published(LOGGER, ddb_client, table_name, key, item, now)
+                published += 1
+        except Exception as ex:
+            # The marker stays as it is, so the ride is picked up again by the next sweep.
+            LOGGER.exception("Something went wrong with settling the outbox marker of ride %s.", key)
+            LOGGER.exception(ex)
+    metrics.add_count(METRIC_RIDES_PUBLISHED, published)
+    metrics.add_count(METRIC_RIDE_PUBLISH_FAILURES, len(failed_ids))
+    return published
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Sweep the outbox: publish the due rides of all shards in batches.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def sweep(context):
+    table_name = os.environ.get(ENV_RIDES_STORE_TABLE_NAME)
+    LOGGER.debug("table_name: %s", table_name)
+    topic_arn = os.environ.get(ENV_RIDE_COMPLETION_TOPIC_ARN, aux.STR_NONE)
+    LOGGER.debug("topic_arn: %s", topic_arn)
+    max_rides = int(os.environ.get(ENV_OUTBOX_MAX_RIDES_PER_SWEEP, DEFAULT_MAX_RIDES_PER_SWEEP))
+
+    ddb_client = boto3.client("dynamodb")
+    sns_client = boto3.client("sns")
+    now = datetime.datetime.utcnow()
+    swept = 0
+    published = 0
+    for shard in range(outbox.get_shards()):
+        with instrumentation.stage("query_due_items"):
+            items = outbox.query_due_items(LOGGER, ddb_client, table_name, shard, now, max_rides - swept)
+        for start in range(0, len(items), MAX_MESSAGES_PER_BATCH):
+            if context is not None and context.get_remaining_time_in_millis() < MIN_REMAINING_MILLIS:
+                LOGGER.warning("Running out of time, leaving the remaining rides to the next sweep.")
+                return swept, published
+            batch = items[start:start + MAX_MESSAGES_PER_BATCH]
+            published += publish_batch(sns_client, ddb_client, table_name, topic_arn, batch, now)
+            swept += len(batch)
+        if swept >= max_rides:
+            break
+    return swept, published
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Lambda handler.
+# ---------------------------------------------------------------------------------------------------------------------
+
+@instrumentation.instrument_handler(LOGGER)
+def lambda_handler(event, context):
+
+    # If the environment advises on a specific debug level, set it accordingly.
+    aux.update_log_level(LOGGER, event, context)
+    # Log environment details.
+    aux.log_env_details(LOGGER)
+    # Log request details.
+    aux.log_event_and_context(LOGGER, event, context)
+
+    swept, published = sweep(context)
+    LOGGER.info("Swept %d pending rides, %d of them published.", swept, published)
+    return { "swept": swept, "published": published }
+
+# ---------------------------------------------------------------------------------------------------------------------
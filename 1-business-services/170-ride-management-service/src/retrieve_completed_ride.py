@@ -11,6 +11,10 @@ from botocore.exceptions import ClientError
 from pprint import pprint
 import aux
 import aux_api
+import read_through_cache
+import log_shipper
+import metrics
+import instrumentation
 
 # ---------------------------------------------------------------------------------------------------------------------
 # "Global variables" - what is the correct term for these things in Python?
@@ -21,6 +25,9 @@ ENV_WORKLOAD = "WORKLOAD"
 ENV_SERVICE = "SERVICE"
 ENV_LOG_LEVEL = "LOG_LEVEL"
 ENV_RIDES_STORE_TABLE_NAME = "RIDES_STORE_TABLE_NAME"
+ENV_FULL_REQUEST_LOG_GROUP_NAME = "FULL_REQUEST_LOG_GROUP_NAME"
+ENV_RIDE_CACHE_MAX_ENTRIES = "RIDE_CACHE_MAX_ENTRIES"
+ENV_RIDE_CACHE_NEGATIVE_TTL_SECS = "RIDE_CACHE_NEGATIVE_TTL_SECS"
 
 STR_NONE = "NONE"
 
@@ -63,66 +70,26 @@ def log_event_and_context(event, context):
     LOGGER.debug("context: %s", context)
 
 # ---------------------------------------------------------------------------------------------------------------------
-# Retrieve the current timestamp.
+# Update metric for requests per customer.
 # ---------------------------------------------------------------------------------------------------------------------
 
-def get_current_date():
-    current_date = datetime.date.today().isoformat()
-    LOGGER.debug("current_date: %s", current_date)
-    return current_date
+def update_metric_for_requests_per_customer(customer_id):
+    # Customer IDs don't make for a sane metric dimension, they go into the (opt-in) top customers report instead.
+    metrics.add_count("Completed ride retrievals")
+    metrics.track_customer(customer_id)
 
 # ---------------------------------------------------------------------------------------------------------------------
-# Update metric for requests per customer.
+# Log full request - buffered and shipped in the background, see log_shipper.
 # ---------------------------------------------------------------------------------------------------------------------
 
-def update_metric_for_requests_per_customer(customer_id):
-    cloudwatch = boto3.client("cloudwatch")
-    response = cloudwatch.put_metric_data(
-        # MetricData = [{
-        #     "MetricName": "KPIs",
-        #     "Dimensions": [{
-        #         "Name": "customer-id",
-        #         "Value": customer_id
-        #     }, {
-        #         "Name": "unicorn-id",
-        #         "Value": unicorn_id
-        #     }],
-        #     "Unit": "None",
-        #     "Value": random.randint(1, 500)
-        # }],
-        MetricData = [{
-            "MetricName": "Completed ride retrievals per customer",
-            "Dimensions": [{
-                "Name": "customer-id",
-                "Value": customer_id
-            }],
-            "Unit": "Count",
-            "Value": 1
-        }],
-        Namespace = "Wild Rydes"
-    )
-    LOGGER.debug("CW response: %s", response)
-
-def get_or_create_log_stream(cw_logs, log_group_name, log_stream_name):
-    
-    response = cw_logs.describe_log_streams(
-        logGroupName = log_group_name,
-        logStreamNamePrefix = log_stream_name,
-        orderBy = "LogStreamName",
-        descending = True,
-        nextToken = 'string',
-        limit = 5
-    )
+FULL_REQUEST_LOG_SHIPPER = log_shipper.LogShipper(
+    LOGGER,
+    os.environ.get(ENV_FULL_REQUEST_LOG_GROUP_NAME, "FULL-REQUESTS"),
+    "FULL-REQUESTS"
+)
 
+@instrumentation.stage("log_full_request")
 def log_full_request(event):
-    
-    current_date = get_current_date()
-    cw_logs = boto3.client('logs')
-    LOG_GROUP = "FULL-REQUESTS"
-    LOG_STREAM = LOG_GROUP + "_" + current_date
-    #cw_logs.create_log_group(logGroupName=LOG_GROUP)
-    cw_logs.create_log_stream(logGroupName=LOG_GROUP, logStreamName=LOG_STREAM)
-    timestamp = int(round(time.time() * 1000))
 
     data = {
         "protocol": event["headers"]["X-Forwarded-Proto"],
@@ -131,46 +98,62 @@ def log_full_request(event):
         "query-string-parameters": event["queryStringParameters"]
     }
 
-    response = cw_logs.put_log_events(
-    logGroupName=LOG_GROUP,
-    logStreamName=LOG_STREAM,
-    logEvents=[
-        {
-            "timestamp": timestamp,
-            "message": time.strftime('%Y-%m-%d %H:%M:%S') + "\t" + json.dumps(data)
-        }
-    ])    
+    FULL_REQUEST_LOG_SHIPPER.append(time.strftime('%Y-%m-%d %H:%M:%S') + "\t" + json.dumps(data))
 
 # ---------------------------------------------------------------------------------------------------------------------
-# Fetch ride details from the database.
+# Fetch ride details from the database, through the per-container cache.
 # ---------------------------------------------------------------------------------------------------------------------
 
+def load_ride_details(key):
+    customer_id, submitted_at = key
+    LOGGER.debug("Fetch ride details from the database.")
+    table_name = os.environ.get(ENV_RIDES_STORE_TABLE_NAME)
+    LOGGER.debug("table_name: %s", table_name)
+
+    dynamodb = boto3.resource("dynamodb")
+    table = dynamodb.Table(table_name)
+    response = table.get_item(Key = { "customer-id": customer_id, "submitted-at": submitted_at })
+
+    LOGGER.debug("Ride details successfully fetched.")
+    LOGGER.debug("response: %s", response)
+    full_item = response.get("Item")
+    if full_item is None:
+        return None
+    LOGGER.debug("full_item: %s", full_item)
+    ride_details = full_item["ride-details"]
+    LOGGER.debug("ride_details: %s", ride_details)
+    return json.loads(ride_details)
+
+# Completed rides never change once they are persisted, so we keep them around for the lifetime of the container.
+RIDE_DETAILS_CACHE = read_through_cache.ReadThroughCache(
+    load_ride_details,
+    max_entries = int(os.environ.get(ENV_RIDE_CACHE_MAX_ENTRIES, read_through_cache.DEFAULT_MAX_ENTRIES)),
+    negative_ttl_secs = int(os.environ.get(ENV_RIDE_CACHE_NEGATIVE_TTL_SECS, read_through_cache.DEFAULT_NEGATIVE_TTL_SECS))
+)
+
+@instrumentation.stage("fetch_ride_details")
 def fetch_ride_details(unicorn_id, customer_id, submitted_at):
     try:
-        LOGGER.debug("Fetch ride details from the database.")
-        table_name = os.environ.get(ENV_RIDES_STORE_TABLE_NAME)
-        LOGGER.debug("table_name: %s", table_name)
-
-        dynamodb = boto3.resource("dynamodb")
-        table = dynamodb.Table(table_name)
-        response = table.get_item(Key = { "customer-id": customer_id, "submitted-at": submitted_at })
-
-        LOGGER.debug("Ride details successfully fetched.")
-        LOGGER.debug("response: %s", response)
-        full_item = response["Item"]
-        LOGGER.debug("full_item: %s", full_item)
-        ride_details = full_item["ride-details"]
-        LOGGER.debug("ride_details: %s", ride_details)
-        return json.loads(ride_details)
+        ride_details = RIDE_DETAILS_CACHE.get(LOGGER, (customer_id, submitted_at))
+        return STR_NONE if ride_details is None else ride_details
     except Exception as ex:
         LOGGER.exception("Something went wrong with fetching the ride details.")
         LOGGER.exception(ex)
         return STR_NONE
 
+# ---------------------------------------------------------------------------------------------------------------------
+# Update metric for cache hits and misses.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def update_metric_for_cache_lookups():
+    for outcome, count in RIDE_DETAILS_CACHE.take_counters().items():
+        metrics.add_count("Completed ride cache lookups", count, { "outcome": outcome })
+
 # ---------------------------------------------------------------------------------------------------------------------
 # Use meta information from incoming request to construct the self link for the resource representation.
 # ---------------------------------------------------------------------------------------------------------------------
 
+@instrumentation.stage("create_self_link_url")
 def create_self_link_url(event, unicorn_id, customer_id, submitted_at):
 
     link_protocol = event["headers"]["X-Forwarded-Proto"]
@@ -197,6 +180,7 @@ def create_self_link_url(event, unicorn_id, customer_id, submitted_at):
 # Lambda handler.
 # ---------------------------------------------------------------------------------------------------------------------
 
+@instrumentation.instrument_handler(LOGGER)
 def lambda_handler(event, context):
 
     # If the environment advises on a specific debug level, set it accordingly.
@@ -206,7 +190,8 @@ def lambda_handler(event, context):
     # Log request details.
     aux.log_event_and_context(LOGGER, event, context)
     # Publish Lambda event to the respective event logging topic.
-    aux_api.publish_apigw_lambda_event(LOGGER, event)
+    with instrumentation.stage("publish_lambda_event"):
+        aux_api.publish_apigw_lambda_event(LOGGER, event)
 
     # Extract unicorn ID from request query parameter.
     unicorn_id = event["queryStringParameters"]["unicorn-id"]
@@ -215,15 +200,17 @@ def lambda_handler(event, context):
     customer_id = event["queryStringParameters"]["customer-id"]
     LOGGER.debug("customer_id: %s", customer_id)
     # Update metric for customer ID.
-    #update_metric_for_requests_per_customer(customer_id)
+    update_metric_for_requests_per_customer(customer_id)
     # Log full request.
-    #log_full_request(event)
+    log_full_request(event)
     # Extract submitted-at from request query parameter.
     submitted_at = event["queryStringParameters"]["submitted-at"]
     LOGGER.debug("submitted_at: %s", submitted_at)
     
     # Fetch ride details from database.
     ride_details = fetch_ride_details(unicorn_id, customer_id, submitted_at)
+    # Update metric for cache hits and misses.
+    update_metric_for_cache_lookups()
 
     # Create self link for the resource representation.
     self_link_url = create_self_link_url(event, unicorn_id, customer_id, submitted_at)
@@ -0,0 +1,206 @@
+import os
+import sys
+import logging
+import json
+import datetime
+import random
+import time
+import urllib.parse
+import boto3
+from botocore.exceptions import ClientError
+from pprint import pprint
+import aux
+import aux_api
+import pagination
+import metrics
+import instrumentation
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Globals.
+# ---------------------------------------------------------------------------------------------------------------------
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+
+ENV_RIDES_STORE_TABLE_NAME = "RIDES_STORE_TABLE_NAME"
+
+# BatchGetItem accepts up to 100 keys per call, which is also what we accept per request.
+MAX_KEYS_PER_REQUEST = 100
+
+# Retry schedule for keys DynamoDB didn't process (e.g. due to throttling): exponential backoff with full jitter.
+MAX_BATCH_GET_ATTEMPTS = 5
+BACKOFF_BASE_SECS = 0.05
+BACKOFF_MAX_SECS = 1.0
+
+BAD_REQUEST_INVALID_KEYS = "Body must be a JSON object with a 'keys' list of 1 to 100 objects with 'customer-id' and 'submitted-at'."
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Extract the (customer-id, submitted-at) keys from the request body.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def extract_ride_keys(body):
+    request = json.loads(body)
+    keys = request["keys"] if isinstance(request, dict) else None
+    if not isinstance(keys, list) or not 1 <= len(keys) <= MAX_KEYS_PER_REQUEST:
+        raise ValueError("Expected 1 to " + str(MAX_KEYS_PER_REQUEST) + " keys.")
+
+    # BatchGetItem refuses duplicate keys, so we only ask once for each ride.
+    ride_keys = []
+    seen = set()
+    for key in keys:
+        if not isinstance(key, dict) or not isinstance(key.get("customer-id"), str) or not isinstance(key.get("submitted-at"), str):
+            raise ValueError("Each key needs a 'customer-id' and a 'submitted-at' string.")
+        ride_key = (key["customer-id"], key["submitted-at"])
+        if ride_key not in seen:
+            seen.add(ride_key)
+            ride_keys.append(ride_key)
+    LOGGER.debug("ride_keys: %s", ride_keys)
+    return ride_keys
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Fetch the rides with BatchGetItem, retrying unprocessed keys with backoff.
+# ---------------------------------------------------------------------------------------------------------------------
+
+@instrumentation.stage("fetch_rides")
+def fetch_rides(ride_keys):
+    LOGGER.debug("Fetch ride details from the database.")
+    table_name = os.environ.get(ENV_RIDES_STORE_TABLE_NAME)
+    LOGGER.debug("table_name: %s", table_name)
+
+    dynamodb = boto3.resource("dynamodb")
+    request_items = {
+        table_name: {
+            "Keys": [ { "customer-id": customer_id, "submitted-at": submitted_at } for customer_id, submitted_at in ride_keys ]
+        }
+    }
+    items = []
+    attempt = 0
+    while request_items:
+        attempt += 1
+        response = dynamodb.batch_get_item(RequestItems = request_items)
+        items.extend(response["Responses"].get(table_name, []))
+        request_items = response.get("UnprocessedKeys") or {}
+        LOGGER.debug("Attempt #%d fetched %d items so far, %d keys unprocessed.",
+            attempt, len(items), len(request_items.get(table_name, {}).get("Keys", [])))
+        if request_items:
+            if attempt >= MAX_BATCH_GET_ATTEMPTS:
+                LOGGER.error("Giving up on unprocessed keys after %d attempts.", attempt)
+                break
+            time.sleep(random.uniform(0, min(BACKOFF_MAX_SECS, BACKOFF_BASE_SECS * (2 ** attempt))))
+
+    unprocessed_keys = [
+        (key["customer-id"], key["submitted-at"]) for key in request_items.get(table_name, {}).get("Keys", [])
+    ]
+    return items, unprocessed_keys
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Update metric for requests per customer.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def update_metric_for_requests_per_customer(ride_keys):
+    # Customer IDs don't make for a sane metric dimension, they go into the (opt-in) top customers report instead.
+    metrics.add_count("Completed ride retrievals", len(ride_keys))
+    for customer_id, submitted_at in ride_keys:
+        metrics.track_customer(customer_id)
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Create the links to the single completed ride resources.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def create_link_base_url(event):
+    link_protocol = event["headers"]["X-Forwarded-Proto"]
+    LOGGER.debug("link_protocol: %s", link_protocol)
+
+    link_host = event["headers"]["Host"]
+    LOGGER.debug("link_host: %s", link_host)
+
+    link_stage = event["requestContext"]["stage"]
+    LOGGER.debug("link_stage: %s", link_stage)
+
+    link_base_url = link_protocol + "://" + link_host
+
+    request_context_path = event["requestContext"]["path"]
+    if request_context_path.startswith("/" + link_stage):
+        # We need to include the stage in constructed resource URLs.
+        link_base_url += "/" + link_stage
+
+    link_base_url += "/api/user"
+    LOGGER.debug("link_base_url: %s", link_base_url)
+    return link_base_url
+
+def create_completed_ride_link(link_base_url, unicorn_id, customer_id, submitted_at):
+    return link_base_url + "/retrieve-completed-ride?" + urllib.parse.urlencode({
+        "unicorn-id": unicorn_id,
+        "customer-id": customer_id,
+        "submitted-at": submitted_at
+    })
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Lambda handler.
+# ---------------------------------------------------------------------------------------------------------------------
+
+@instrumentation.instrument_handler(LOGGER)
+def lambda_handler(event, context):
+
+    # If the environment advises on a specific debug level, set it accordingly.
+    aux.update_log_level(LOGGER, event, context)
+    # Log environment details.
+    aux.log_env_details(LOGGER)
+    # Log request details.
+    aux.log_event_and_context(LOGGER, event, context)
+    # Publish Lambda event to the respective event logging topic.
+    with instrumentation.stage("publish_lambda_event"):
+        aux_api.publish_apigw_lambda_event(LOGGER, event)
+
+    # Extract the keys of the rides to retrieve.
+    try:
+        ride_keys = extract_ride_keys(event[aux.EK_BODY])
+    except Exception as ex:
+        LOGGER.exception(BAD_REQUEST_INVALID_KEYS)
+        LOGGER.exception(ex)
+        return aux_api.bad_request(LOGGER, event, BAD_REQUEST_INVALID_KEYS, ex)
+
+    # Update metric for customer IDs.
+    update_metric_for_requests_per_customer(ride_keys)
+
+    # Fetch ride details from database.
+    items, unprocessed_keys = fetch_rides(ride_keys)
+
+    link_base_url = create_link_base_url(event)
+    rides = []
+    found_keys = set()
+    for item in items:
+        found_keys.add((item["customer-id"], item["submitted-at"]))
+        unicorn_id = item.get("unicorn-id", aux.STR_NONE)
+        rides.append({
+            "links": {
+                "self": create_completed_ride_link(link_base_url, unicorn_id, item["customer-id"], item["submitted-at"])
+            },
+            "unicorn-id": unicorn_id,
+            "customer-id": item["customer-id"],
+            "submitted-at": item["submitted-at"],
+            "ride-details": json.loads(item["ride-details"])
+        })
+    # Keys we didn't get an answer for are reported separately, the client may simply ask for them again.
+    unprocessed = set(unprocessed_keys)
+    missing_keys = [
+        { "customer-id": customer_id, "submitted-at": submitted_at }
+        for customer_id, submitted_at in ride_keys
+        if (customer_id, submitted_at) not in found_keys and (customer_id, submitted_at) not in unprocessed
+    ]
+
+    data = {
+        "rides": pagination.convert_decimals(rides),
+        "missing-keys": missing_keys,
+        "unprocessed-keys": [ { "customer-id": customer_id, "submitted-at": submitted_at } for customer_id, submitted_at in unprocessed_keys ]
+    }
+
+    return {
+        "statusCode": 200,
+        "body": json.dumps(data),
+        "headers": {
+            "Content-Type": "application/json"
+        }
+    }
+
+# ---------------------------------------------------------------------------------------------------------------------
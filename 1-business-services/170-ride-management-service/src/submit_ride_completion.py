@@ -9,7 +9,14 @@ from botocore.exceptions import ClientError
 from pprint import pprint
 import aux
 import aux_api
-from completed_ride import CompletedRide
+import instrumentation
+import profiling
+import request_validation
+import request_schemas
+import value_objects
+import outbox
+import read_through_cache
+import metrics
 
 # ---------------------------------------------------------------------------------------------------------------------
 # "Global variables".
@@ -18,48 +25,153 @@ from completed_ride import CompletedRide
 LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.DEBUG)
 
-ENV_RIDE_COMPLETION_TOPIC_ARN = "RIDE_COMPLETION_TOPIC_ARN"
-ENV_RIDE_COMPLETION_TOPIC_NAME = "RIDE_COMPLETION_TOPIC_NAME"
+# Compiled once per container, so validating a request is just a few function calls.
+RIDE_COMPLETION_VALIDATOR = request_validation.compile_schema(request_schemas.SUBMIT_RIDE_COMPLETION_SCHEMA)
+
+ENV_RIDES_STORE_TABLE_NAME = "RIDES_STORE_TABLE_NAME"
+ENV_RIDE_IDS_TABLE_NAME = "RIDE_IDS_TABLE_NAME"
+ENV_RIDE_ID_RETENTION_IN_DAYS = "RIDE_ID_RETENTION_IN_DAYS"
+ENV_RECENT_RIDE_IDS_MAX_ENTRIES = "RECENT_RIDE_IDS_MAX_ENTRIES"
 #ENV_SERVICE_API_BASE_URL = "SERVICE_API_BASE_URL"
 
+DEFAULT_RIDE_ID_RETENTION_IN_DAYS = 30
+# A ride ID always stands for the same ride, so remembering it for an hour is safe - it's just a matter of memory.
+RECENT_RIDE_ID_TTL_SECS = 3600
+
+CONFLICT_RIDE_ID_TAKEN = "Ride ID was already submitted for another unicorn or customer."
+INTERNAL_SERVER_ERROR_NOT_PERSISTED = "Ride completion couldn't be persisted, please retry."
+METRIC_DUPLICATE_RIDE_COMPLETIONS = "Duplicate ride completions"
+
+# Per-container cache of the ride IDs seen recently: ride ID -> the original ride's key fields.
+RECENT_RIDE_IDS = read_through_cache.LruTtlCache(int(os.environ.get(ENV_RECENT_RIDE_IDS_MAX_ENTRIES, read_through_cache.DEFAULT_MAX_ENTRIES)))
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Create a new completed ride from the validated ride details, plus when it was submitted and its correlation ID.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def create_completed_ride(ride_details):
+    submitted_at = datetime.datetime.utcnow().isoformat()
+    LOGGER.debug("submitted_at: %s", submitted_at)
+    correlation_id = str(uuid.uuid4())
+    LOGGER.debug("correlation_id: %s", correlation_id)
+    ride_details.update({ "submitted-at": submitted_at, "correlation-id": correlation_id })
+    return value_objects.CompletedRide.from_fields(ride_details)
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Remember which ride a ride ID was submitted as.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def remember_ride_id(ride_id, original):
+    RECENT_RIDE_IDS.set(ride_id, original, RECENT_RIDE_ID_TTL_SECS)
+
+def fetch_original_ride(ddb_client, ride_id):
+    response = ddb_client.get_item(
+        TableName = os.environ.get(ENV_RIDE_IDS_TABLE_NAME),
+        Key = { "ride-id": { "S": ride_id } },
+        ConsistentRead = True
+    )
+    item = response.get("Item")
+    if item is None:
+        return None
+    original = {
+        "unicorn-id": item["unicorn-id"]["S"],
+        "customer-id": item["customer-id"]["S"],
+        "submitted-at": item["submitted-at"]["S"]
+    }
+    remember_ride_id(ride_id, original)
+    return original
+
+def is_transaction_cancelled_by_dedup_record(ex):
+    if ex.response["Error"]["Code"] != "TransactionCanceledException":
+        return False
+    reasons = ex.response.get("CancellationReasons") or []
+    # The dedup record is the first item of the transaction.
+    return len(reasons) > 0 and reasons[0].get("Code") == "ConditionalCheckFailed"
+
 # ---------------------------------------------------------------------------------------------------------------------
-# Publish ride details to ride completion topic.
+# Persist ride details, together with the marker that they still need to be published (see publish_pending_rides).
+# The ride ID is claimed in the same transaction, so a retried submission neither persists nor publishes the ride
+# again - instead, we get the key fields of the original ride back. If the ride is neither persisted nor found as the
+# original, this raises, so that the client retries.
 # ---------------------------------------------------------------------------------------------------------------------
 
-def publish_ride_details(completed_ride):
+@instrumentation.stage("persist_ride_details")
+def persist_ride_details(completed_ride):
     try:
-        LOGGER.debug("Publish ride details to ride completion topic.")
-        topic_arn = os.environ.get(ENV_RIDE_COMPLETION_TOPIC_ARN, aux.STR_NONE)
-        LOGGER.debug("topic_arn: %s", topic_arn)
-
-        sns_client = boto3.client("sns")
-        response = sns_client.publish(
-            TargetArn = topic_arn,
-            # The message body contains just the ride details.
-            Message = json.dumps({'default': json.dumps(completed_ride.get_ride_details())}),
-            MessageStructure = "json",
-            # Certain data from the ride details could be interesting for message filtering, hence go into meta data.
-            MessageAttributes = {
-                "unicorn-id": { "DataType": "String", "StringValue": completed_ride.get_unicorn_id() },
-                "customer-id": { "DataType": "String", "StringValue": completed_ride.get_customer_id() },
-                "fare": { "DataType": "Number", "StringValue": completed_ride.get_fare_as_string() },
-                "distance": { "DataType": "Number", "StringValue": completed_ride.get_distance_as_string() },
-                "correlation-id": { "DataType": "String", "StringValue": completed_ride.get_correlation_id() }
-            }
-        )
+        LOGGER.debug("Persist ride details.")
+        table_name = os.environ.get(ENV_RIDES_STORE_TABLE_NAME, aux.STR_NONE)
+        LOGGER.debug("table_name: %s", table_name)
+        ride_ids_table_name = os.environ.get(ENV_RIDE_IDS_TABLE_NAME, aux.STR_NONE)
+        LOGGER.debug("ride_ids_table_name: %s", ride_ids_table_name)
+        retention_in_days = int(os.environ.get(ENV_RIDE_ID_RETENTION_IN_DAYS, DEFAULT_RIDE_ID_RETENTION_IN_DAYS))
+        now = datetime.datetime.utcnow()
+
+        ride_id_item = {
+            "ride-id"        : { "S": completed_ride.get_ride_id() },
+            "unicorn-id"     : { "S": completed_ride.get_unicorn_id() },
+            "customer-id"    : { "S": completed_ride.get_customer_id() },
+            "submitted-at"   : { "S": completed_ride.get_submitted_at() },
+            # Epoch seconds for the table's TTL, retries come within minutes, not weeks.
+            "expires-at"     : { "N": str(int(now.replace(tzinfo=datetime.timezone.utc).timestamp()) + retention_in_days * 86400) }
+        }
+
+        item = {
+            "unicorn-id"     : { "S": completed_ride.get_unicorn_id() },
+            "customer-id"    : { "S": completed_ride.get_customer_id() },
+            "submitted-at"   : { "S": completed_ride.get_submitted_at() },
+            "ride-id"        : { "S": completed_ride.get_ride_id() },
+            "fare"           : { "N": completed_ride.get_fare_as_string() },
+            "distance"       : { "N": completed_ride.get_distance_as_string() },
+            "correlation-id" : { "S": completed_ride.get_correlation_id() },
+            # Encoded once, the very same JSON goes into the response and, later on, into the ride completion notification.
+            "ride-details"   : { "S": completed_ride.to_json() }
+        }
+        item.update(outbox.create_pending_marker(now))
+
+        ddb_client = boto3.client("dynamodb")
+        try:
+            response = ddb_client.transact_write_items(
+                TransactItems = [
+                    { "Put": {
+                        "TableName": ride_ids_table_name,
+                        "Item": ride_id_item,
+                        "ConditionExpression": "attribute_not_exists(#ride_id)",
+                        "ExpressionAttributeNames": { "#ride_id": "ride-id" }
+                    } },
+                    { "Put": {
+                        "TableName": table_name,
+                        "Item": item
+                    } }
+                ]
+            )
+        except ClientError as ex:
+            if not is_transaction_cancelled_by_dedup_record(ex):
+                raise
+            LOGGER.info("Ride ID %s was already submitted.", completed_ride.get_ride_id())
+            original = fetch_original_ride(ddb_client, completed_ride.get_ride_id())
+            if original is None:
+                # The claim is gone by now, e.g. expired in between - the next attempt gets a fresh one.
+                raise RuntimeError("Ride ID %s was already submitted, but its original ride wasn't found." % completed_ride.get_ride_id())
+            return original
     except Exception as ex:
-        LOGGER.exception("Something went wrong with publishing the ride details.")
+        LOGGER.exception("Something went wrong with persisting the ride details.")
         LOGGER.exception(ex)
-        return 0
+        raise
     else:
-        LOGGER.debug("Ride details successfully published.")
-        LOGGER.debug("SNS response: %s", response)
-        return 1
+        LOGGER.debug("Ride details successfully persisted.")
+        LOGGER.debug("DDB response: %s", response)
+        remember_ride_id(completed_ride.get_ride_id(), {
+            "unicorn-id": completed_ride.get_unicorn_id(),
+            "customer-id": completed_ride.get_customer_id(),
+            "submitted-at": completed_ride.get_submitted_at()
+        })
+        return None
 
 # ---------------------------------------------------------------------------------------------------------------------
 # Create the self link URL for the new completed ride resource.
 # ---------------------------------------------------------------------------------------------------------------------
 
+@instrumentation.stage("create_self_link_url")
 def create_self_link_url(event, completed_ride):
 
     LOGGER.debug("Create the self link URL for the new completed ride resource.")
@@ -91,10 +203,59 @@ def create_self_link_url(event, completed_ride):
 
     return completed_ride_link
 
+# ---------------------------------------------------------------------------------------------------------------------
+# Respond to a duplicate submission with the original completed ride resource.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def create_duplicate_response(event, ride_details, original):
+    metrics.add_count(METRIC_DUPLICATE_RIDE_COMPLETIONS)
+    if original["unicorn-id"] != ride_details["unicorn-id"] or original["customer-id"] != ride_details["customer-id"]:
+        LOGGER.warning("Ride ID %s was already submitted as %s.", ride_details["ride-id"], original)
+        return {
+            "statusCode": 409,
+            "body": json.dumps({ "error-message": CONFLICT_RIDE_ID_TAKEN }),
+            "headers": {
+                "Content-Type": "application/json"
+            }
+        }
+
+    completed_ride_link = create_self_link_url(event, value_objects.CompletedRide.from_fields(original))
+    data = {
+        "links": {
+            "self": completed_ride_link
+        },
+        "unicorn-id": original["unicorn-id"],
+        "customer-id": original["customer-id"],
+        "submitted-at": original["submitted-at"]
+    }
+    return {
+        "statusCode": 200,
+        "body": json.dumps(data),
+        "headers": {
+            "Location": completed_ride_link,
+            "Content-Location": completed_ride_link,
+            "Content-Type": "application/json"
+        }
+    }
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Respond to a submission that couldn't be persisted - nothing has been stored or published, so retrying is safe.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def create_not_persisted_response():
+    return {
+        "statusCode": 500,
+        "body": json.dumps({ "error-message": INTERNAL_SERVER_ERROR_NOT_PERSISTED }),
+        "headers": {
+            "Content-Type": "application/json"
+        }
+    }
+
 # ---------------------------------------------------------------------------------------------------------------------
 # Lambda handler.
 # ---------------------------------------------------------------------------------------------------------------------
 
+@instrumentation.instrument_handler(LOGGER)
 def lambda_handler(event, context):
 
     # If the environment advises on a specific debug level, set it accordingly.
@@ -103,25 +264,33 @@ def lambda_handler(event, context):
     aux.log_env_details(LOGGER)
     # Log request details.
     aux.log_event_and_context(LOGGER, event, context)
+    # Validate the ride details before any I/O - invalid requests don't even make it to the event logging topic.
+    with instrumentation.stage("validate_request"):
+        ride_details, violations = request_validation.parse_and_validate(RIDE_COMPLETION_VALIDATOR, event.get(aux.EK_BODY))
+    if violations:
+        return request_validation.create_bad_request_response(LOGGER, violations)
     # Publish Lambda event to the respective event logging topic.
-    aux_api.publish_apigw_lambda_event(LOGGER, event)
+    with instrumentation.stage("publish_lambda_event"):
+        aux_api.publish_apigw_lambda_event(LOGGER, event)
 
-    # Create a new completed ride object from the incoming event.
-    try:
-        LOGGER.debug("Create a new completed ride object from the incoming event.")
-        completed_ride = CompletedRide(LOGGER, event, event[aux.EK_BODY])
-    except Exception as ex:
-        LOGGER.exception(aux_api.BAD_REQUEST_NO_JSON_BODY)
-        LOGGER.exception(ex)
-        return aux_api.bad_request(LOGGER, event, aux_api.BAD_REQUEST_NO_JSON_BODY, ex)
+    # Clients retry, so we might know this ride already - without asking the database.
+    original = RECENT_RIDE_IDS.get(ride_details["ride-id"])
+    if original is not None:
+        LOGGER.info("Ride ID %s was submitted recently.", ride_details["ride-id"])
+        return create_duplicate_response(event, ride_details, original)
 
-    # Persist ride details.
-    # Feature request: Eventually respond with Internal Server Error if this fails.
-    completed_ride.persist_ride_details()
+    # Create a new completed ride from the ride details we have already parsed for validation.
+    completed_ride = create_completed_ride(ride_details)
+    profiling.annotate_correlation_id(completed_ride.get_correlation_id())
 
-    # Send ride details to the ride completion topic.
-    # Feature request: If this fails, add a scheduled process to retry.
-    publish_ride_details(completed_ride)
+    # Persist ride details - the ride completion topic hears about them from the outbox sweeper.
+    try:
+        original = persist_ride_details(completed_ride)
+    except Exception:
+        # Logged already.
+        return create_not_persisted_response()
+    if original is not None:
+        return create_duplicate_response(event, ride_details, original)
 
     # Prepare self link for the new completed ride resource.
     # Feature request: Make this an instance operation of a CompletedRide instance?
@@ -133,13 +302,12 @@ def lambda_handler(event, context):
         },
         "unicorn-id": completed_ride.get_unicorn_id(),
         "customer-id": completed_ride.get_customer_id(),
-        "submitted-at": completed_ride.get_submitted_at(),
-        "ride-details": completed_ride.get_ride_details()
+        "submitted-at": completed_ride.get_submitted_at()
     }
 
     return {
         "statusCode": 201,
-        "body": json.dumps(data),
+        "body": value_objects.encode_with_embedded(data, "ride-details", completed_ride),
         "headers": {
             "Location": completed_ride_link,
             "Content-Location": completed_ride_link,
@@ -0,0 +1 @@
+../../../lib/value_objects.py
\ No newline at end of file
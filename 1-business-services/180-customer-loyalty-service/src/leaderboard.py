@@ -0,0 +1 @@
+../../../lib/leaderboard.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../../lib/loyalty_klebs.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../../lib/metrics.py
\ No newline at end of file
@@ -2,6 +2,7 @@ import os
 import sys
 import logging
 import json
+import time
 import datetime
 import uuid
 import boto3
@@ -9,6 +10,11 @@ from botocore.exceptions import ClientError
 from pprint import pprint
 import aux
 import aux_processing
+import instrumentation
+import metrics
+import loyalty_klebs
+import leaderboard
+import batch_processing
 
 # ---------------------------------------------------------------------------------------------------------------------
 # Globals.
@@ -18,44 +24,88 @@ LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.DEBUG)
 
 ENV_RIDES_STORE_TABLE_NAME = "RIDES_STORE_TABLE_NAME"
+ENV_LOYALTY_KLEBS_TABLE_NAME = "LOYALTY_KLEBS_TABLE_NAME"
+
+RIDE_KEY_ATTRIBUTES = ["customer-id", "submitted-at"]
+
+METRIC_KLEBS_CREDITED = "Klebs credited"
+METRIC_LEADERBOARD_SHARD_UPDATES = "Leaderboard shard updates"
 
 # ---------------------------------------------------------------------------------------------------------------------
-# Persist the incoming ride details.
+# Persist the incoming ride details of a batch, with as few BatchWriteItem calls as possible.
 # ---------------------------------------------------------------------------------------------------------------------
 
-def persist_ride_details(unicorn_id, customer_id, submitted_at, ride_id, fare, distance, correlation_id, ride_details):
+def create_ride_item(unicorn_id, customer_id, submitted_at, ride_id, fare, distance, correlation_id, ride_details):
+    return {
+        "unicorn-id"     : { "S": unicorn_id },
+        "customer-id"    : { "S": customer_id },
+        "submitted-at"   : { "S": submitted_at },
+        "ride-id"        : { "S": ride_id },
+        "fare"           : { "N": str(fare) },
+        "distance"       : { "N": str(distance) },
+        "correlation-id" : { "S": correlation_id },
+        "ride-details"   : { "S": json.dumps(ride_details) }
+    }
+
+@instrumentation.stage("persist_ride_details")
+def persist_ride_details(items):
+    LOGGER.debug("Persist the incoming ride details of %d rides.", len(items))
+    table_name = os.environ.get(ENV_RIDES_STORE_TABLE_NAME)
+    LOGGER.debug("table_name: %s", table_name)
+    failed_message_ids = batch_processing.batch_write_items(LOGGER, boto3.client("dynamodb"), table_name, items, RIDE_KEY_ATTRIBUTES)
+    LOGGER.debug("Ride details of %d rides persisted.", len(items) - len(failed_message_ids))
+    return failed_message_ids
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Credit the klebs for the rides of a batch, with one update per customer.
+# ---------------------------------------------------------------------------------------------------------------------
+
+@instrumentation.stage("credit_klebs")
+def credit_klebs(rides):
+    LOGGER.debug("Credit the klebs for %d rides.", len(rides))
+    table_name = os.environ.get(ENV_LOYALTY_KLEBS_TABLE_NAME)
+    LOGGER.debug("table_name: %s", table_name)
+
+    ddb_client = boto3.client("dynamodb")
+    failed_customer_ids = []
+    balances = {}
+    for customer_id, customer_rides in loyalty_klebs.coalesce_rides(rides).items():
+        try:
+            klebs, balance = loyalty_klebs.credit_rides(LOGGER, ddb_client, table_name, customer_id, customer_rides.values())
+            metrics.add_count(METRIC_KLEBS_CREDITED, klebs)
+            if balance is not None:
+                balances[customer_id] = balance
+        except Exception as ex:
+            LOGGER.exception("Something went wrong with crediting the klebs of customer %s.", customer_id)
+            LOGGER.exception(ex)
+            failed_customer_ids.append(customer_id)
+    return failed_customer_ids, balances
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Update the leaderboard with the new balances.
+# ---------------------------------------------------------------------------------------------------------------------
+
+@instrumentation.stage("update_leaderboard")
+def update_leaderboard(balances):
     try:
-        LOGGER.debug("Persist the incoming ride details.")
-        table_name = os.environ.get(ENV_RIDES_STORE_TABLE_NAME)
+        LOGGER.debug("Update the leaderboard with %d balances.", len(balances))
+        table_name = os.environ.get(leaderboard.ENV_LEADERBOARD_TABLE_NAME)
         LOGGER.debug("table_name: %s", table_name)
-
-        ddb_client = boto3.client("dynamodb")
-        response = ddb_client.put_item(
-            TableName = table_name,
-            Item = {
-                "unicorn-id"     : { "S": unicorn_id },
-                "customer-id"    : { "S": customer_id },
-                "submitted-at"   : { "S": submitted_at },
-                "ride-id"        : { "S": ride_id },
-                "fare"           : { "N": str(fare) },
-                "distance"       : { "N": str(distance) },
-                "correlation-id" : { "S": correlation_id },
-                "ride-details"   : { "S": json.dumps(ride_details) }
-            }
-        )
+        updated = leaderboard.update_leaderboard(LOGGER, boto3.client("dynamodb"), table_name, balances)
+        metrics.add_count(METRIC_LEADERBOARD_SHARD_UPDATES, updated)
     except Exception as ex:
-        LOGGER.exception("Something went wrong with persisting the ride details.")
+        # The leaderboard holds absolute balances, so the customer's next ride puts things right again.
+        LOGGER.exception("Something went wrong with updating the leaderboard.")
         LOGGER.exception(ex)
         return 0
     else:
-        LOGGER.debug("Ride details successfully persisted.")
-        LOGGER.debug("DDB response: %s", response)
         return 1
 
 # ---------------------------------------------------------------------------------------------------------------------
 # Lambda handler.
 # ---------------------------------------------------------------------------------------------------------------------
 
+@instrumentation.instrument_handler(LOGGER)
 def lambda_handler(event, context):
 
     # If the environment advises on a specific debug level, set it accordingly.
@@ -65,43 +115,76 @@ def lambda_handler(event, context):
     # Log request details.
     aux.log_event_and_context(LOGGER, event, context)
     # Publish Lambda event to the respective event logging topic.
-    aux_processing.publish_sns_lambda_event(LOGGER, event)
+    with instrumentation.stage("publish_lambda_event"):
+        aux_processing.publish_sns_lambda_event(LOGGER, event)
 
-    # We expect SNS messages coming in in a "Records" array, within each record, there's an object "Sns".
-    # Within that object:
+    # We expect SQS messages coming in in a "Records" array, within each record, the "body" is the SNS notification.
+    # Within that notification:
     # - The message body is in the "Message" object.
     # - Message meta data is in the "MessageAttributes" object.
+    started_at = time.perf_counter()
+    failed_message_ids = set()
+    items = []
+    rides = []
+    message_ids_per_customer = {}
     count = 0
     for record in event["Records"]:
         count += 1
-        LOGGER.debug("Looking into record #%d:", count)
-
-        # Extract ride details from record.
-        ride_details = json.loads(record["Sns"]["Message"])
-        LOGGER.debug("ride_details: %s", ride_details)
-        # Extract unicorn ID from ride details.
-        unicorn_id = ride_details["unicorn-id"]
-        LOGGER.debug("unicorn_id: %s", unicorn_id)
-        # Extract customer ID from ride details.
-        customer_id = ride_details["customer-id"]
-        LOGGER.debug("customer_id: %s", customer_id)
-        # Extract submitted-at from ride details.
-        submitted_at = ride_details["submitted-at"]
-        LOGGER.debug("submitted_at: %s", submitted_at)
-        # Extract ride ID from ride details.
-        ride_id = ride_details["ride-id"]
-        LOGGER.debug("ride_id: %s", ride_id)
-        # Extract fare from ride details.
-        fare = ride_details["fare"]
-        LOGGER.debug("fare: %s", fare)
-        # Extract distance from ride details.
-        distance = ride_details["distance"]
-        LOGGER.debug("distance: %s", distance)
-        # Extract correlation ID from ride details.
-        correlation_id = ride_details["correlation-id"]
-        LOGGER.debug("correlation_id: %s", correlation_id)
-
-        # Persist ride details.
-        persist_ride_details(unicorn_id, customer_id, submitted_at, ride_id, fare, distance, correlation_id, ride_details)
+        message_id = batch_processing.get_message_id(record)
+        LOGGER.debug("Looking into record #%d (%s):", count, message_id)
+
+        try:
+            # Extract ride details from record.
+            ride_details = json.loads(batch_processing.extract_sns_message(record))
+            LOGGER.debug("ride_details: %s", ride_details)
+            # Extract unicorn ID from ride details.
+            unicorn_id = ride_details["unicorn-id"]
+            LOGGER.debug("unicorn_id: %s", unicorn_id)
+            # Extract customer ID from ride details.
+            customer_id = ride_details["customer-id"]
+            LOGGER.debug("customer_id: %s", customer_id)
+            # Extract submitted-at from ride details.
+            submitted_at = ride_details["submitted-at"]
+            LOGGER.debug("submitted_at: %s", submitted_at)
+            # Extract ride ID from ride details.
+            ride_id = ride_details["ride-id"]
+            LOGGER.debug("ride_id: %s", ride_id)
+            # Extract fare from ride details.
+            fare = ride_details["fare"]
+            LOGGER.debug("fare: %s", fare)
+            # Extract distance from ride details.
+            distance = ride_details["distance"]
+            LOGGER.debug("distance: %s", distance)
+            # Extract correlation ID from ride details.
+            correlation_id = ride_details["correlation-id"]
+            LOGGER.debug("correlation_id: %s", correlation_id)
+            klebs = loyalty_klebs.compute_klebs(fare, distance)
+        except Exception as ex:
+            # Malformed messages end up in the dead letter queue after a few attempts.
+            LOGGER.exception("Something went wrong with extracting the ride details of message %s.", message_id)
+            LOGGER.exception(ex)
+            failed_message_ids.add(message_id)
+            continue
+
+        # Remember the ride for persisting it and crediting the klebs.
+        items.append((message_id, create_ride_item(unicorn_id, customer_id, submitted_at, ride_id, fare, distance, correlation_id, ride_details)))
+        rides.append(loyalty_klebs.Ride(customer_id, ride_id, submitted_at, klebs))
+        message_ids_per_customer.setdefault(customer_id, []).append(message_id)
+
+    # Persist ride details.
+    failed_message_ids.update(persist_ride_details(items))
+    # Credit the klebs of all rides in one go per customer. Rides credited already don't count twice, so if crediting
+    # fails, we report the customer's messages as failed and have just those retried.
+    failed_customer_ids, balances = credit_klebs(rides)
+    for customer_id in failed_customer_ids:
+        failed_message_ids.update(message_ids_per_customer[customer_id])
+    # Keep the leaderboard up to date with the balances that changed.
+    if balances:
+        update_leaderboard(balances)
+
+    batch_processing.put_batch_metrics(count, len(failed_message_ids), time.perf_counter() - started_at)
+    if failed_message_ids:
+        LOGGER.warning("Processing failed for %d of %d messages.", len(failed_message_ids), count)
+    return batch_processing.create_batch_response(failed_message_ids)
 
 # ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1 @@
+../../../lib/read_through_cache.py
\ No newline at end of file
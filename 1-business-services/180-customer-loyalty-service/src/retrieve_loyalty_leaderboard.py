@@ -0,0 +1,81 @@
+import os
+import sys
+import logging
+import json
+import datetime
+import boto3
+from botocore.exceptions import ClientError
+from pprint import pprint
+import aux
+import aux_api
+import pagination
+import leaderboard
+import instrumentation
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Globals.
+# ---------------------------------------------------------------------------------------------------------------------
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+
+BAD_REQUEST_INVALID_PARAMETERS = "Query string parameters are invalid."
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Read the top customers from the sharded leaderboard.
+# ---------------------------------------------------------------------------------------------------------------------
+
+@instrumentation.stage("read_leaderboard")
+def read_leaderboard(limit):
+    LOGGER.debug("Read the leaderboard from the database.")
+    table_name = os.environ.get(leaderboard.ENV_LEADERBOARD_TABLE_NAME)
+    LOGGER.debug("table_name: %s", table_name)
+    entries = leaderboard.read_leaderboard(boto3.client("dynamodb"), table_name, limit)
+    LOGGER.debug("entries: %s", entries)
+    return entries
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Lambda handler.
+# ---------------------------------------------------------------------------------------------------------------------
+
+@instrumentation.instrument_handler(LOGGER)
+def lambda_handler(event, context):
+
+    # If the environment advises on a specific debug level, set it accordingly.
+    aux.update_log_level(LOGGER, event, context)
+    # Log environment details.
+    aux.log_env_details(LOGGER)
+    # Log request details.
+    aux.log_event_and_context(LOGGER, event, context)
+    # Publish Lambda event to the respective event logging topic.
+    with instrumentation.stage("publish_lambda_event"):
+        aux_api.publish_apigw_lambda_event(LOGGER, event)
+
+    # Extract and check the query string parameters.
+    query_string_parameters = event.get("queryStringParameters") or {}
+    try:
+        limit = pagination.extract_limit(query_string_parameters, leaderboard.TOP_K, leaderboard.TOP_K)
+        LOGGER.debug("limit: %d", limit)
+    except ValueError as ex:
+        LOGGER.exception(BAD_REQUEST_INVALID_PARAMETERS)
+        return aux_api.bad_request(LOGGER, event, BAD_REQUEST_INVALID_PARAMETERS, ex)
+
+    entries = read_leaderboard(limit)
+
+    data = {
+        "customers": [ {
+            "rank": rank,
+            "customer-id": customer_id,
+            "klebs": klebs
+        } for rank, (customer_id, klebs) in enumerate(entries, start=1) ]
+    }
+
+    return {
+        "statusCode": 200,
+        "body": json.dumps(data),
+        "headers": {
+            "Content-Type": "application/json"
+        }
+    }
+
+# ---------------------------------------------------------------------------------------------------------------------
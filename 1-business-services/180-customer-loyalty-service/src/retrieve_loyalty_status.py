@@ -0,0 +1,195 @@
+import os
+import sys
+import logging
+import json
+import datetime
+import urllib.parse
+import boto3
+from botocore.exceptions import ClientError
+from pprint import pprint
+import aux
+import aux_api
+import pagination
+import read_through_cache
+import loyalty_klebs
+import metrics
+import instrumentation
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Globals.
+# ---------------------------------------------------------------------------------------------------------------------
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+
+ENV_RIDES_STORE_TABLE_NAME = "RIDES_STORE_TABLE_NAME"
+ENV_LOYALTY_KLEBS_TABLE_NAME = "LOYALTY_KLEBS_TABLE_NAME"
+ENV_LOYALTY_CACHE_MAX_ENTRIES = "LOYALTY_CACHE_MAX_ENTRIES"
+ENV_LOYALTY_CACHE_TTL_SECS = "LOYALTY_CACHE_TTL_SECS"
+
+QSP_CUSTOMER_ID = "customer-id"
+
+DEFAULT_HISTORY_LIMIT = 10
+MAX_HISTORY_LIMIT = 50
+# Balances change with every ride, so they are only cached briefly.
+DEFAULT_LOYALTY_CACHE_TTL_SECS = 30
+
+HISTORY_ATTRIBUTES = ["ride-id", "submitted-at", "fare", "distance"]
+
+BAD_REQUEST_NO_CUSTOMER_ID = "Query string parameter 'customer-id' is required."
+BAD_REQUEST_INVALID_PARAMETERS = "Query string parameters are invalid."
+
+METRIC_LOYALTY_CACHE_LOOKUPS = "Loyalty cache lookups"
+DIMENSION_CACHE = "cache"
+DIMENSION_OUTCOME = "outcome"
+
+CACHE_TTL_SECS = int(os.environ.get(ENV_LOYALTY_CACHE_TTL_SECS, DEFAULT_LOYALTY_CACHE_TTL_SECS))
+# Per-container caches: customer ID -> balance, (customer ID, limit) -> earning history.
+BALANCE_CACHE = read_through_cache.LruTtlCache(int(os.environ.get(ENV_LOYALTY_CACHE_MAX_ENTRIES, read_through_cache.DEFAULT_MAX_ENTRIES)))
+HISTORY_CACHE = read_through_cache.LruTtlCache(int(os.environ.get(ENV_LOYALTY_CACHE_MAX_ENTRIES, read_through_cache.DEFAULT_MAX_ENTRIES)))
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Look up a value in one of the caches, loading it on a miss.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def get_cached(cache, cache_name, key, loader):
+    value = cache.get(key)
+    outcome = read_through_cache.OUTCOME_LOCAL_HIT
+    if value is None:
+        outcome = read_through_cache.OUTCOME_MISS
+        value = loader()
+        cache.set(key, value, CACHE_TTL_SECS)
+    metrics.add_count(METRIC_LOYALTY_CACHE_LOOKUPS, 1, { DIMENSION_CACHE: cache_name, DIMENSION_OUTCOME: outcome })
+    return value
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Fetch the balance of a customer - a single get_item on the klebs ledger.
+# ---------------------------------------------------------------------------------------------------------------------
+
+@instrumentation.stage("fetch_balance")
+def fetch_balance(ddb_client, customer_id):
+    LOGGER.debug("Fetch the klebs balance from the database.")
+    table_name = os.environ.get(ENV_LOYALTY_KLEBS_TABLE_NAME)
+    LOGGER.debug("table_name: %s", table_name)
+    balance = loyalty_klebs.fetch_balance(ddb_client, table_name, customer_id)
+    if balance is None:
+        # No rides credited yet, which is a perfectly fine balance, too (and is cached just the same).
+        balance = { loyalty_klebs.ATTR_KLEBS: 0, loyalty_klebs.ATTR_CREDITED_RIDES: 0, loyalty_klebs.ATTR_LAST_CREDITED_AT: None }
+    LOGGER.debug("balance: %s", balance)
+    return balance
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Fetch the most recent rides of a customer with the klebs earned for each - one query with a limit.
+# ---------------------------------------------------------------------------------------------------------------------
+
+@instrumentation.stage("fetch_history")
+def fetch_history(ddb_client, customer_id, limit):
+    LOGGER.debug("Fetch the earning history from the database.")
+    table_name = os.environ.get(ENV_RIDES_STORE_TABLE_NAME)
+    LOGGER.debug("table_name: %s", table_name)
+
+    names = { "#a" + str(index): attribute for index, attribute in enumerate(HISTORY_ATTRIBUTES) }
+    names["#customer_id"] = "customer-id"
+    response = ddb_client.query(
+        TableName = table_name,
+        KeyConditionExpression = "#customer_id = :customer_id",
+        ExpressionAttributeNames = names,
+        ExpressionAttributeValues = { ":customer_id": { "S": customer_id } },
+        ProjectionExpression = ", ".join("#a" + str(index) for index in range(len(HISTORY_ATTRIBUTES))),
+        # Most recent first.
+        ScanIndexForward = False,
+        Limit = limit
+    )
+    history = []
+    for item in response["Items"]:
+        fare = float(item["fare"]["N"])
+        distance = float(item["distance"]["N"])
+        history.append({
+            "ride-id": item["ride-id"]["S"],
+            "submitted-at": item["submitted-at"]["S"],
+            "fare": fare,
+            "distance": distance,
+            "klebs": loyalty_klebs.compute_klebs(fare, distance)
+        })
+    LOGGER.debug("history: %s", history)
+    return history
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Create the self link URL for the loyalty status resource.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def create_self_link_url(event, customer_id, limit):
+    link_protocol = event["headers"]["X-Forwarded-Proto"]
+    link_host = event["headers"]["Host"]
+    link_stage = event["requestContext"]["stage"]
+    link_base_url = link_protocol + "://" + link_host
+    if event["requestContext"]["path"].startswith("/" + link_stage):
+        # We need to include the stage in constructed resource URLs.
+        link_base_url += "/" + link_stage
+    link = link_base_url + "/api/user/retrieve-loyalty-status?" + urllib.parse.urlencode({
+        QSP_CUSTOMER_ID: customer_id,
+        pagination.QSP_LIMIT: limit
+    })
+    LOGGER.debug("self_link_url: %s", link)
+    return link
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Lambda handler.
+# ---------------------------------------------------------------------------------------------------------------------
+
+@instrumentation.instrument_handler(LOGGER)
+def lambda_handler(event, context):
+
+    # If the environment advises on a specific debug level, set it accordingly.
+    aux.update_log_level(LOGGER, event, context)
+    # Log environment details.
+    aux.log_env_details(LOGGER)
+    # Log request details.
+    aux.log_event_and_context(LOGGER, event, context)
+    # Publish Lambda event to the respective event logging topic.
+    with instrumentation.stage("publish_lambda_event"):
+        aux_api.publish_apigw_lambda_event(LOGGER, event)
+
+    # Extract and check the query string parameters.
+    query_string_parameters = event.get("queryStringParameters") or {}
+    customer_id = query_string_parameters.get(QSP_CUSTOMER_ID)
+    LOGGER.debug("customer_id: %s", customer_id)
+    if not customer_id:
+        return aux_api.bad_request(LOGGER, event, BAD_REQUEST_NO_CUSTOMER_ID, None)
+    try:
+        limit = pagination.extract_limit(query_string_parameters, DEFAULT_HISTORY_LIMIT, MAX_HISTORY_LIMIT)
+        LOGGER.debug("limit: %d", limit)
+    except ValueError as ex:
+        LOGGER.exception(BAD_REQUEST_INVALID_PARAMETERS)
+        return aux_api.bad_request(LOGGER, event, BAD_REQUEST_INVALID_PARAMETERS, ex)
+
+    # Fetch balance and history, each through its cache.
+    ddb_client = boto3.client("dynamodb")
+    balance = get_cached(BALANCE_CACHE, "balance", customer_id, lambda: fetch_balance(ddb_client, customer_id))
+    history = get_cached(HISTORY_CACHE, "history", (customer_id, limit), lambda: fetch_history(ddb_client, customer_id, limit))
+    tier, next_tier = loyalty_klebs.get_tier(balance[loyalty_klebs.ATTR_KLEBS])
+
+    self_link_url = create_self_link_url(event, customer_id, limit)
+    data = {
+        "links": {
+            "self": self_link_url
+        },
+        "customer-id": customer_id,
+        "klebs": balance[loyalty_klebs.ATTR_KLEBS],
+        "credited-rides": balance[loyalty_klebs.ATTR_CREDITED_RIDES],
+        "last-credited-at": balance[loyalty_klebs.ATTR_LAST_CREDITED_AT],
+        "tier": tier,
+        "next-tier": next_tier,
+        "history": history
+    }
+
+    return {
+        "statusCode": 200,
+        "body": json.dumps(data),
+        "headers": {
+            "Content-Location": self_link_url,
+            "Content-Type": "application/json"
+        }
+    }
+
+# ---------------------------------------------------------------------------------------------------------------------
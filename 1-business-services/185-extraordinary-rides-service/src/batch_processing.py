@@ -0,0 +1 @@
+../../../lib/batch_processing.py
\ No newline at end of file
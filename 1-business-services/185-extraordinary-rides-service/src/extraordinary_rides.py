@@ -0,0 +1 @@
+../../../lib/extraordinary_rides.py
\ No newline at end of file
@@ -2,6 +2,7 @@ import os
 import sys
 import logging
 import json
+import time
 import datetime
 import uuid
 import boto3
@@ -9,6 +10,10 @@ from botocore.exceptions import ClientError
 from pprint import pprint
 import aux
 import aux_processing
+import instrumentation
+import metrics
+import extraordinary_rides
+import batch_processing
 
 # ---------------------------------------------------------------------------------------------------------------------
 # Globals.
@@ -19,43 +24,115 @@ LOGGER.setLevel(logging.DEBUG)
 
 ENV_RIDES_STORE_TABLE_NAME = "RIDES_STORE_TABLE_NAME"
 
+RIDE_KEY_ATTRIBUTES = ["customer-id", "submitted-at"]
+RIDE_ATTRIBUTES = ["unicorn-id", "customer-id", "submitted-at", "ride-id", "fare", "distance", "correlation-id"]
+
+METRIC_RIDES_CLASSIFIED = "Rides classified"
+DIMENSION_SCOPE = "scope"
+DIMENSION_EXTRAORDINARY = "extraordinary"
+
+# Per-container detector, its sketches live as long as the container does and are synced with the stored ones.
+DETECTOR = extraordinary_rides.Detector(
+    float(os.environ.get(extraordinary_rides.ENV_EXTRAORDINARY_PERCENTILE, extraordinary_rides.DEFAULT_EXTRAORDINARY_PERCENTILE)),
+    int(os.environ.get(extraordinary_rides.ENV_SKETCH_MIN_RIDES, extraordinary_rides.DEFAULT_SKETCH_MIN_RIDES)),
+    int(os.environ.get(extraordinary_rides.ENV_SKETCH_SYNC_INTERVAL_SECS, extraordinary_rides.DEFAULT_SKETCH_SYNC_INTERVAL_SECS)))
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Persist the details of the extraordinary rides of a batch, with as few BatchWriteItem calls as possible.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def create_ride_item(unicorn_id, customer_id, submitted_at, ride_id, fare, distance, correlation_id, ride_details):
+    return {
+        "unicorn-id"     : { "S": unicorn_id },
+        "customer-id"    : { "S": customer_id },
+        "submitted-at"   : { "S": submitted_at },
+        "ride-id"        : { "S": ride_id },
+        "fare"           : { "N": str(fare) },
+        "distance"       : { "N": str(distance) },
+        "correlation-id" : { "S": correlation_id },
+        "ride-details"   : { "S": json.dumps(ride_details) }
+    }
+
+@instrumentation.stage("persist_ride_details")
+def persist_ride_details(items):
+    LOGGER.debug("Persist the incoming ride details of %d rides.", len(items))
+    table_name = os.environ.get(ENV_RIDES_STORE_TABLE_NAME)
+    LOGGER.debug("table_name: %s", table_name)
+    failed_message_ids = batch_processing.batch_write_items(LOGGER, boto3.client("dynamodb"), table_name, items, RIDE_KEY_ATTRIBUTES)
+    LOGGER.debug("Ride details of %d rides persisted.", len(items) - len(failed_message_ids))
+    return failed_message_ids
+
 # ---------------------------------------------------------------------------------------------------------------------
-# Persist the incoming ride details.
+# Decode the ride details of a batch.
 # ---------------------------------------------------------------------------------------------------------------------
 
-def persist_ride_details(unicorn_id, customer_id, submitted_at, ride_id, fare, distance, correlation_id, ride_details):
+@instrumentation.stage("decode_records")
+def decode_records(records):
+    # Returns (message ID, ride details) for the records that could be decoded, and the IDs of those that couldn't.
+    # The SNS envelope within the SQS envelope is decoded in one go per record, right here. Decoding is pure Python
+    # work that holds the GIL, so spreading it across threads wouldn't make it any faster.
+    rides = []
+    failed_message_ids = set()
+    for record in records:
+        message_id = batch_processing.get_message_id(record)
+        try:
+            ride_details = json.loads(batch_processing.extract_sns_message(record))
+            for attribute in RIDE_ATTRIBUTES:
+                if attribute not in ride_details:
+                    raise KeyError(attribute)
+            # The detector takes the attributes it sketches as numbers, a single bad one would fail the whole batch.
+            for attribute in extraordinary_rides.ATTRIBUTES:
+                extraordinary_rides.parse_attribute(ride_details[attribute])
+        except Exception as ex:
+            # Malformed messages end up in the dead letter queue after a few attempts.
+            LOGGER.exception("Something went wrong with decoding the ride details of message %s.", message_id)
+            LOGGER.exception(ex)
+            failed_message_ids.add(message_id)
+        else:
+            rides.append((message_id, ride_details))
+    return rides, failed_message_ids
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Tell the extraordinary rides from the others, with the sketches of the rides' routes and unicorns.
+# ---------------------------------------------------------------------------------------------------------------------
+
+@instrumentation.stage("load_sketches")
+def load_sketches(rides):
     try:
-        LOGGER.debug("Persist the incoming ride details.")
-        table_name = os.environ.get(ENV_RIDES_STORE_TABLE_NAME)
+        table_name = os.environ.get(extraordinary_rides.ENV_SKETCHES_TABLE_NAME)
         LOGGER.debug("table_name: %s", table_name)
-
-        ddb_client = boto3.client("dynamodb")
-        response = ddb_client.put_item(
-            TableName = table_name,
-            Item = {
-                "unicorn-id"     : { "S": unicorn_id },
-                "customer-id"    : { "S": customer_id },
-                "submitted-at"   : { "S": submitted_at },
-                "ride-id"        : { "S": ride_id },
-                "fare"           : { "N": str(fare) },
-                "distance"       : { "N": str(distance) },
-                "correlation-id" : { "S": correlation_id },
-                "ride-details"   : { "S": json.dumps(ride_details) }
-            }
-        )
+        scope_keys = set(scope_key for ride_details in rides for scope_key in extraordinary_rides.get_scope_keys(ride_details))
+        extraordinary_rides.load_views(LOGGER, boto3.client("dynamodb"), table_name, DETECTOR, scope_keys)
     except Exception as ex:
-        LOGGER.exception("Something went wrong with persisting the ride details.")
+        # We carry on with the sketches we have (or the static rule), and try again with the next batch.
+        LOGGER.exception("Something went wrong with loading the sketches.")
         LOGGER.exception(ex)
         return 0
     else:
-        LOGGER.debug("Ride details successfully persisted.")
-        LOGGER.debug("DDB response: %s", response)
         return 1
 
+@instrumentation.stage("classify_rides")
+def classify_rides(rides):
+    verdicts = DETECTOR.classify(rides)
+    for verdict in verdicts:
+        metrics.add_count(METRIC_RIDES_CLASSIFIED, 1, {
+            DIMENSION_SCOPE: verdict.scope or "none",
+            DIMENSION_EXTRAORDINARY: str(verdict.extraordinary).lower()
+        })
+    return verdicts
+
+@instrumentation.stage("sync_sketches")
+def sync_sketches():
+    table_name = os.environ.get(extraordinary_rides.ENV_SKETCHES_TABLE_NAME)
+    retention_in_days = int(os.environ.get(extraordinary_rides.ENV_SKETCH_RETENTION_IN_DAYS, extraordinary_rides.DEFAULT_SKETCH_RETENTION_IN_DAYS))
+    merged = extraordinary_rides.sync_deltas(LOGGER, boto3.client("dynamodb"), table_name, DETECTOR, retention_in_days)
+    LOGGER.debug("Merged the sketches of %d scopes.", merged)
+
 # ---------------------------------------------------------------------------------------------------------------------
 # Main.
 # ---------------------------------------------------------------------------------------------------------------------
 
+@instrumentation.instrument_handler(LOGGER)
 def lambda_handler(event, context):
 
     # If the environment advises on a specific debug level, set it accordingly.
@@ -65,32 +142,27 @@ def lambda_handler(event, context):
     # Log request details.
     aux.log_event_and_context(LOGGER, event, context)
     # Publish Lambda event to the respective event logging topic.
-    aux_processing.publish_sns_lambda_event(LOGGER, event)
-
-    # We expect either SNS or SQS messages coming in - both will appear within an array called "Records".
-    # Within each record, SNS data appears in an object calles "Sns". Within that object:
-    # - The message body is in the "Message" object.
-    # - Message meta data is in the "MessageAttributes" object.
-    # In case we receive an SQS message here, it will be from topic-queue-chaining.
-    # All relevant data from the SNS message is going to be stuffed into the "body" object of a record.
-    # Within that "body" object, we will find the "Message" and "MessageAttributes" objects again.
-    count = 0
-    for record in event["Records"]:
-        count += 1
-        LOGGER.debug("Looking into record #%d:", count)
-
-        # Extract ride details from record.
-        ride_details = {}
-        if "Sns" in record:
-            # Direct message reception from SNS.
-            LOGGER.debug("Direct message reception from SNS.")
-            ride_details = json.loads(record["Sns"]["Message"])
-        else:
-            # Indirect message reception via buffering SQS queue due to topic-queue-chaining.
-            LOGGER.debug("Indirect message reception via buffering SQS queue due to topic-queue-chaining.")
-            body = json.loads(record["body"])
-            ride_details = json.loads(body["Message"])
-        LOGGER.debug("ride_details: %s", ride_details)
+    with instrumentation.stage("publish_lambda_event"):
+        aux_processing.publish_sns_lambda_event(LOGGER, event)
+
+    # We expect SQS messages coming in in a "Records" array, from topic-queue-chaining.
+    # All relevant data from the SNS message is stuffed into the "body" object of a record.
+    # Within that "body" object, we find the "Message" and "MessageAttributes" objects of the SNS message.
+    # There is no filter policy on the subscription, all ride completions come in - the detector decides which of them
+    # are extraordinary.
+    started_at = time.perf_counter()
+    count = len(event["Records"])
+    LOGGER.debug("Looking into %d records.", count)
+    rides, failed_message_ids = decode_records(event["Records"])
+
+    load_sketches([ ride_details for _, ride_details in rides ])
+    verdicts = classify_rides([ ride_details for _, ride_details in rides ])
+
+    items = []
+    for (message_id, ride_details), verdict in zip(rides, verdicts):
+        if not verdict.extraordinary:
+            continue
+        LOGGER.info("Ride %s is extraordinary: %s", ride_details["ride-id"], verdict)
 
         # Extract unicorn ID from ride details.
         unicorn_id = ride_details["unicorn-id"]
@@ -114,7 +186,20 @@ def lambda_handler(event, context):
         correlation_id = ride_details["correlation-id"]
         LOGGER.debug("correlation_id: %s", correlation_id)
 
-        # Persist ride details.
-        persist_ride_details(unicorn_id, customer_id, submitted_at, ride_id, fare, distance, correlation_id, ride_details)
+        items.append((message_id, create_ride_item(unicorn_id, customer_id, submitted_at, ride_id, fare, distance, correlation_id, ride_details)))
+
+    # Persist ride details. Only the messages that failed are retried - their rides count towards the sketches again,
+    # which is neither here nor there for percentiles.
+    if items:
+        failed_message_ids.update(persist_ride_details(items))
+
+    # Merge this container's rides into the stored sketches every now and then.
+    if DETECTOR.is_sync_due():
+        sync_sketches()
+
+    batch_processing.put_batch_metrics(count, len(failed_message_ids), time.perf_counter() - started_at)
+    if failed_message_ids:
+        LOGGER.warning("Processing failed for %d of %d messages.", len(failed_message_ids), count)
+    return batch_processing.create_batch_response(failed_message_ids)
 
 # ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1 @@
+../../../lib/quantile_sketch.py
\ No newline at end of file
@@ -0,0 +1,69 @@
+import os
+import logging
+import json
+import datetime
+import boto3
+import object_storage
+import raw_tier_compaction
+import metrics
+import instrumentation
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Globals.
+# ---------------------------------------------------------------------------------------------------------------------
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+ENV_RAW_DATA_BUCKET_NAME = "RAW_DATA_BUCKET_NAME"
+ENV_INGESTION_PREFIX = "INGESTION_PREFIX"
+
+METRIC_OBJECTS_COMPACTED = "Objects compacted"
+METRIC_FILES_WRITTEN = "Files written"
+METRIC_PARTITIONS_FAILED = "Partitions failed"
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Work out the day to compact: the day before, unless the event names one (reruns, backfills).
+# ---------------------------------------------------------------------------------------------------------------------
+
+def get_date(event):
+    if event.get("date"):
+        # Validates the format, partitions are named after the date as it is.
+        return datetime.datetime.strptime(event["date"], "%Y-%m-%d").date().isoformat()
+    return (datetime.datetime.utcnow().date() - datetime.timedelta(days=1)).isoformat()
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Compact the partitions of a day.
+# ---------------------------------------------------------------------------------------------------------------------
+
+@instrumentation.stage("compact_date")
+def compact_date(date):
+    bucket_name = os.environ.get(ENV_RAW_DATA_BUCKET_NAME)
+    LOGGER.debug("bucket_name: %s", bucket_name)
+    prefix = os.environ.get(ENV_INGESTION_PREFIX)
+    LOGGER.debug("prefix: %s", prefix)
+    storage = object_storage.S3Storage(boto3.client("s3"), bucket_name)
+    return raw_tier_compaction.compact_date(LOGGER, storage, prefix, date)
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Lambda handler.
+# ---------------------------------------------------------------------------------------------------------------------
+
+@instrumentation.instrument_handler(LOGGER)
+def lambda_handler(event, context):
+
+    # Scheduled events come in without a date, the day before is compacted then. A run for a day that has been
+    # compacted already only picks up what has arrived since.
+    date = get_date(event)
+    summaries = compact_date(date)
+    failed = [ summary for summary in summaries if "error" in summary ]
+    metrics.add_count(METRIC_OBJECTS_COMPACTED, sum(summary.get("inputs", 0) for summary in summaries))
+    metrics.add_count(METRIC_FILES_WRITTEN, sum(summary.get("outputs", 0) for summary in summaries))
+    metrics.add_count(METRIC_PARTITIONS_FAILED, len(failed))
+    LOGGER.info("Compacted %d partitions of %s: %s", len(summaries), date, json.dumps(summaries))
+    if failed:
+        # Fail the invocation, so that the failed partitions are retried (and alarmed on).
+        raise RuntimeError("Compacting %d of %d partitions of %s failed." % (len(failed), len(summaries), date))
+    return { "date": date, "partitions": summaries }
+
+# ---------------------------------------------------------------------------------------------------------------------
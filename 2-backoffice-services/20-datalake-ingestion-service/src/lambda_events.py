@@ -0,0 +1 @@
+../../../lib/lambda_events.py
\ No newline at end of file
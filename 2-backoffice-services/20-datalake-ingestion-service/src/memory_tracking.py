@@ -0,0 +1 @@
+../../../lib/memory_tracking.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../../lib/profiling.py
\ No newline at end of file
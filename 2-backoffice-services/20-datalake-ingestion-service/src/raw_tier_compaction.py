@@ -0,0 +1 @@
+../../../lib/raw_tier_compaction.py
\ No newline at end of file
@@ -1,48 +1,107 @@
-from __future__ import print_function
-
+import re
+import logging
+import json
 import base64
+import lambda_events
+import metrics
+import instrumentation
 
-print('Loading function')
+# ---------------------------------------------------------------------------------------------------------------------
+# Globals.
+# ---------------------------------------------------------------------------------------------------------------------
 
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
 
-def lambda_handler(event, context):
-    output = []
+# A Lambda response to Firehose may be 6 MB at most - records beyond this (base64 encoded) budget fail and go to the
+# error output, rather than failing the whole invocation.
+MAX_RESPONSE_BYTES = 5500000
+# Per record: record ID, result, metadata and the JSON around it.
+RECORD_OVERHEAD_BYTES = 300
 
-    for record in event['records']:
-        print(record['recordId'])
-        payload = base64.b64decode(record['data'])
+RESULT_OK = "Ok"
+RESULT_PROCESSING_FAILED = "ProcessingFailed"
 
-        # Do custom processing on the payload here
+# Partition key values end up in S3 prefixes.
+PARTITION_KEY_VALUE_PATTERN = re.compile("[^a-z0-9_.-]+")
 
-        output_record = {
-            'recordId': record['recordId'],
-            'result': 'Ok',
-            'data': base64.b64encode(payload)
-        }
-        output.append(output_record)
+METRIC_EVENTS_TRANSFORMED = "Events transformed"
+METRIC_EVENTS_FAILED = "Events failed"
+DIMENSION_EVENT_TYPE = "event-type"
 
-    print('Successfully processed {} records.'.format(len(event['records'])))
+# ---------------------------------------------------------------------------------------------------------------------
+# Create the dynamic partition keys for an event: event type, service and date.
+# ---------------------------------------------------------------------------------------------------------------------
 
-    return {'records': output}
+def to_partition_key_value(value):
+    return PARTITION_KEY_VALUE_PATTERN.sub("-", (value or lambda_events.UNKNOWN).lower()).strip("-") or lambda_events.UNKNOWN
 
-import logging
-import json
+def create_partition_keys(fields):
+    return {
+        "event_type": to_partition_key_value(fields["event-type"]),
+        "service": to_partition_key_value(fields["service"]),
+        "date": to_partition_key_value(fields["date"])
+    }
 
 # ---------------------------------------------------------------------------------------------------------------------
-# Main.
+# Transform the records of a batch into newline-delimited JSON in the flat schema.
 # ---------------------------------------------------------------------------------------------------------------------
 
-def lambda_handler(event, context):
+def create_failed_record(record_id, data):
+    return { "recordId": record_id, "result": RESULT_PROCESSING_FAILED, "data": data }
+
+@instrumentation.stage("transform_records")
+def transform_records(records):
+    output = []
+    budget = MAX_RESPONSE_BYTES
+    for record in records:
+        record_id = record["recordId"]
+        try:
+            # json.loads takes the decoded bytes as they are, no need for another string copy.
+            fields, message = lambda_events.normalize(base64.b64decode(record["data"]))
+            data = base64.b64encode(lambda_events.encode(fields, message).encode("utf-8")).decode("ascii")
+        except Exception as ex:
+            LOGGER.exception("Something went wrong with transforming record %s.", record_id)
+            LOGGER.exception(ex)
+            metrics.add_count(METRIC_EVENTS_FAILED)
+            data = record["data"]
+            if len(data) + RECORD_OVERHEAD_BYTES > budget:
+                # Firehose keeps the original record either way, returning it is just for the error output's sake.
+                LOGGER.warning("Response size limit reached, record %s goes to the error output as it is.", record_id)
+                data = ""
+            output.append(create_failed_record(record_id, data))
+            budget -= len(data) + RECORD_OVERHEAD_BYTES
+            continue
+
+        if len(data) + RECORD_OVERHEAD_BYTES > budget:
+            # Firehose delivers the original record to the error output, there is no point in returning it once more.
+            LOGGER.warning("Response size limit reached, record %s goes to the error output.", record_id)
+            metrics.add_count(METRIC_EVENTS_FAILED)
+            output.append(create_failed_record(record_id, ""))
+            continue
+        budget -= len(data) + RECORD_OVERHEAD_BYTES
+        metrics.add_count(METRIC_EVENTS_TRANSFORMED, 1, { DIMENSION_EVENT_TYPE: fields["event-type"] })
+        output.append({
+            "recordId": record_id,
+            "result": RESULT_OK,
+            "data": data,
+            "metadata": { "partitionKeys": create_partition_keys(fields) }
+        })
+    return output
 
-    LOGGER = logging.getLogger(__name__)
-    LOGGER.setLevel(logging.DEBUG)
+# ---------------------------------------------------------------------------------------------------------------------
+# Lambda handler.
+# ---------------------------------------------------------------------------------------------------------------------
+
+@instrumentation.instrument_handler(LOGGER)
+def lambda_handler(event, context):
 
-    # We expect SNS messages coming in in a "Records" array, within each record, there's an object "Sns".
-    # Within that object:
-    # - The message body is in the "Message" object.
+    # We expect Firehose records coming in in a "records" array, each with its base64 encoded "data".
+    # The data is an SNS notification as SNS delivers it to Firehose. Within that notification:
+    # - The Lambda event published by a business service is in the "Message" object.
     # - Message meta data is in the "MessageAttributes" object.
-    for record in event["Records"]:
-        event_details = json.loads(record["Sns"]["Message"])
-        LOGGER.info(event_details)
+    output = transform_records(event["records"])
+    LOGGER.info("Transformed %d records.", sum(1 for record in output if record["result"] == RESULT_OK))
+    return { "records": output }
 
 # ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,62 @@
+import os
+import logging
+import json
+import datetime
+import boto3
+import object_storage
+import trace_index
+import metrics
+import instrumentation
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Globals.
+# ---------------------------------------------------------------------------------------------------------------------
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+ENV_TRACE_INDEX_BUCKET_NAME = "TRACE_INDEX_BUCKET_NAME"
+
+METRIC_POSTINGS_OBJECTS_MERGED = "Postings objects merged"
+METRIC_HOURS_FAILED = "Hours failed"
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Work out the days to look into: today and the day before (postings arriving around midnight), unless the event
+# names them.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def get_dates(event):
+    if event.get("dates"):
+        return [ datetime.datetime.strptime(date, "%Y-%m-%d").date().isoformat() for date in event["dates"] ]
+    today = datetime.datetime.utcnow().date()
+    return [ (today - datetime.timedelta(days=1)).isoformat(), today.isoformat() ]
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Merge the pending postings into the segments of their hours.
+# ---------------------------------------------------------------------------------------------------------------------
+
+@instrumentation.stage("compact_trace_index")
+def compact_trace_index(dates):
+    bucket_name = os.environ.get(ENV_TRACE_INDEX_BUCKET_NAME)
+    LOGGER.debug("bucket_name: %s", bucket_name)
+    storage = object_storage.S3Storage(boto3.client("s3"), bucket_name)
+    return trace_index.compact_dates(LOGGER, storage, dates)
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Lambda handler.
+# ---------------------------------------------------------------------------------------------------------------------
+
+@instrumentation.instrument_handler(LOGGER)
+def lambda_handler(event, context):
+
+    dates = get_dates(event)
+    summaries = compact_trace_index(dates)
+    failed = [ summary for summary in summaries if "error" in summary ]
+    metrics.add_count(METRIC_POSTINGS_OBJECTS_MERGED, sum(summary.get("inputs", 0) for summary in summaries))
+    metrics.add_count(METRIC_HOURS_FAILED, len(failed))
+    LOGGER.info("Compacted the trace index of %d hours: %s", len(summaries), json.dumps(summaries))
+    if failed:
+        raise RuntimeError("Compacting the trace index of %d of %d hours failed." % (len(failed), len(summaries)))
+    return { "dates": dates, "hours": summaries }
+
+# ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1 @@
+../../../lib/object_storage.py
\ No newline at end of file
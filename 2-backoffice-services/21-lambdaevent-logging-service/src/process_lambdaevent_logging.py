@@ -1,5 +1,12 @@
+import os
 import logging
 import json
+import time
+import boto3
+import lambda_events
+import trace_index
+import metrics
+import instrumentation
 
 # ---------------------------------------------------------------------------------------------------------------------
 # Globals.
@@ -8,18 +15,51 @@ import json
 LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.INFO)
 
+ENV_TRACE_POSTINGS_STREAM_NAME = "TRACE_POSTINGS_STREAM_NAME"
+
+METRIC_EVENTS_INDEXED = "Events indexed"
+METRIC_POSTINGS = "Postings"
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Index the events: the IDs they are about, and where they were logged.
+# ---------------------------------------------------------------------------------------------------------------------
+
+@instrumentation.stage("index_events")
+def index_events(postings):
+    stream_name = os.environ.get(ENV_TRACE_POSTINGS_STREAM_NAME)
+    LOGGER.debug("stream_name: %s", stream_name)
+    trace_index.put_postings(LOGGER, boto3.client("firehose"), stream_name, postings)
+
 # ---------------------------------------------------------------------------------------------------------------------
 # Lambda handler.
 # ---------------------------------------------------------------------------------------------------------------------
 
+@instrumentation.instrument_handler(LOGGER)
 def lambda_handler(event, context):
 
     # We expect SNS messages coming in in a "Records" array, within each record, there's an object "Sns".
     # Within that object:
     # - The message body is in the "Message" object.
     # - Message meta data is in the "MessageAttributes" object.
+    postings = []
     for record in event["Records"]:
-        event_details = json.loads(record["Sns"]["Message"])
-        LOGGER.info(event_details)
+        notification = record["Sns"]
+        # One line per event, with the message ID to find it by.
+        LOGGER.info("Lambda event %s: %s", notification["MessageId"], notification["Message"])
+        logged_at = int(time.time() * 1000)
+        try:
+            fields, _ = lambda_events.describe_notification(notification)
+        except ValueError as ex:
+            # Logged as it is, but there's nothing to index.
+            LOGGER.exception("Something went wrong with describing event %s.", notification["MessageId"])
+            LOGGER.exception(ex)
+            continue
+        postings.extend(trace_index.create_postings(fields, context.log_group_name, context.log_stream_name, logged_at))
+        metrics.add_count(METRIC_EVENTS_INDEXED, 1, { "event-type": fields["event-type"] })
+
+    # If the postings can't be put, the invocation fails and SNS delivers the event again.
+    if postings:
+        index_events(postings)
+    metrics.add_count(METRIC_POSTINGS, len(postings))
 
 # ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,117 @@
+import os
+import logging
+import json
+import time
+import datetime
+import concurrent.futures
+import boto3
+import object_storage
+import trace_index
+import metrics
+import instrumentation
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Globals.
+# ---------------------------------------------------------------------------------------------------------------------
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+ENV_TRACE_INDEX_BUCKET_NAME = "TRACE_INDEX_BUCKET_NAME"
+
+# Events are fetched from the logs for the first postings of a trace only.
+MAX_EVENTS = 100
+# The log line of an event is written right before its logged-at timestamp is taken.
+LOG_WINDOW_BEFORE_MILLIS = 1000
+LOG_WINDOW_AFTER_MILLIS = 5000
+# FilterLogEvents may return empty pages while there is more to search - but not forever.
+MAX_FILTER_PAGES = 10
+# FilterLogEvents is throttled at a few calls per second per account, so only a few go at once.
+FETCH_THREADS = 4
+# Whatever isn't fetched by then is left out, so that the postings are returned in any case.
+FETCH_RESERVE_SECS = 2
+
+METRIC_TRACE_POSTINGS = "Trace postings"
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Work out what to look for: one of the IDs, in the given days - today and the day before by default.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def get_id(event):
+    for id_name, _ in trace_index.ID_FIELDS:
+        if event.get(id_name):
+            return id_name, event[id_name]
+    raise ValueError("Expected one of %s." % ", ".join(id_name for id_name, _ in trace_index.ID_FIELDS))
+
+def get_dates(event):
+    if event.get("dates"):
+        return [ datetime.datetime.strptime(date, "%Y-%m-%d").date().isoformat() for date in event["dates"] ]
+    today = datetime.datetime.utcnow().date()
+    return [ (today - datetime.timedelta(days=1)).isoformat(), today.isoformat() ]
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Look up the trace, and fetch its events from where they were logged.
+# ---------------------------------------------------------------------------------------------------------------------
+
+@instrumentation.stage("lookup_postings")
+def lookup_postings(id_name, id_value, dates):
+    bucket_name = os.environ.get(ENV_TRACE_INDEX_BUCKET_NAME)
+    LOGGER.debug("bucket_name: %s", bucket_name)
+    storage = object_storage.S3Storage(boto3.client("s3"), bucket_name)
+    return trace_index.lookup(storage, id_name, id_value, dates)
+
+def fetch_event(logs_client, posting, deadline):
+    arguments = {
+        "logGroupName": posting["log-group"],
+        "logStreamNames": [ posting["log-stream"] ],
+        "startTime": posting["logged-at"] - LOG_WINDOW_BEFORE_MILLIS,
+        "endTime": posting["logged-at"] + LOG_WINDOW_AFTER_MILLIS,
+        "filterPattern": "\"%s\"" % posting["event-id"]
+    }
+    for _ in range(MAX_FILTER_PAGES):
+        if time.monotonic() >= deadline:
+            break
+        response = logs_client.filter_log_events(**arguments)
+        for log_event in response.get("events", []):
+            # "Lambda event <message ID>: <event>", possibly behind the log level and request ID.
+            _, separator, message = log_event["message"].partition("Lambda event %s: " % posting["event-id"])
+            if separator:
+                return json.loads(message)
+        if not response.get("nextToken"):
+            break
+        arguments["nextToken"] = response["nextToken"]
+    return None
+
+@instrumentation.stage("fetch_events")
+def fetch_events(postings, deadline):
+    logs_client = boto3.client("logs")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=FETCH_THREADS) as executor:
+        futures = [ (posting, executor.submit(fetch_event, logs_client, posting, deadline)) for posting in postings[:MAX_EVENTS] ]
+        for posting, future in futures:
+            try:
+                posting["event"] = future.result()
+            except Exception as ex:
+                # The trace is there even without the event, e.g. once the log has expired.
+                LOGGER.exception("Something went wrong with fetching event %s.", posting["event-id"])
+                LOGGER.exception(ex)
+    fetched = sum(1 for posting in postings if posting.get("event") is not None)
+    LOGGER.info("Fetched %d of %d events.", fetched, min(len(postings), MAX_EVENTS))
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Lambda handler.
+# ---------------------------------------------------------------------------------------------------------------------
+
+@instrumentation.instrument_handler(LOGGER)
+def lambda_handler(event, context):
+
+    # We expect e.g. { "correlation-id": "...", "dates": ["2026-10-19"], "with-events": true } from a direct invocation.
+    id_name, id_value = get_id(event)
+    dates = get_dates(event)
+    postings = lookup_postings(id_name, id_value, dates)
+    metrics.add_count(METRIC_TRACE_POSTINGS, len(postings))
+    LOGGER.info("Found %d events for %s %s.", len(postings), id_name, id_value)
+    if event.get("with-events"):
+        fetch_events(postings, time.monotonic() + context.get_remaining_time_in_millis() / 1000 - FETCH_RESERVE_SECS)
+    return { id_name: id_value, "dates": dates, "events": postings }
+
+# ---------------------------------------------------------------------------------------------------------------------
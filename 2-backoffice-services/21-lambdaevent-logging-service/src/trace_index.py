@@ -0,0 +1 @@
+../../../lib/trace_index.py
\ No newline at end of file
@@ -0,0 +1,99 @@
+import json
+import time
+import random
+import collections
+import metrics
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Batch processing of SNS notifications buffered in an SQS queue: records are persisted with BatchWriteItem, and the
+# records that failed are reported back to the event source mapping (ReportBatchItemFailures), so that only those
+# become visible in the queue again - instead of the whole batch.
+# ---------------------------------------------------------------------------------------------------------------------
+
+# BatchWriteItem takes up to 25 put requests per call.
+MAX_ITEMS_PER_BATCH_WRITE = 25
+# Unprocessed items (throttling) are written again with exponential backoff and jitter, the rest is left to redelivery.
+MAX_BATCH_WRITE_ATTEMPTS = 4
+BATCH_WRITE_BACKOFF_SECS = 0.05
+
+METRIC_BATCH_SIZE = "Batch size"
+METRIC_BATCH_FAILURES = "Batch failures"
+METRIC_BATCH_THROUGHPUT = "Batch throughput"
+METRIC_TIME_PER_RECORD = "Time per record"
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Read records coming in from SNS directly or through an SQS subscription.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def get_message_id(record):
+    if "Sns" in record:
+        return record["Sns"]["MessageId"]
+    return record["messageId"]
+
+def extract_sns_message(record):
+    if "Sns" in record:
+        return record["Sns"]["Message"]
+    # Without raw message delivery, the SQS message body is the SNS notification as a whole.
+    return json.loads(record["body"])["Message"]
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Persist items with BatchWriteItem, keeping track of the messages they came from.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def get_key(item, key_attributes):
+    return tuple(json.dumps(item[attribute], sort_keys=True) for attribute in key_attributes)
+
+def write_chunk(LOGGER, ddb_client, table_name, requests):
+    # Returns the put requests that still weren't processed after the last attempt.
+    for attempt in range(1, MAX_BATCH_WRITE_ATTEMPTS + 1):
+        response = ddb_client.batch_write_item(RequestItems = { table_name: requests })
+        requests = (response.get("UnprocessedItems") or {}).get(table_name, [])
+        if not requests:
+            return []
+        LOGGER.warning("%d items were not processed (attempt #%d).", len(requests), attempt)
+        if attempt < MAX_BATCH_WRITE_ATTEMPTS:
+            time.sleep(random.uniform(0, BATCH_WRITE_BACKOFF_SECS * 2 ** attempt))
+    return requests
+
+def batch_write_items(LOGGER, ddb_client, table_name, items, key_attributes):
+    # Takes (message ID, item) pairs and returns the IDs of the messages whose items couldn't be written.
+    # BatchWriteItem rejects requests with the same key twice, so the last item per key wins, as with consecutive puts.
+    items_per_key = collections.OrderedDict()
+    message_ids_per_key = {}
+    for message_id, item in items:
+        key = get_key(item, key_attributes)
+        items_per_key[key] = item
+        message_ids_per_key.setdefault(key, []).append(message_id)
+
+    keys = list(items_per_key.keys())
+    failed_message_ids = set()
+    for start in range(0, len(keys), MAX_ITEMS_PER_BATCH_WRITE):
+        chunk_keys = keys[start:start + MAX_ITEMS_PER_BATCH_WRITE]
+        requests = [ { "PutRequest": { "Item": items_per_key[key] } } for key in chunk_keys ]
+        try:
+            unprocessed_keys = [ get_key(request["PutRequest"]["Item"], key_attributes)
+                for request in write_chunk(LOGGER, ddb_client, table_name, requests) ]
+        except Exception as ex:
+            LOGGER.exception("Something went wrong with writing a batch of %d items.", len(requests))
+            LOGGER.exception(ex)
+            unprocessed_keys = chunk_keys
+        for key in unprocessed_keys:
+            failed_message_ids.update(message_ids_per_key[key])
+    return failed_message_ids
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Report the outcome of a batch.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def create_batch_response(failed_message_ids):
+    return { "batchItemFailures": [ { "itemIdentifier": message_id } for message_id in sorted(failed_message_ids) ] }
+
+def put_batch_metrics(records, failures, secs):
+    metrics.put_value(METRIC_BATCH_SIZE, records, metrics.UNIT_COUNT)
+    metrics.add_count(METRIC_BATCH_FAILURES, failures)
+    if records > 0:
+        metrics.add_timing(METRIC_TIME_PER_RECORD, secs * 1000 / records)
+    if secs > 0:
+        metrics.put_value(METRIC_BATCH_THROUGHPUT, round(records / secs, 1), metrics.UNIT_COUNT_PER_SECOND)
+
+# ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,332 @@
+import os
+import sys
+import json
+import time
+import math
+import random
+import datetime
+import collections
+from botocore.exceptions import ClientError
+import quantile_sketch
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Streaming detection of extraordinary rides: a ride is extraordinary when its fare or distance is above a percentile
+# of the rides on the same route or of the same unicorn. Each scope (route, unicorn) keeps a KLL sketch per attribute,
+# so memory per scope is constant no matter how many rides there were.
+# Sketches are stored per scope and month, thresholds come from the current and the previous month merged - seasons
+# change the thresholds within weeks. Each container adds its rides to a local delta sketch and merges the deltas into
+# the stored sketches now and then, which is what makes the sketches of all containers add up.
+# A ride is flagged as soon as one of its thresholds (attribute and scope) is exceeded, so each threshold is set at a
+# Bonferroni-corrected percentile: that way, the share of rides flagged stays below 100 - EXTRAORDINARY_PERCENTILE
+# percent, rather than adding up across the thresholds.
+# Scopes without enough rides yet fall back to the static rule the SNS filter policy used to implement.
+# ---------------------------------------------------------------------------------------------------------------------
+
+ENV_SKETCHES_TABLE_NAME = "SKETCHES_TABLE_NAME"
+ENV_EXTRAORDINARY_PERCENTILE = "EXTRAORDINARY_PERCENTILE"
+ENV_SKETCH_MIN_RIDES = "SKETCH_MIN_RIDES"
+ENV_SKETCH_SYNC_INTERVAL_SECS = "SKETCH_SYNC_INTERVAL_SECS"
+ENV_SKETCH_RETENTION_IN_DAYS = "SKETCH_RETENTION_IN_DAYS"
+
+DEFAULT_EXTRAORDINARY_PERCENTILE = 99.0
+DEFAULT_SKETCH_MIN_RIDES = 200
+DEFAULT_SKETCH_SYNC_INTERVAL_SECS = 60
+DEFAULT_SKETCH_RETENTION_IN_DAYS = 90
+
+# The static rule for cold scopes (both have to be met).
+STATIC_MIN_FARE = 100
+STATIC_MIN_DISTANCE = 1000
+
+ATTRIBUTES = ["fare", "distance"]
+
+SCOPE_ROUTE = "route"
+SCOPE_UNICORN = "unicorn"
+SCOPE_STATIC = "static"
+
+# A ride is checked against the thresholds of each attribute in each of its scopes (unicorn, route).
+MAX_THRESHOLDS_PER_RIDE = len(ATTRIBUTES) * len([SCOPE_UNICORN, SCOPE_ROUTE])
+
+ATTR_SCOPE_KEY = "scope-key"
+ATTR_MONTH = "month"
+ATTR_VERSION = "version"
+ATTR_EXPIRES_AT = "expires-at"
+
+# Sketch updates are optimistic (conditional on the version read), concurrent updates make us try again.
+MAX_MERGE_ATTEMPTS = 5
+# Computing a quantile sorts the sketch, so thresholds are only computed again once a sketch grew by this share.
+THRESHOLD_REFRESH_SHARE = 1.0 / 32
+# BatchGetItem takes up to 100 keys per call.
+MAX_KEYS_PER_BATCH_GET = 100
+
+# The verdict for a ride: flagged or not, and why (scope, attribute, threshold) if so.
+Verdict = collections.namedtuple("Verdict", ["extraordinary", "scope", "attribute", "threshold"])
+
+def get_scope_keys(ride_details):
+    scope_keys = [ SCOPE_UNICORN + "#" + ride_details["unicorn-id"] ]
+    if ride_details.get("from") and ride_details.get("to"):
+        scope_keys.append(SCOPE_ROUTE + "#" + ride_details["from"] + "#" + ride_details["to"])
+    return scope_keys
+
+def get_scope(scope_key):
+    return scope_key.split("#", 1)[0]
+
+def get_month(day):
+    return day.strftime("%Y-%m")
+
+def get_previous_month(day):
+    return get_month(day.replace(day=1) - datetime.timedelta(days=1))
+
+def parse_attribute(value):
+    # Fares and distances come from unicorns, anything that isn't a finite number can't be sketched.
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError("Expected a number, got " + repr(value) + ".")
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError("Expected a finite number, got " + repr(value) + ".")
+    return number
+
+def is_extraordinary_by_static_rule(fare, distance):
+    return float(fare) >= STATIC_MIN_FARE and float(distance) >= STATIC_MIN_DISTANCE
+
+# ---------------------------------------------------------------------------------------------------------------------
+# The detector, one per container.
+# ---------------------------------------------------------------------------------------------------------------------
+
+class Detector:
+
+    def __init__(self, percentile=DEFAULT_EXTRAORDINARY_PERCENTILE, min_rides=DEFAULT_SKETCH_MIN_RIDES,
+            sync_interval_secs=DEFAULT_SKETCH_SYNC_INTERVAL_SECS, k=quantile_sketch.DEFAULT_K):
+        # The percentile of each threshold, see MAX_THRESHOLDS_PER_RIDE.
+        self.q = 1.0 - (1.0 - percentile / 100.0) / MAX_THRESHOLDS_PER_RIDE
+        self.min_rides = min_rides
+        self.sync_interval_secs = sync_interval_secs
+        self.k = k
+        # Scope key -> attribute -> sketch: the stored sketches plus the local rides, for the thresholds.
+        self.views = {}
+        # Scope key -> attribute -> sketch: the local rides not merged into the stored sketches yet.
+        self.deltas = {}
+        # Scope key -> when its view was loaded from the stored sketches.
+        self.loaded_at = {}
+        # (Scope key, attribute) -> (threshold, count of the view when it was computed).
+        self.thresholds = {}
+        self.synced_at = time.monotonic()
+
+    def create_sketches(self):
+        return { attribute: quantile_sketch.KllSketch(self.k) for attribute in ATTRIBUTES }
+
+    def get_stale_scope_keys(self, scope_keys, now=None):
+        now = now or time.monotonic()
+        return [ scope_key for scope_key in scope_keys
+            if now - self.loaded_at.get(scope_key, -self.sync_interval_secs) >= self.sync_interval_secs ]
+
+    def load(self, scope_key, stored_sketches, now=None):
+        # Stored sketches of all months that count, the local rides not merged yet go on top.
+        view = self.create_sketches()
+        for sketches in stored_sketches + [ self.deltas.get(scope_key, {}) ]:
+            for attribute, sketch in sketches.items():
+                view[attribute].merge(sketch)
+        self.views[scope_key] = view
+        self.loaded_at[scope_key] = now or time.monotonic()
+        for attribute in ATTRIBUTES:
+            self.thresholds.pop((scope_key, attribute), None)
+
+    def get_threshold(self, scope_key, attribute):
+        view = self.views.get(scope_key)
+        if view is None or view[attribute].n < self.min_rides:
+            return None
+        sketch = view[attribute]
+        key = (scope_key, attribute)
+        cached = self.thresholds.get(key)
+        if cached is None or sketch.n - cached[1] > cached[1] * THRESHOLD_REFRESH_SHARE:
+            cached = (sketch.quantile(self.q), sketch.n)
+            self.thresholds[key] = cached
+        return cached[0]
+
+    def classify(self, rides):
+        # Takes ride details (with their attributes checked by parse_attribute) and returns a verdict for each. The batch's rides are added to the sketches afterwards,
+        # so that a batch of outliers doesn't raise its own bar.
+        verdicts = []
+        for ride_details in rides:
+            scope_keys = get_scope_keys(ride_details)
+            verdict = None
+            warm = False
+            for scope_key in scope_keys:
+                for attribute in ATTRIBUTES:
+                    threshold = self.get_threshold(scope_key, attribute)
+                    if threshold is None:
+                        continue
+                    warm = True
+                    if float(ride_details[attribute]) > threshold:
+                        verdict = Verdict(True, get_scope(scope_key), attribute, threshold)
+                        break
+                if verdict is not None:
+                    break
+            if verdict is None:
+                if warm:
+                    verdict = Verdict(False, None, None, None)
+                elif is_extraordinary_by_static_rule(ride_details["fare"], ride_details["distance"]):
+                    verdict = Verdict(True, SCOPE_STATIC, None, None)
+                else:
+                    verdict = Verdict(False, SCOPE_STATIC, None, None)
+            verdicts.append(verdict)
+
+        for ride_details in rides:
+            for scope_key in get_scope_keys(ride_details):
+                view = self.views.setdefault(scope_key, self.create_sketches())
+                delta = self.deltas.setdefault(scope_key, self.create_sketches())
+                for attribute in ATTRIBUTES:
+                    value = float(ride_details[attribute])
+                    view[attribute].update(value)
+                    delta[attribute].update(value)
+        return verdicts
+
+    def is_sync_due(self, now=None):
+        return bool(self.deltas) and (now or time.monotonic()) - self.synced_at >= self.sync_interval_secs
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Read and write the stored sketches: one item per scope and month, one binary attribute per sketched attribute.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def parse_sketch_item(item):
+    sketches = { attribute: quantile_sketch.KllSketch.from_bytes(item[attribute]["B"]) for attribute in ATTRIBUTES if attribute in item }
+    return sketches, int(item[ATTR_VERSION]["N"])
+
+def read_sketches(ddb_client, table_name, scope_keys, months):
+    # Returns scope key -> month -> (sketches, version), for the items that exist.
+    keys = [ { ATTR_SCOPE_KEY: { "S": scope_key }, ATTR_MONTH: { "S": month } } for scope_key in scope_keys for month in months ]
+    stored = {}
+    for start in range(0, len(keys), MAX_KEYS_PER_BATCH_GET):
+        request_items = { table_name: { "Keys": keys[start:start + MAX_KEYS_PER_BATCH_GET] } }
+        while request_items:
+            response = ddb_client.batch_get_item(RequestItems = request_items)
+            for item in response["Responses"].get(table_name, []):
+                stored.setdefault(item[ATTR_SCOPE_KEY]["S"], {})[item[ATTR_MONTH]["S"]] = parse_sketch_item(item)
+            request_items = response.get("UnprocessedKeys") or {}
+    return stored
+
+def write_sketches(ddb_client, table_name, scope_key, month, sketches, seen_version, expires_at):
+    item = {
+        ATTR_SCOPE_KEY: { "S": scope_key },
+        ATTR_MONTH: { "S": month },
+        ATTR_VERSION: { "N": str(seen_version + 1) },
+        ATTR_EXPIRES_AT: { "N": str(expires_at) }
+    }
+    for attribute, sketch in sketches.items():
+        item[attribute] = { "B": sketch.to_bytes() }
+    put_args = {
+        "TableName": table_name,
+        "Item": item,
+        "ExpressionAttributeNames": { "#version": ATTR_VERSION }
+    }
+    if seen_version == 0:
+        put_args["ConditionExpression"] = "attribute_not_exists(#version)"
+    else:
+        put_args["ConditionExpression"] = "#version = :seen"
+        put_args["ExpressionAttributeValues"] = { ":seen": { "N": str(seen_version) } }
+    ddb_client.put_item(**put_args)
+
+def merge_delta(LOGGER, ddb_client, table_name, scope_key, month, delta, expires_at, stored=None):
+    for attempt in range(1, MAX_MERGE_ATTEMPTS + 1):
+        if stored is None:
+            stored = read_sketches(ddb_client, table_name, [ scope_key ], [ month ]).get(scope_key, {}).get(month)
+        sketches, version = stored or ({}, 0)
+        merged = { attribute: quantile_sketch.KllSketch(delta[attribute].k).merge(delta[attribute]) for attribute in ATTRIBUTES }
+        for attribute, sketch in sketches.items():
+            merged[attribute].merge(sketch)
+        try:
+            write_sketches(ddb_client, table_name, scope_key, month, merged, version, expires_at)
+        except ClientError as ex:
+            if ex.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            LOGGER.debug("Sketches of %s were updated concurrently (attempt #%d).", scope_key, attempt)
+            stored = None
+            time.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+        else:
+            return
+    raise RuntimeError("Couldn't merge the sketches of " + scope_key + " after " + str(MAX_MERGE_ATTEMPTS) + " attempts.")
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Bring a detector in sync with the stored sketches: load stale views, merge the local deltas.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def get_months(today=None):
+    today = today or datetime.datetime.utcnow().date()
+    return [ get_month(today), get_previous_month(today) ]
+
+def load_views(LOGGER, ddb_client, table_name, detector, scope_keys):
+    stale_scope_keys = detector.get_stale_scope_keys(scope_keys)
+    if not stale_scope_keys:
+        return 0
+    months = get_months()
+    stored = read_sketches(ddb_client, table_name, stale_scope_keys, months)
+    for scope_key in stale_scope_keys:
+        stored_sketches = [ stored[scope_key][month][0] for month in months if month in stored.get(scope_key, {}) ]
+        detector.load(scope_key, stored_sketches)
+    LOGGER.debug("Loaded the sketches of %d scopes.", len(stale_scope_keys))
+    return len(stale_scope_keys)
+
+def sync_deltas(LOGGER, ddb_client, table_name, detector, retention_in_days):
+    month = get_months()[0]
+    expires_at = int(time.time()) + retention_in_days * 86400
+    merged = 0
+    for scope_key in list(detector.deltas.keys()):
+        try:
+            merge_delta(LOGGER, ddb_client, table_name, scope_key, month, detector.deltas[scope_key], expires_at)
+        except Exception as ex:
+            # The delta stays, it is merged with the next sync.
+            LOGGER.exception("Something went wrong with merging the sketches of %s.", scope_key)
+            LOGGER.exception(ex)
+        else:
+            del detector.deltas[scope_key]
+            # The view is loaded again with the next ride of the scope, including the other containers' rides.
+            detector.loaded_at.pop(scope_key, None)
+            merged += 1
+    detector.synced_at = time.monotonic()
+    return merged
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Benchmark classification throughput and flag rates, e.g. python extraordinary_rides.py 200000 (number of rides).
+# ---------------------------------------------------------------------------------------------------------------------
+
+def simulate(rides_count, routes=500, unicorns=200, batch_size=100, percentile=DEFAULT_EXTRAORDINARY_PERCENTILE, seed=4711):
+    rng = random.Random(seed)
+    quantile_sketch._RANDOM.seed(seed)
+    locations = [ "L" + str(index) for index in range(50) ]
+    route_list = [ (rng.choice(locations), rng.choice(locations), rng.lognormvariate(5, 0.8)) for _ in range(routes) ]
+    rides = []
+    for index in range(rides_count):
+        from_location, to_location, distance = route_list[int(rng.paretovariate(1.2)) % routes]
+        ride_distance = distance * rng.lognormvariate(0, 0.1)
+        rides.append({
+            "unicorn-id": "unicorn-" + str(rng.randrange(unicorns)),
+            "from": from_location,
+            "to": to_location,
+            "distance": round(ride_distance, 2),
+            "fare": round(2.5 + ride_distance * 0.06 * rng.lognormvariate(0, 0.25), 2)
+        })
+
+    detector = Detector(percentile)
+    flagged = collections.Counter()
+    started_at = time.perf_counter()
+    for start in range(0, rides_count, batch_size):
+        for verdict in detector.classify(rides[start:start + batch_size]):
+            if verdict.extraordinary:
+                flagged[verdict.scope] += 1
+    secs = time.perf_counter() - started_at
+
+    retained = sum(sum(len(values) for values in sketch.levels) for view in detector.views.values() for sketch in view.values())
+    return {
+        "rides": rides_count,
+        "scopes": len(detector.views),
+        "rides-per-sec": int(rides_count / secs),
+        "flagged-share": round(sum(flagged.values()) / rides_count, 4),
+        "flagged-by-scope": dict(flagged),
+        "static-rule-share": round(sum(1 for ride in rides if is_extraordinary_by_static_rule(ride["fare"], ride["distance"])) / rides_count, 4),
+        "retained-values-per-scope": int(retained / len(detector.views))
+    }
+
+if __name__ == "__main__":
+    for rides_count in ([ int(sys.argv[1]) ] if len(sys.argv) > 1 else [ 10000, 100000, 500000 ]):
+        print(json.dumps(simulate(rides_count)))
+
+# ---------------------------------------------------------------------------------------------------------------------
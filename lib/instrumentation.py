@@ -0,0 +1,112 @@
+import os
+import time
+import functools
+import metrics
+import profiling
+import memory_tracking
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Globals.
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Instrumentation is on unless switched off explicitly.
+ENV_INSTRUMENTATION_ENABLED = "INSTRUMENTATION_ENABLED"
+
+METRIC_STAGE_DURATION = "Stage duration"
+METRIC_HANDLER_DURATION = "Handler duration"
+
+DIMENSION_STAGE = "stage"
+DIMENSION_START = "start"
+START_COLD = "cold"
+START_WARM = "warm"
+
+# The first invocation in a container is the cold one.
+_COLD_START = True
+
+# The environment doesn't change during the life of a container, so there is no need to look it up per stage.
+_ENABLED = os.environ.get(ENV_INSTRUMENTATION_ENABLED, "1").lower() not in ("0", "false", "no", "off")
+
+def is_enabled():
+    return _ENABLED
+
+def get_start_type():
+    return START_COLD if _COLD_START else START_WARM
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Time a named stage of a handler, as a context manager:
+#
+#     with instrumentation.stage("persist_rfq"):
+#         ...
+#
+# or as a decorator of a function that is a stage on its own:
+#
+#     @instrumentation.stage("publish_rfq")
+#     def publish_rfq(...):
+# ---------------------------------------------------------------------------------------------------------------------
+
+class Stage:
+
+    # One of these is created per stage and invocation, so it shouldn't carry a __dict__ around.
+    __slots__ = ("name", "started_at")
+
+    def __init__(self, name):
+        self.name = name
+        self.started_at = None
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.started_at is not None and is_enabled():
+            record_stage(self.name, (time.perf_counter() - self.started_at) * 1000)
+        return False
+
+    def __call__(self, function):
+        name = self.name
+
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            with Stage(name):
+                return function(*args, **kwargs)
+        return timed
+
+def stage(name):
+    return Stage(name)
+
+def record_stage(name, millis):
+    # Each value goes into the EMF line, so CloudWatch can give us p50/p95/p99 (and any other percentile) per stage.
+    metrics.add_timing(METRIC_STAGE_DURATION, millis, {
+        DIMENSION_STAGE: name,
+        DIMENSION_START: get_start_type()
+    })
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Decorator for Lambda handlers: times the whole invocation, tells cold from warm starts, tracks the peak memory and
+# writes the metrics of the invocation when it's done - whichever way it ends.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def instrument_handler(LOGGER):
+    def decorator(handler):
+
+        @functools.wraps(handler)
+        def instrumented(event, context):
+            global _COLD_START
+            if is_enabled():
+                memory_tracking.start_invocation()
+            started_at = time.perf_counter()
+            try:
+                # Runs the handler under a profiler if the invocation asks for it, see profiling.
+                return profiling.call_handler(LOGGER, handler, event, context)
+            finally:
+                if is_enabled():
+                    millis = (time.perf_counter() - started_at) * 1000
+                    metrics.add_timing(METRIC_HANDLER_DURATION, millis, { DIMENSION_START: get_start_type() })
+                    LOGGER.debug("Handler took %.3f ms (%s start).", millis, get_start_type())
+                    memory_tracking.finish_invocation(LOGGER, event, context)
+                _COLD_START = False
+                metrics.flush(LOGGER)
+        return instrumented
+    return decorator
+
+# ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,340 @@
+import json
+import datetime
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Lambda events published by the business services (aux_api.publish_apigw_lambda_event and
+# aux_processing.publish_sns_lambda_event) arrive as SNS notifications, with the Lambda event as the message. This
+# turns them into one flat schema: a few columns to partition and filter by, the IDs the event is about, and the
+# original Lambda event as it was published (spliced in as text, not encoded again).
+# ---------------------------------------------------------------------------------------------------------------------
+
+EVENT_TYPE_APIGW_REQUEST = "apigw-request"
+EVENT_TYPE_SNS_MESSAGE = "sns-message"
+EVENT_TYPE_SQS_MESSAGE = "sqs-message"
+EVENT_TYPE_UNKNOWN = "unknown"
+
+UNKNOWN = "unknown"
+
+# Flat schema: name -> type, in the order of the encoded fields. The Lambda event follows as "event".
+# This is the schema registered in the data catalog (LambdaEventTable in the datalake ingestion template), where the
+# partition fields are partition keys, names use underscores, and the event is a string column. Fields are only ever
+# added at the end, with a new schema version.
+SCHEMA_VERSION = 1
+FIELD_TYPES = [
+    ("event-id", "string"),
+    ("event-type", "string"),
+    ("service", "string"),
+    ("published-at", "string"),
+    ("date", "string"),
+    ("source", "string"),
+    ("http-method", "string"),
+    ("path", "string"),
+    ("records", "int"),
+    ("correlation-ids", "list<string>"),
+    ("customer-ids", "list<string>"),
+    ("unicorn-ids", "list<string>")
+]
+FIELDS = [ name for name, _ in FIELD_TYPES ]
+FIELD_EVENT = "event"
+PARTITION_FIELDS = ["event-type", "service", "date"]
+
+def get_column_name(field):
+    return field.replace("-", "_")
+
+# The IDs an event is about, wherever they show up (bodies, messages, query strings, message attributes).
+ID_NAMES = ["correlation-id", "customer-id", "unicorn-id"]
+# Message attributes carry the correlation ID with a prefix, e.g. "icp.correlation-id".
+ID_NAME_SEPARATOR = "."
+
+# Message attribute a publisher may set to name the service the event comes from.
+ATTR_SERVICE = "service"
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Collect the IDs from the parts of an event.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def add_ids(ids, data):
+    if not isinstance(data, dict):
+        return
+    for name, value in data.items():
+        id_name = name.rsplit(ID_NAME_SEPARATOR, 1)[-1]
+        if id_name in ids and isinstance(value, str) and value:
+            ids[id_name].add(value)
+
+def add_ids_from_json(ids, text):
+    # Bodies and messages are JSON documents most of the time, but they don't have to be.
+    if not text or not text.lstrip().startswith("{"):
+        return
+    try:
+        add_ids(ids, json.loads(text))
+    except ValueError:
+        pass
+
+def add_ids_from_attributes(ids, attributes):
+    # SNS ("Value"/"Type") and SQS ("stringValue"/"dataType") message attributes.
+    for name, attribute in (attributes or {}).items():
+        if isinstance(attribute, dict):
+            add_ids(ids, { name: attribute.get("Value", attribute.get("stringValue")) })
+
+def create_ids():
+    return { id_name: set() for id_name in ID_NAMES }
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Classify a Lambda event and describe it in the flat schema.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def get_event_type(event):
+    if "requestContext" in event and "httpMethod" in event:
+        return EVENT_TYPE_APIGW_REQUEST
+    records = event.get("Records")
+    if records:
+        event_source = records[0].get("EventSource") or records[0].get("eventSource")
+        if event_source == "aws:sns":
+            return EVENT_TYPE_SNS_MESSAGE
+        if event_source == "aws:sqs":
+            return EVENT_TYPE_SQS_MESSAGE
+    return EVENT_TYPE_UNKNOWN
+
+def get_arn_name(arn):
+    return arn.rsplit(":", 1)[-1] if arn else UNKNOWN
+
+def describe_event(event):
+    # Returns the event type, source (API, topic or queue), HTTP method, path, number of records and IDs.
+    event_type = get_event_type(event)
+    ids = create_ids()
+    source = UNKNOWN
+    http_method = None
+    path = None
+    records = 1
+    if event_type == EVENT_TYPE_APIGW_REQUEST:
+        request_context = event.get("requestContext") or {}
+        source = request_context.get("apiId") or UNKNOWN
+        http_method = event.get("httpMethod")
+        path = event.get("resource") or event.get("path")
+        add_ids(ids, event.get("queryStringParameters"))
+        add_ids(ids, event.get("pathParameters"))
+        add_ids_from_json(ids, event.get("body"))
+    elif event_type == EVENT_TYPE_SNS_MESSAGE:
+        records = len(event["Records"])
+        source = get_arn_name(event["Records"][0].get("Sns", {}).get("TopicArn"))
+        for record in event["Records"]:
+            add_ids_from_attributes(ids, record.get("Sns", {}).get("MessageAttributes"))
+            add_ids_from_json(ids, record.get("Sns", {}).get("Message"))
+    elif event_type == EVENT_TYPE_SQS_MESSAGE:
+        records = len(event["Records"])
+        source = get_arn_name(event["Records"][0].get("eventSourceARN"))
+        for record in event["Records"]:
+            add_ids_from_attributes(ids, record.get("messageAttributes"))
+            add_ids_from_json(ids, record.get("body"))
+    return event_type, source, http_method, path, records, ids
+
+def get_service(notification, source):
+    attribute = (notification.get("MessageAttributes") or {}).get(ATTR_SERVICE)
+    if attribute and attribute.get("Value"):
+        return attribute["Value"]
+    # Without the publisher telling, the API, topic or queue the event came from is the next best thing.
+    return source
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Normalize an SNS notification (as SNS delivers it to Firehose) carrying a Lambda event.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def normalize(notification_text):
+    # Returns the flat fields and the Lambda event's JSON text. Raises ValueError for anything that isn't one.
+    notification = json.loads(notification_text)
+    if not isinstance(notification, dict) or "Message" not in notification:
+        raise ValueError("Not an SNS notification.")
+    return describe_notification(notification)
+
+def describe_notification(notification):
+    # Same as normalize, for a notification that is decoded already - e.g. the "Sns" object of a record SNS delivers
+    # to Lambda, which has the same attributes.
+    message = notification["Message"]
+    event = json.loads(message)
+    if not isinstance(event, dict):
+        raise ValueError("Not a Lambda event.")
+
+    if "\n" in message or "\r" in message:
+        # Pretty-printed events would break the lines of newline-delimited JSON.
+        message = json.dumps(event, separators=(",", ":"))
+
+    event_type, source, http_method, path, records, ids = describe_event(event)
+    published_at = notification.get("Timestamp") or datetime.datetime.utcnow().isoformat() + "Z"
+    fields = {
+        "event-id": notification.get("MessageId"),
+        "event-type": event_type,
+        "service": get_service(notification, source),
+        "published-at": published_at,
+        "date": published_at[:10],
+        "source": source,
+        "http-method": http_method,
+        "path": path,
+        "records": records,
+        "correlation-ids": sorted(ids["correlation-id"]),
+        "customer-ids": sorted(ids["customer-id"]),
+        "unicorn-ids": sorted(ids["unicorn-id"])
+    }
+    return fields, message
+
+def encode(fields, message):
+    # One line of newline-delimited JSON: the flat fields with the Lambda event spliced in as it is.
+    encoded = json.dumps(fields, separators=(",", ":"))
+    return encoded[:-1] + ",\"" + FIELD_EVENT + "\":" + message + "}\n"
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Benchmark the raw tier formats for a representative day of events: SNS notifications as JSON in 1 MB objects (as
+# Firehose used to write them) versus Parquet partitioned like the delivery stream does now. Needs pyarrow, which the
+# functions don't, e.g. python lambda_events.py 200000 (number of events).
+# ---------------------------------------------------------------------------------------------------------------------
+
+RAW_OBJECT_BYTES = 1024 * 1024
+SERVICES = [ "ride-booking", "unicorn-management", "ride-management", "customer-loyalty", "extraordinary-rides" ]
+
+def create_notification(rng, index, day):
+    correlation_id = "%032x" % rng.getrandbits(128)
+    customer_id = "CUST-%04d" % rng.randrange(5000)
+    unicorn_id = "unicorn-%03d" % rng.randrange(300)
+    published_at = day + "T%02d:%02d:%02d.%03dZ" % (index * 24 // 100000 % 24, rng.randrange(60), rng.randrange(60), rng.randrange(1000))
+    kind = rng.random()
+    if kind < 0.6:
+        event = {
+            "resource": "/api/user/submit-rfq", "path": "/dev/api/user/submit-rfq", "httpMethod": "POST",
+            "headers": { "Accept": "*/*", "Content-Type": "application/json", "Host": "abc123.execute-api.eu-west-1.amazonaws.com",
+                "User-Agent": "curl/7.64.1", "X-Amzn-Trace-Id": "Root=1-" + correlation_id[:24], "X-Forwarded-For": "203.0.113.7",
+                "X-Forwarded-Port": "443", "X-Forwarded-Proto": "https" },
+            "queryStringParameters": None, "pathParameters": None,
+            "requestContext": { "apiId": "abc123", "stage": "dev", "requestId": correlation_id, "resourcePath": "/api/user/submit-rfq",
+                "identity": { "sourceIp": "203.0.113.7", "userAgent": "curl/7.64.1" }, "requestTimeEpoch": 1792380000000 + index },
+            "body": json.dumps({ "customer-id": customer_id, "from": "NYC", "to": "LAX", "timeout-in-secs": 30 })
+        }
+    else:
+        message = json.dumps({ "unicorn-id": unicorn_id, "customer-id": customer_id, "ride-id": "RIDE-%06d" % index,
+            "fare": round(rng.uniform(5, 400), 2), "distance": round(rng.uniform(1, 5000), 2), "correlation-id": correlation_id })
+        topic_arn = "arn:aws:sns:eu-west-1:123456789012:dev-wrbs-ride-completion-topic"
+        if kind < 0.9:
+            event = { "Records": [ { "EventSource": "aws:sns", "EventVersion": "1.0",
+                "Sns": { "Type": "Notification", "MessageId": correlation_id, "TopicArn": topic_arn, "Message": message,
+                    "Timestamp": published_at, "MessageAttributes": { "correlation-id": { "Type": "String", "Value": correlation_id } } } } ] }
+        else:
+            event = { "Records": [ { "messageId": correlation_id, "eventSource": "aws:sqs",
+                "eventSourceARN": "arn:aws:sqs:eu-west-1:123456789012:dev-wrbs-exri-ride-completion",
+                "body": json.dumps({ "Type": "Notification", "Message": message }), "messageAttributes": {} } ] }
+    return json.dumps({
+        "Type": "Notification", "MessageId": "%032x" % rng.getrandbits(128),
+        "TopicArn": "arn:aws:sns:eu-west-1:123456789012:dev-wrbs-lambda-events", "Message": json.dumps(event),
+        "Timestamp": published_at, "SignatureVersion": "1", "Signature": "x" * 344,
+        "MessageAttributes": { ATTR_SERVICE: { "Type": "String", "Value": rng.choice(SERVICES) } }
+    }), correlation_id
+
+def benchmark(count, directory, seed=4711):
+    import os
+    import time
+    import random
+    import pyarrow
+    import pyarrow.dataset
+    import pyarrow.parquet
+
+    rng = random.Random(seed)
+    day = "2026-10-19"
+    notifications = []
+    for index in range(count):
+        notifications.append(create_notification(rng, index, day))
+    wanted_correlation_id = notifications[count // 2][1]
+
+    # Raw tier as it was: notifications as they come, cut into 1 MB objects.
+    raw_directory = os.path.join(directory, "json")
+    os.makedirs(raw_directory, exist_ok=True)
+    raw_objects = 0
+    raw_bytes = 0
+    chunk = []
+    chunk_bytes = 0
+    for text, _ in notifications + [ (None, None) ]:
+        if text is None or chunk_bytes >= RAW_OBJECT_BYTES:
+            with open(os.path.join(raw_directory, "part-%06d" % raw_objects), "w") as raw_file:
+                raw_file.write("".join(chunk))
+            raw_objects += 1
+            raw_bytes += chunk_bytes
+            chunk = []
+            chunk_bytes = 0
+        if text is not None:
+            chunk.append(text + "\n")
+            chunk_bytes += len(text) + 1
+
+    # Raw tier as it is now: flat schema, Parquet, partitioned.
+    started_at = time.perf_counter()
+    rows = { get_column_name(field): [] for field in FIELDS + [ FIELD_EVENT ] }
+    for text, _ in notifications:
+        fields, message = normalize(text)
+        for field in FIELDS:
+            rows[get_column_name(field)].append(fields[field])
+        rows[FIELD_EVENT].append(message)
+    normalize_secs = time.perf_counter() - started_at
+    parquet_directory = os.path.join(directory, "parquet")
+    pyarrow.dataset.write_dataset(pyarrow.table(rows), parquet_directory, format="parquet",
+        partitioning=[ get_column_name(field) for field in PARTITION_FIELDS ], partitioning_flavor="hive",
+        file_options=pyarrow.dataset.ParquetFileFormat().make_write_options(compression="snappy"))
+    parquet_files = [ os.path.join(path, name) for path, _, names in os.walk(parquet_directory) for name in names ]
+    parquet_bytes = sum(os.path.getsize(path) for path in parquet_files)
+
+    def get_scanned_bytes(paths, columns):
+        scanned = 0
+        for path in paths:
+            metadata = pyarrow.parquet.ParquetFile(path).metadata
+            for row_group in range(metadata.num_row_groups):
+                for column in range(metadata.num_columns):
+                    chunk_metadata = metadata.row_group(row_group).column(column)
+                    if chunk_metadata.path_in_schema.split(".")[0] in columns:
+                        scanned += chunk_metadata.total_compressed_size
+        return scanned
+
+    results = { "events": count, "json-objects": raw_objects, "json-bytes": raw_bytes,
+        "parquet-files": len(parquet_files), "parquet-bytes": parquet_bytes, "normalize-ms": round(normalize_secs * 1000) }
+
+    # The JSON side of the queries is a plain scan of the lines, like a query engine reading the old raw tier would do:
+    # each notification is decoded, its Lambda event only where the query needs something from it.
+
+    # Query 1: the trace of one correlation ID (all event types and services of the day).
+    started_at = time.perf_counter()
+    found = 0
+    for name in sorted(os.listdir(raw_directory)):
+        with open(os.path.join(raw_directory, name)) as raw_file:
+            for line in raw_file:
+                found += wanted_correlation_id in json.loads(line)["Message"]
+    results["trace-json-ms"] = round((time.perf_counter() - started_at) * 1000)
+    results["trace-json-scanned-bytes"] = raw_bytes
+    started_at = time.perf_counter()
+    table = pyarrow.dataset.dataset(parquet_directory, format="parquet", partitioning="hive").to_table(columns=["correlation_ids", "event_id"])
+    found_parquet = sum(1 for correlation_ids in table.column("correlation_ids").to_pylist() if wanted_correlation_id in correlation_ids)
+    results["trace-parquet-ms"] = round((time.perf_counter() - started_at) * 1000)
+    results["trace-parquet-scanned-bytes"] = get_scanned_bytes(parquet_files, [ "correlation_ids", "event_id" ])
+    results["trace-found"] = [ found, found_parquet ]
+
+    # Query 2: API requests per path of one service - partition pruning on top of column pruning.
+    started_at = time.perf_counter()
+    requests_per_path = {}
+    for name in sorted(os.listdir(raw_directory)):
+        with open(os.path.join(raw_directory, name)) as raw_file:
+            for line in raw_file:
+                notification = json.loads(line)
+                if notification["MessageAttributes"][ATTR_SERVICE]["Value"] != SERVICES[0]:
+                    continue
+                event = json.loads(notification["Message"])
+                if "httpMethod" in event:
+                    requests_per_path[event["path"]] = requests_per_path.get(event["path"], 0) + 1
+    results["requests-json-ms"] = round((time.perf_counter() - started_at) * 1000)
+    results["requests-json-scanned-bytes"] = raw_bytes
+    partition = os.path.join(parquet_directory, "event_type=" + EVENT_TYPE_APIGW_REQUEST, "service=" + SERVICES[0])
+    partition_files = [ os.path.join(path, name) for path, _, names in os.walk(partition) for name in names ]
+    started_at = time.perf_counter()
+    pyarrow.dataset.dataset(partition_files, format="parquet").to_table(columns=["path"]).group_by("path").aggregate([ ("path", "count") ])
+    results["requests-parquet-ms"] = round((time.perf_counter() - started_at) * 1000)
+    results["requests-parquet-scanned-bytes"] = get_scanned_bytes(partition_files, [ "path" ])
+    return results
+
+if __name__ == "__main__":
+    import sys
+    import tempfile
+    with tempfile.TemporaryDirectory() as directory:
+        print(json.dumps(benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100000, directory)))
+
+# ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,213 @@
+import os
+import sys
+import json
+import time
+import zlib
+import heapq
+import random
+from botocore.exceptions import ClientError
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Sharded leaderboard: customers are spread across a fixed number of shards by a hash of their ID, and each shard item
+# keeps the top K customers of its shard only. Updating touches one shard item of bounded size, reading merges the
+# shards' sorted lists - neither depends on how many customers there are. The top K overall are always within the
+# union of the shards' top K, so the merge is exact.
+# Entries hold absolute balances, not increments, and balances only ever grow, so an update keeps the higher of the
+# balance on the list and the new one: a stale balance, delivered late or again, never takes a customer back. An update
+# that doesn't make it (it's only logged, see update_leaderboard's callers) stays missing until the next one of the
+# same customer.
+# ---------------------------------------------------------------------------------------------------------------------
+
+ENV_LEADERBOARD_TABLE_NAME = "LEADERBOARD_TABLE_NAME"
+ENV_LEADERBOARD_SHARDS = "LEADERBOARD_SHARDS"
+
+ATTR_SHARD = "shard"
+ATTR_ENTRIES = "entries"
+ATTR_VERSION = "version"
+
+DEFAULT_SHARDS = 8
+TOP_K = 100
+
+# Shard updates are optimistic (conditional on the version read), concurrent updates make us try again.
+MAX_UPDATE_ATTEMPTS = 5
+
+# Per-container cache of the lowest balance on each full shard: shard -> balance. Balances only ever grow, so a stale
+# value is too low at worst, which costs an unnecessary read, but never skips an update that would have mattered.
+_SHARD_THRESHOLDS = {}
+
+def get_shards():
+    return max(1, int(os.environ.get(ENV_LEADERBOARD_SHARDS, DEFAULT_SHARDS)))
+
+def get_shard(customer_id, shards):
+    # Stable across processes, unlike hash().
+    return zlib.crc32(customer_id.encode("utf-8")) % shards
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Pure top-K operations on lists of (customer ID, klebs), highest balance first (ties by customer ID).
+# ---------------------------------------------------------------------------------------------------------------------
+
+def sort_key(entry):
+    return (-entry[1], entry[0])
+
+def apply_balances(entries, balances, k=TOP_K):
+    merged = dict(entries)
+    for customer_id, klebs in balances.items():
+        merged[customer_id] = max(merged.get(customer_id, klebs), klebs)
+    return heapq.nsmallest(k, merged.items(), key=sort_key)
+
+def merge_shards(shard_entries, k=TOP_K):
+    merged = heapq.merge(*shard_entries, key=sort_key)
+    return [ entry for _, entry in zip(range(k), merged) ]
+
+def get_threshold(entries, k=TOP_K):
+    # The balance a customer needs to make it into a shard's list - anything goes as long as the list isn't full.
+    return entries[-1][1] if len(entries) >= k else None
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Read and write shard items.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def parse_shard_item(item):
+    if item is None:
+        return [], 0
+    entries = [ tuple(entry) for entry in json.loads(item[ATTR_ENTRIES]["S"]) ]
+    return entries, int(item[ATTR_VERSION]["N"])
+
+def read_shard(ddb_client, table_name, shard):
+    response = ddb_client.get_item(
+        TableName = table_name,
+        Key = { ATTR_SHARD: { "N": str(shard) } },
+        ConsistentRead = True
+    )
+    return parse_shard_item(response.get("Item"))
+
+def write_shard(ddb_client, table_name, shard, entries, seen_version):
+    item = {
+        ATTR_SHARD: { "N": str(shard) },
+        ATTR_ENTRIES: { "S": json.dumps(entries, separators=(",", ":")) },
+        ATTR_VERSION: { "N": str(seen_version + 1) }
+    }
+    if seen_version == 0:
+        condition_expression = "attribute_not_exists(#version)"
+        values = None
+    else:
+        condition_expression = "#version = :seen"
+        values = { ":seen": { "N": str(seen_version) } }
+    put_args = {
+        "TableName": table_name,
+        "Item": item,
+        "ConditionExpression": condition_expression,
+        "ExpressionAttributeNames": { "#version": ATTR_VERSION }
+    }
+    if values is not None:
+        put_args["ExpressionAttributeValues"] = values
+    ddb_client.put_item(**put_args)
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Update the leaderboard with new balances (customer ID -> klebs): at most one read and one write per shard touched.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def update_shard(LOGGER, ddb_client, table_name, shard, balances, k=TOP_K):
+    for attempt in range(1, MAX_UPDATE_ATTEMPTS + 1):
+        entries, version = read_shard(ddb_client, table_name, shard)
+        updated_entries = apply_balances(entries, balances, k)
+        threshold = get_threshold(updated_entries, k)
+        if threshold is not None:
+            _SHARD_THRESHOLDS[shard] = threshold
+        if updated_entries == entries:
+            LOGGER.debug("Leaderboard shard %d doesn't change.", shard)
+            return False
+        try:
+            write_shard(ddb_client, table_name, shard, updated_entries, version)
+        except ClientError as ex:
+            if ex.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            LOGGER.debug("Leaderboard shard %d was updated concurrently (attempt #%d).", shard, attempt)
+            time.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+        else:
+            LOGGER.debug("Leaderboard shard %d updated to version %d.", shard, version + 1)
+            return True
+    raise RuntimeError("Couldn't update leaderboard shard " + str(shard) + " after " + str(MAX_UPDATE_ATTEMPTS) + " attempts.")
+
+def update_leaderboard(LOGGER, ddb_client, table_name, balances, shards=None, k=TOP_K):
+    shards = shards or get_shards()
+    balances_per_shard = {}
+    for customer_id, klebs in balances.items():
+        shard = get_shard(customer_id, shards)
+        threshold = _SHARD_THRESHOLDS.get(shard)
+        # Customers below the bottom of a full shard can't make it in - and customers on the list are never below it.
+        if threshold is not None and klebs < threshold:
+            continue
+        balances_per_shard.setdefault(shard, {})[customer_id] = klebs
+    updated = 0
+    for shard, shard_balances in balances_per_shard.items():
+        if update_shard(LOGGER, ddb_client, table_name, shard, shard_balances, k):
+            updated += 1
+    return updated
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Read the top customers: one BatchGetItem for all shards, then a k-way merge.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def read_leaderboard(ddb_client, table_name, limit=TOP_K, shards=None):
+    shards = shards or get_shards()
+    keys = [ { ATTR_SHARD: { "N": str(shard) } } for shard in range(shards) ]
+    shard_entries = []
+    request_items = { table_name: { "Keys": keys } }
+    while request_items:
+        response = ddb_client.batch_get_item(RequestItems = request_items)
+        for item in response["Responses"].get(table_name, []):
+            shard_entries.append(parse_shard_item(item)[0])
+        request_items = response.get("UnprocessedKeys") or {}
+    return merge_shards(shard_entries, min(limit, TOP_K))
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Check against a brute-force baseline (sorting all balances) for correctness and throughput, e.g.
+# python leaderboard.py 100000 500000 (number of customers, number of credits).
+# ---------------------------------------------------------------------------------------------------------------------
+
+def simulate(customers, credits, shards=DEFAULT_SHARDS, k=TOP_K, seed=4711):
+    rng = random.Random(seed)
+    customer_ids = [ "customer-" + str(index) for index in range(customers) ]
+    # A few heavy riders and a long tail, like the real thing.
+    weights = [ 1.0 / (index + 1) ** 0.8 for index in range(customers) ]
+    credited = rng.choices(customer_ids, weights=weights, k=credits)
+    amounts = [ rng.randint(1, 60) for _ in range(credits) ]
+
+    balances = {}
+    shard_entries = [ [] for _ in range(shards) ]
+    thresholds = [ None ] * shards
+    started_at = time.perf_counter()
+    for customer_id, amount in zip(credited, amounts):
+        balance = balances.get(customer_id, 0) + amount
+        balances[customer_id] = balance
+        shard = get_shard(customer_id, shards)
+        if thresholds[shard] is not None and balance < thresholds[shard]:
+            continue
+        shard_entries[shard] = apply_balances(shard_entries[shard], { customer_id: balance }, k)
+        thresholds[shard] = get_threshold(shard_entries[shard], k)
+    sharded_update_secs = time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    sharded_top = merge_shards(shard_entries, k)
+    sharded_read_secs = time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    brute_force_top = heapq.nsmallest(k, balances.items(), key=sort_key)
+    brute_force_read_secs = time.perf_counter() - started_at
+
+    return {
+        "customers": customers,
+        "credits": credits,
+        "correct": sharded_top == brute_force_top,
+        "sharded-update-us": round(sharded_update_secs / credits * 1000000, 2),
+        "sharded-read-ms": round(sharded_read_secs * 1000, 3),
+        "brute-force-read-ms": round(brute_force_read_secs * 1000, 3)
+    }
+
+if __name__ == "__main__":
+    arguments = [ int(argument) for argument in sys.argv[1:3] ]
+    for customers in ([ arguments[0] ] if arguments else [ 1000, 10000, 100000 ]):
+        print(json.dumps(simulate(customers, arguments[1] if len(arguments) > 1 else customers * 5)))
+
+# ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,166 @@
+import time
+import datetime
+import threading
+import collections
+import boto3
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Globals.
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Limits of a single PutLogEvents call: every event counts with its UTF-8 size plus 26 bytes.
+MAX_BATCH_EVENTS = 10000
+MAX_BATCH_BYTES = 1048576
+EVENT_OVERHEAD_BYTES = 26
+
+# Flush triggers - whichever comes first.
+DEFAULT_FLUSH_EVENTS = 500
+DEFAULT_FLUSH_BYTES = 256 * 1024
+DEFAULT_FLUSH_AGE_SECS = 5
+
+# Beyond this, the oldest records are dropped rather than letting a broken log group eat up the container's memory.
+DEFAULT_MAX_BUFFERED_EVENTS = 20000
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Create the name of the daily log stream for a timestamp (in milliseconds since the epoch).
+# ---------------------------------------------------------------------------------------------------------------------
+
+def create_daily_log_stream_name(prefix, timestamp_ms):
+    return prefix + "_" + datetime.datetime.utcfromtimestamp(timestamp_ms / 1000).date().isoformat()
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Buffered log shipper: records are appended in memory and shipped by a background worker in batched PutLogEvents
+# calls, so the response path never waits for CloudWatch Logs. Lambda freezes the container between invocations, and
+# the worker with it: records left over from before a freeze are shipped as soon as the next invocation appends one.
+# Records still buffered when a frozen container is reclaimed are lost - at most those of the last flush_age_secs.
+# ---------------------------------------------------------------------------------------------------------------------
+
+class LogShipper:
+
+    def __init__(self, LOGGER, log_group_name, log_stream_prefix,
+                 flush_events=DEFAULT_FLUSH_EVENTS, flush_bytes=DEFAULT_FLUSH_BYTES,
+                 flush_age_secs=DEFAULT_FLUSH_AGE_SECS, max_buffered_events=DEFAULT_MAX_BUFFERED_EVENTS):
+        self.LOGGER = LOGGER
+        self.log_group_name = log_group_name
+        self.log_stream_prefix = log_stream_prefix
+        self.flush_events = min(flush_events, MAX_BATCH_EVENTS)
+        self.flush_bytes = min(flush_bytes, MAX_BATCH_BYTES)
+        self.flush_age_secs = flush_age_secs
+        self.max_buffered_events = max_buffered_events
+
+        self.lock = threading.Lock()
+        self.flush_requested = threading.Event()
+        # Buffered (timestamp_ms, message, size) tuples, plus what we need for the flush triggers.
+        self.buffer = collections.deque()
+        self.buffered_bytes = 0
+        self.oldest_buffered_at = None
+        self.dropped_events = 0
+        # Streams we know exist - creating them is a one-off per stream and container, not per request.
+        self.known_log_streams = set()
+        self.cw_logs = None
+        self.worker = None
+
+    def append(self, message, timestamp_ms=None):
+        if timestamp_ms is None:
+            timestamp_ms = int(round(time.time() * 1000))
+        size = len(message.encode("utf-8")) + EVENT_OVERHEAD_BYTES
+        with self.lock:
+            if not self.buffer:
+                self.oldest_buffered_at = time.monotonic()
+            self.buffer.append((timestamp_ms, message, size))
+            self.buffered_bytes += size
+            while len(self.buffer) > self.max_buffered_events:
+                self.buffered_bytes -= self.buffer.popleft()[2]
+                self.dropped_events += 1
+            # Either trigger, or the age one - which may have passed while the container was frozen.
+            flush_due = (len(self.buffer) >= self.flush_events or self.buffered_bytes >= self.flush_bytes
+                or time.monotonic() - self.oldest_buffered_at >= self.flush_age_secs)
+        self.ensure_worker()
+        if flush_due:
+            self.flush_requested.set()
+
+    def ensure_worker(self):
+        if self.worker is None or not self.worker.is_alive():
+            self.worker = threading.Thread(target=self.run_worker, name="log-shipper", daemon=True)
+            self.worker.start()
+
+    def run_worker(self):
+        while True:
+            # Wake up on a size trigger or at the latest when the oldest record is due because of its age.
+            self.flush_requested.wait(self.flush_age_secs)
+            self.flush_requested.clear()
+            with self.lock:
+                age = time.monotonic() - self.oldest_buffered_at if self.buffer else 0
+                flush_due = (len(self.buffer) >= self.flush_events or self.buffered_bytes >= self.flush_bytes
+                    or age >= self.flush_age_secs)
+            if flush_due:
+                self.flush()
+
+    def take_batch(self):
+        # Take as many records as fit into one PutLogEvents call.
+        with self.lock:
+            batch = []
+            batch_bytes = 0
+            while self.buffer and len(batch) < MAX_BATCH_EVENTS:
+                size = self.buffer[0][2]
+                if batch and batch_bytes + size > MAX_BATCH_BYTES:
+                    break
+                batch.append(self.buffer.popleft())
+                batch_bytes += size
+            self.buffered_bytes -= batch_bytes
+            self.oldest_buffered_at = time.monotonic() if self.buffer else None
+            return batch
+
+    def flush(self):
+        # Ship everything that is buffered right now, one batch after the other.
+        while True:
+            batch = self.take_batch()
+            if not batch:
+                break
+            # Records from around midnight may belong to different daily streams.
+            batches_per_stream = {}
+            for timestamp_ms, message, size in batch:
+                log_stream_name = create_daily_log_stream_name(self.log_stream_prefix, timestamp_ms)
+                batches_per_stream.setdefault(log_stream_name, []).append({
+                    "timestamp": timestamp_ms,
+                    "message": message
+                })
+            for log_stream_name, log_events in batches_per_stream.items():
+                self.put_log_events(log_stream_name, log_events)
+        if self.dropped_events:
+            self.LOGGER.warning("Dropped %d full request records since the log group couldn't keep up.", self.dropped_events)
+            self.dropped_events = 0
+
+    def put_log_events(self, log_stream_name, log_events):
+        try:
+            if self.cw_logs is None:
+                self.cw_logs = boto3.client("logs")
+            self.ensure_log_stream(log_stream_name)
+            # Events within one call must be in chronological order.
+            log_events.sort(key=lambda log_event: log_event["timestamp"])
+            response = self.cw_logs.put_log_events(
+                logGroupName = self.log_group_name,
+                logStreamName = log_stream_name,
+                logEvents = log_events
+            )
+        except Exception as ex:
+            # Shipping logs must never break anything else, so this batch is lost.
+            self.LOGGER.exception("Something went wrong with shipping %d records to %s.", len(log_events), log_stream_name)
+            self.LOGGER.exception(ex)
+            return 0
+        else:
+            self.LOGGER.debug("Shipped %d records to %s: %s", len(log_events), log_stream_name, response)
+            return 1
+
+    def ensure_log_stream(self, log_stream_name):
+        if log_stream_name in self.known_log_streams:
+            return
+        try:
+            self.cw_logs.create_log_stream(logGroupName = self.log_group_name, logStreamName = log_stream_name)
+            self.LOGGER.debug("Log stream %s created.", log_stream_name)
+        except self.cw_logs.exceptions.ResourceAlreadyExistsException:
+            # Another container was quicker, which is just fine.
+            self.LOGGER.debug("Log stream %s already exists.", log_stream_name)
+        self.known_log_streams.add(log_stream_name)
+
+# ---------------------------------------------------------------------------------------------------------------------
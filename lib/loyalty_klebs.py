@@ -0,0 +1,198 @@
+import bisect
+import datetime
+import collections
+from botocore.exceptions import ClientError
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Loyalty klebs ledger: one item per customer with the running balance, so reading a balance is a single get_item.
+# Rides are credited with an atomic ADD, guarded by the IDs of the rides already credited - redelivered ride completion
+# notifications don't count twice. The credited ride IDs are kept in one string set per day the ride was submitted
+# on, so the item doesn't grow forever: sets beyond the retention window are removed along with later credits.
+# ---------------------------------------------------------------------------------------------------------------------
+
+ATTR_CUSTOMER_ID = "customer-id"
+ATTR_KLEBS = "klebs"
+ATTR_CREDITED_RIDES = "credited-rides"
+ATTR_LAST_CREDITED_AT = "last-credited-at"
+ATTR_CREDITED_RIDE_IDS_PREFIX = "credited-ride-ids-"
+
+KLEBS_PER_FARE_UNIT = 1
+MIN_KLEBS_PER_RIDE = 1
+
+# Redeliveries (SNS retries, outbox retries) come within hours, so a few days of ride IDs are plenty.
+DEDUP_RETENTION_DAYS = 3
+# Days before the retention window whose sets get removed with each credit (for customers not riding every day).
+DEDUP_CLEANUP_DAYS = 14
+
+# Some rides of a credit might have been credited in the meantime, after which we try again with the others.
+MAX_CREDIT_ATTEMPTS = 3
+# Keeps the update and condition expressions well within DynamoDB's 4 KB limit.
+MAX_RIDES_PER_UPDATE = 25
+
+# Loyalty tiers: (minimum klebs, tier name), ascending.
+TIERS = [
+    (0, "bronze"),
+    (500, "silver"),
+    (2000, "gold"),
+    (10000, "platinum")
+]
+# Precomputed for bisecting, the tier of a balance is a binary search away.
+TIER_THRESHOLDS = [ minimum_klebs for minimum_klebs, _ in TIERS ]
+
+# One ride to be credited.
+Ride = collections.namedtuple("Ride", ["customer_id", "ride_id", "submitted_at", "klebs"])
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Compute the klebs for a ride and coalesce the rides of a batch per customer.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def compute_klebs(fare, distance):
+    # Distance doesn't count (yet), but it's part of the signature so that the rules can change in one place.
+    return max(MIN_KLEBS_PER_RIDE, int(float(fare) * KLEBS_PER_FARE_UNIT))
+
+def coalesce_rides(rides):
+    # customer ID -> ride ID -> ride, a ride that is in a batch twice is only credited once.
+    rides_per_customer = collections.OrderedDict()
+    for ride in rides:
+        rides_per_customer.setdefault(ride.customer_id, collections.OrderedDict())[ride.ride_id] = ride
+    return rides_per_customer
+
+def get_credited_ride_ids_attribute(day):
+    return ATTR_CREDITED_RIDE_IDS_PREFIX + day.isoformat()
+
+def get_submitted_on(ride):
+    return datetime.date.fromisoformat(ride.submitted_at[:10])
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Credit the rides of a customer: one UpdateItem, conditional on none of the rides being credited already.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def create_credit_update(rides, today):
+    names = { "#klebs": ATTR_KLEBS, "#rides": ATTR_CREDITED_RIDES, "#last": ATTR_LAST_CREDITED_AT }
+    values = {
+        ":klebs": { "N": str(sum(ride.klebs for ride in rides)) },
+        ":rides": { "N": str(len(rides)) },
+        ":now": { "S": datetime.datetime.utcnow().isoformat() }
+    }
+    adds = [ "#klebs :klebs", "#rides :rides" ]
+    conditions = []
+    rides_per_day = collections.OrderedDict()
+    for ride in rides:
+        rides_per_day.setdefault(get_submitted_on(ride), []).append(ride)
+    for day_index, (day, day_rides) in enumerate(rides_per_day.items()):
+        names["#ids" + str(day_index)] = get_credited_ride_ids_attribute(day)
+        values[":ids" + str(day_index)] = { "SS": [ ride.ride_id for ride in day_rides ] }
+        adds.append("#ids" + str(day_index) + " :ids" + str(day_index))
+        for ride_index, ride in enumerate(day_rides):
+            value_name = ":id" + str(day_index) + "_" + str(ride_index)
+            values[value_name] = { "S": ride.ride_id }
+            conditions.append("NOT contains(#ids" + str(day_index) + ", " + value_name + ")")
+
+    removes = []
+    for days_back in range(DEDUP_RETENTION_DAYS + 1, DEDUP_RETENTION_DAYS + DEDUP_CLEANUP_DAYS + 1):
+        stale_day = today - datetime.timedelta(days=days_back)
+        # The very same attribute can't be added to and removed in one update (late rides are added to).
+        if stale_day not in rides_per_day:
+            names["#stale" + str(days_back)] = get_credited_ride_ids_attribute(stale_day)
+            removes.append("#stale" + str(days_back))
+
+    update_expression = "SET #last = :now ADD " + ", ".join(adds)
+    if removes:
+        update_expression += " REMOVE " + ", ".join(removes)
+    return update_expression, " AND ".join(conditions), names, values
+
+def fetch_credited_ride_ids(ddb_client, table_name, customer_id, rides):
+    days = sorted(set(get_submitted_on(ride) for ride in rides))
+    names = { "#ids" + str(index): get_credited_ride_ids_attribute(day) for index, day in enumerate(days) }
+    response = ddb_client.get_item(
+        TableName = table_name,
+        Key = { ATTR_CUSTOMER_ID: { "S": customer_id } },
+        ProjectionExpression = ", ".join(names.keys()),
+        ExpressionAttributeNames = names,
+        ConsistentRead = True
+    )
+    item = response.get("Item") or {}
+    credited_ride_ids = set()
+    for attribute in names.values():
+        credited_ride_ids.update(item.get(attribute, { "SS": [] })["SS"])
+    return credited_ride_ids
+
+def credit_ride_chunk(LOGGER, ddb_client, table_name, customer_id, rides):
+    # Returns the klebs credited and the balance after crediting them (None if there was nothing left to credit).
+    for attempt in range(1, MAX_CREDIT_ATTEMPTS + 1):
+        if not rides:
+            LOGGER.debug("All rides of customer %s were credited already.", customer_id)
+            return 0, None
+        update_expression, condition_expression, names, values = create_credit_update(rides, datetime.datetime.utcnow().date())
+        try:
+            response = ddb_client.update_item(
+                TableName = table_name,
+                Key = { ATTR_CUSTOMER_ID: { "S": customer_id } },
+                UpdateExpression = update_expression,
+                ConditionExpression = condition_expression,
+                ExpressionAttributeNames = names,
+                ExpressionAttributeValues = values,
+                ReturnValues = "UPDATED_NEW"
+            )
+        except ClientError as ex:
+            if ex.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            # Some of the rides were credited before, only the others are left to be credited.
+            credited_ride_ids = fetch_credited_ride_ids(ddb_client, table_name, customer_id, rides)
+            LOGGER.info("Rides %s of customer %s were credited already.",
+                [ ride.ride_id for ride in rides if ride.ride_id in credited_ride_ids ], customer_id)
+            rides = [ ride for ride in rides if ride.ride_id not in credited_ride_ids ]
+        else:
+            klebs = sum(ride.klebs for ride in rides)
+            balance = int(response["Attributes"][ATTR_KLEBS]["N"])
+            LOGGER.debug("Credited %d klebs for %d rides to customer %s, balance is %d now.", klebs, len(rides), customer_id, balance)
+            return klebs, balance
+    raise RuntimeError("Couldn't credit the rides of customer " + customer_id + " after " + str(MAX_CREDIT_ATTEMPTS) + " attempts.")
+
+def credit_rides(LOGGER, ddb_client, table_name, customer_id, rides):
+    rides = list(rides)
+    klebs = 0
+    balance = None
+    for start in range(0, len(rides), MAX_RIDES_PER_UPDATE):
+        chunk_klebs, chunk_balance = credit_ride_chunk(LOGGER, ddb_client, table_name, customer_id, rides[start:start + MAX_RIDES_PER_UPDATE])
+        klebs += chunk_klebs
+        if chunk_balance is not None:
+            balance = chunk_balance
+    return klebs, balance
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Read the balance of a customer.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def fetch_balance(ddb_client, table_name, customer_id):
+    response = ddb_client.get_item(
+        TableName = table_name,
+        Key = { ATTR_CUSTOMER_ID: { "S": customer_id } },
+        ProjectionExpression = "#klebs, #rides, #last",
+        ExpressionAttributeNames = { "#klebs": ATTR_KLEBS, "#rides": ATTR_CREDITED_RIDES, "#last": ATTR_LAST_CREDITED_AT }
+    )
+    item = response.get("Item")
+    if item is None:
+        return None
+    return {
+        ATTR_KLEBS: int(item[ATTR_KLEBS]["N"]),
+        ATTR_CREDITED_RIDES: int(item[ATTR_CREDITED_RIDES]["N"]),
+        ATTR_LAST_CREDITED_AT: item[ATTR_LAST_CREDITED_AT]["S"]
+    }
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Determine the tier of a balance, and what it takes to get to the next one.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def get_tier(klebs):
+    index = max(0, bisect.bisect_right(TIER_THRESHOLDS, klebs) - 1)
+    minimum_klebs, name = TIERS[index]
+    tier = { "name": name, "min-klebs": minimum_klebs }
+    if index + 1 < len(TIERS):
+        next_minimum_klebs, next_name = TIERS[index + 1]
+        next_tier = { "name": next_name, "min-klebs": next_minimum_klebs, "klebs-to-go": next_minimum_klebs - klebs }
+    else:
+        next_tier = None
+    return tier, next_tier
+
+# ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,123 @@
+import sys
+import json
+import math
+import time
+import argparse
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Globals.
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Lambda memory settings: 128 MB to 10,240 MB, in steps of 1 MB - we recommend in steps of 64 MB though.
+MIN_MEMORY_MB = 128
+MAX_MEMORY_MB = 10240
+MEMORY_STEP_MB = 64
+
+DEFAULT_PERCENTILE = 99
+# On top of the percentile, for what the percentile doesn't see (and for the runtime itself growing a bit).
+DEFAULT_HEADROOM = 0.3
+# Below this many samples, a recommendation isn't worth much.
+MIN_SAMPLES = 20
+
+# Memory records as written by memory_tracking.
+MEMORY_REPORT = "memory"
+LOG_FILTER_PATTERN = '{ $.report = "memory" }'
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Read memory records from log lines - plain JSON lines or lines from exported logs with a prefix before the JSON.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def parse_memory_record(line):
+    start = line.find("{")
+    if start < 0:
+        return None
+    try:
+        record = json.loads(line[start:])
+    except ValueError:
+        return None
+    if not isinstance(record, dict) or record.get("report") != MEMORY_REPORT:
+        return None
+    return record
+
+def read_memory_records_from_files(paths):
+    for path in paths:
+        with (sys.stdin if path == "-" else open(path)) as lines:
+            for line in lines:
+                record = parse_memory_record(line)
+                if record is not None:
+                    yield record
+
+def read_memory_records_from_log_group(log_group_name, hours):
+    import boto3
+    cw_logs = boto3.client("logs")
+    paginator = cw_logs.get_paginator("filter_log_events")
+    start_time = int((time.time() - hours * 3600) * 1000)
+    for page in paginator.paginate(logGroupName = log_group_name, startTime = start_time, filterPattern = LOG_FILTER_PATTERN):
+        for log_event in page["events"]:
+            record = parse_memory_record(log_event["message"])
+            if record is not None:
+                yield record
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Recommend a memory setting per function from the distribution of its peak RSS.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def calculate_percentile(sorted_values, percentile):
+    # Nearest-rank percentile.
+    rank = max(1, math.ceil(percentile / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+def recommend_memory_mb(peak_rss_mb, headroom):
+    memory_mb = math.ceil(peak_rss_mb * (1 + headroom) / MEMORY_STEP_MB) * MEMORY_STEP_MB
+    return min(MAX_MEMORY_MB, max(MIN_MEMORY_MB, memory_mb))
+
+def create_report(records, percentile=DEFAULT_PERCENTILE, headroom=DEFAULT_HEADROOM):
+    samples_per_function = {}
+    limits_per_function = {}
+    for record in records:
+        function_name = record.get("function-name", "NONE")
+        samples_per_function.setdefault(function_name, []).append(float(record["peak-rss-mb"]))
+        if record.get("memory-limit-mb"):
+            limits_per_function[function_name] = int(record["memory-limit-mb"])
+
+    report = []
+    for function_name, samples in sorted(samples_per_function.items()):
+        samples.sort()
+        percentile_mb = calculate_percentile(samples, percentile)
+        report.append({
+            "function-name": function_name,
+            "samples": len(samples),
+            "p50-mb": calculate_percentile(samples, 50),
+            "p" + format(percentile, "g") + "-mb": percentile_mb,
+            "max-mb": samples[-1],
+            "configured-mb": limits_per_function.get(function_name),
+            "recommended-mb": recommend_memory_mb(percentile_mb, headroom),
+            "enough-samples": len(samples) >= MIN_SAMPLES
+        })
+    return report
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Main.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Recommend Lambda memory settings from recorded peak RSS distributions.")
+    parser.add_argument("files", nargs="*", default=["-"], help="log files with memory records ('-' for stdin)")
+    parser.add_argument("--log-group", action="append", default=[], help="read memory records from this log group")
+    parser.add_argument("--hours", type=float, default=24, help="how far back to look in the log groups")
+    parser.add_argument("--percentile", type=float, default=DEFAULT_PERCENTILE)
+    parser.add_argument("--headroom", type=float, default=DEFAULT_HEADROOM)
+    args = parser.parse_args(argv)
+
+    if args.log_group:
+        records = [ record for log_group_name in args.log_group for record in read_memory_records_from_log_group(log_group_name, args.hours) ]
+    else:
+        records = list(read_memory_records_from_files(args.files))
+
+    for entry in create_report(records, args.percentile, args.headroom):
+        print(json.dumps(entry))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
+
+# ---------------------------------------------------------------------------------------------------------------------
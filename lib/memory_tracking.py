@@ -0,0 +1,139 @@
+import os
+import json
+import random
+import resource
+import tracemalloc
+import metrics
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Globals.
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Share of invocations for which the top allocation sites are traced (0.0 - 1.0) - tracemalloc is anything but free.
+ENV_MEMORY_TRACEMALLOC_SAMPLE_RATE = "MEMORY_TRACEMALLOC_SAMPLE_RATE"
+ENV_FUNCTION_NAME = "AWS_LAMBDA_FUNCTION_NAME"
+
+METRIC_PEAK_RSS = "Peak RSS"
+DIMENSION_BATCH_SIZE = "batch-size"
+
+PROC_STATUS = "/proc/self/status"
+PROC_CLEAR_REFS = "/proc/self/clear_refs"
+# Writing "5" to clear_refs resets the peak RSS (VmHWM) of the process.
+CLEAR_REFS_RESET_PEAK_RSS = "5"
+
+TRACEMALLOC_FRAMES = 5
+TOP_ALLOCATION_SITES = 10
+
+# Batch sizes are bucketed to keep the dimension small: upper bound of the bucket -> name of the bucket.
+BATCH_SIZE_BUCKETS = [(1, "1"), (5, "2-5"), (10, "6-10"), (50, "11-50"), (100, "51-100")]
+LARGEST_BATCH_SIZE_BUCKET = "101+"
+
+try:
+    _TRACEMALLOC_SAMPLE_RATE = float(os.environ.get(ENV_MEMORY_TRACEMALLOC_SAMPLE_RATE, "0"))
+except ValueError:
+    _TRACEMALLOC_SAMPLE_RATE = 0.0
+
+# Whether we can reset the peak between invocations - if not, the peak is the one of the whole container so far.
+_PEAK_RESETTABLE = None
+_TRACING = False
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Read and reset the peak RSS of this process.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def read_peak_rss_kb():
+    try:
+        with open(PROC_STATUS) as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    # ru_maxrss is in kilobytes on Linux, but it can't be reset.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def reset_peak_rss():
+    global _PEAK_RESETTABLE
+    if _PEAK_RESETTABLE is False:
+        return False
+    try:
+        with open(PROC_CLEAR_REFS, "w") as clear_refs:
+            clear_refs.write(CLEAR_REFS_RESET_PEAK_RSS)
+        _PEAK_RESETTABLE = True
+    except OSError:
+        _PEAK_RESETTABLE = False
+    return _PEAK_RESETTABLE
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Determine the batch size of an invocation and its bucket.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def get_batch_size(event):
+    if isinstance(event, dict):
+        records = event.get("Records", event.get("records"))
+        if isinstance(records, list):
+            return len(records)
+    return 1
+
+def get_batch_size_bucket(batch_size):
+    for upper_bound, bucket in BATCH_SIZE_BUCKETS:
+        if batch_size <= upper_bound:
+            return bucket
+    return LARGEST_BATCH_SIZE_BUCKET
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Track an invocation: reset the peak before, report it after - plus the top allocation sites if sampled.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def start_invocation():
+    global _TRACING
+    reset_peak_rss()
+    _TRACING = _TRACEMALLOC_SAMPLE_RATE > 0 and random.random() < _TRACEMALLOC_SAMPLE_RATE
+    if _TRACING:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+
+def take_top_allocation_sites():
+    # These are the sites of what is still allocated at the end of the invocation, the traced peak is reported apart.
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>")
+    ])
+    return [{
+        "site": str(statistic.traceback[0]),
+        "size-kb": round(statistic.size / 1024, 1),
+        "count": statistic.count
+    } for statistic in snapshot.statistics("lineno")[:TOP_ALLOCATION_SITES]]
+
+def finish_invocation(LOGGER, event, context):
+    global _TRACING
+    try:
+        peak_rss_mb = read_peak_rss_kb() / 1024
+        batch_size = get_batch_size(event)
+        batch_size_bucket = get_batch_size_bucket(batch_size)
+        metrics.put_value(METRIC_PEAK_RSS, round(peak_rss_mb, 1), metrics.UNIT_MEGABYTES, {
+            DIMENSION_BATCH_SIZE: batch_size_bucket
+        })
+        report = {
+            "report": "memory",
+            "function-name": os.environ.get(ENV_FUNCTION_NAME, "NONE"),
+            "memory-limit-mb": int(getattr(context, "memory_limit_in_mb", 0) or 0),
+            "peak-rss-mb": round(peak_rss_mb, 1),
+            "peak-is-per-invocation": bool(_PEAK_RESETTABLE),
+            "batch-size": batch_size
+        }
+        if _TRACING:
+            report["traced-peak-kb"] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+            report["top-allocation-sites"] = take_top_allocation_sites()
+        # One record per invocation - memory_report turns these into recommended memory settings.
+        print(json.dumps(report, separators=(",", ":")))
+    except Exception as ex:
+        LOGGER.exception("Something went wrong with tracking the memory usage.")
+        LOGGER.exception(ex)
+    finally:
+        if _TRACING and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        _TRACING = False
+
+# ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import threading
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Globals.
+# ---------------------------------------------------------------------------------------------------------------------
+
+ENV_SERVICE = "SERVICE"
+ENV_FUNCTION_NAME = "AWS_LAMBDA_FUNCTION_NAME"
+# Metrics are written at the end of every invocation unless this asks for aggregating across invocations.
+ENV_METRICS_FLUSH_INTERVAL_SECS = "METRICS_FLUSH_INTERVAL_SECS"
+# Opt-in: number of top customers to report (0 switches the report off).
+ENV_METRICS_TOP_CUSTOMERS = "METRICS_TOP_CUSTOMERS"
+
+NAMESPACE = "Wild Rydes"
+
+UNIT_COUNT = "Count"
+UNIT_COUNT_PER_SECOND = "Count/Second"
+UNIT_MILLISECONDS = "Milliseconds"
+UNIT_BYTES = "Bytes"
+UNIT_MEGABYTES = "Megabytes"
+
+# An embedded metric format (EMF) log line may carry at most 100 values per metric.
+MAX_VALUES_PER_METRIC = 100
+# Every distinct dimension value becomes a metric of its own, so each dimension only gets this many of them. Anything
+# beyond is reported as OVERFLOW_DIMENSION_VALUE.
+MAX_VALUES_PER_DIMENSION = 20
+OVERFLOW_DIMENSION_VALUE = "OTHER"
+# The Space-Saving sketch keeps this many candidates per requested top customer.
+TOP_CUSTOMERS_CANDIDATE_FACTOR = 10
+
+_LOCK = threading.Lock()
+# (sorted dimension items) -> metric name -> [unit, [values]]
+_METRICS = {}
+# dimension name -> set of dimension values seen in this container
+_DIMENSION_VALUES = {}
+_LAST_FLUSH_AT = time.monotonic()
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Space-Saving sketch for the top customers: a fixed number of counters, whatever the number of customers.
+# ---------------------------------------------------------------------------------------------------------------------
+
+class SpaceSaving:
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        # item -> [count, error]
+        self.counters = {}
+
+    def add(self, item, count=1):
+        counter = self.counters.get(item)
+        if counter is not None:
+            counter[0] += count
+        elif len(self.counters) < self.capacity:
+            self.counters[item] = [count, 0]
+        else:
+            # Evict the smallest counter, its count becomes the maximum error of the newcomer.
+            evicted = min(self.counters, key=lambda candidate: self.counters[candidate][0])
+            min_count = self.counters.pop(evicted)[0]
+            self.counters[item] = [min_count + count, min_count]
+
+    def top(self, n):
+        ranked = sorted(self.counters.items(), key=lambda entry: entry[1][0], reverse=True)[:n]
+        return [ { "item": item, "count": count, "max-error": error } for item, (count, error) in ranked ]
+
+    def clear(self):
+        self.counters = {}
+
+def get_top_customers_count():
+    try:
+        return max(0, int(os.environ.get(ENV_METRICS_TOP_CUSTOMERS, "0")))
+    except ValueError:
+        return 0
+
+_TOP_CUSTOMERS = SpaceSaving(max(1, get_top_customers_count() * TOP_CUSTOMERS_CANDIDATE_FACTOR))
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Record metrics in memory.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def bound_dimensions(dimensions):
+    bounded = {}
+    for name, value in (dimensions or {}).items():
+        value = str(value)
+        seen = _DIMENSION_VALUES.setdefault(name, set())
+        if value not in seen:
+            if len(seen) >= MAX_VALUES_PER_DIMENSION:
+                value = OVERFLOW_DIMENSION_VALUE
+            else:
+                seen.add(value)
+        bounded[name] = value
+    return bounded
+
+def put_value(name, value, unit, dimensions=None):
+    with _LOCK:
+        key = tuple(sorted(bound_dimensions(dimensions).items()))
+        metric = _METRICS.setdefault(key, {}).setdefault(name, [unit, []])
+        metric[1].append(value)
+        if len(metric[1]) < MAX_VALUES_PER_METRIC:
+            return
+        # A full EMF line's worth of values is written right away, so that aggregating across invocations (see
+        # ENV_METRICS_FLUSH_INTERVAL_SECS) doesn't let the values pile up in the container's memory.
+        full_metrics = { key: { name: [unit, metric[1]] } }
+        metric[1] = []
+    write_emf_documents(full_metrics, int(round(time.time() * 1000)))
+
+def add_count(name, count=1, dimensions=None):
+    # Counts are summed up right away, there is no point in shipping a long list of ones.
+    with _LOCK:
+        key = tuple(sorted(bound_dimensions(dimensions).items()))
+        metric = _METRICS.setdefault(key, {}).setdefault(name, [UNIT_COUNT, [0]])
+        metric[1][0] += count
+
+def add_timing(name, millis, dimensions=None):
+    put_value(name, millis, UNIT_MILLISECONDS, dimensions)
+
+def track_customer(customer_id, count=1):
+    if get_top_customers_count() > 0:
+        with _LOCK:
+            _TOP_CUSTOMERS.add(customer_id, count)
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Write the recorded metrics as EMF log lines - CloudWatch extracts the metrics from the logs, no API call needed.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def create_emf_documents(metrics, timestamp_ms):
+    default_dimensions = {
+        "service": os.environ.get(ENV_SERVICE, "NONE"),
+        "function-name": os.environ.get(ENV_FUNCTION_NAME, "NONE")
+    }
+    documents = []
+    for dimension_items, metrics_by_name in metrics.items():
+        dimensions = dict(default_dimensions)
+        dimensions.update(dimension_items)
+        # Chunk into as many documents as the metric with the most values needs.
+        chunk_count = max((len(values) - 1) // MAX_VALUES_PER_METRIC + 1 for unit, values in metrics_by_name.values())
+        for chunk in range(chunk_count):
+            document = dict(dimensions)
+            metric_definitions = []
+            for name, (unit, values) in metrics_by_name.items():
+                chunk_values = values[chunk * MAX_VALUES_PER_METRIC:(chunk + 1) * MAX_VALUES_PER_METRIC]
+                if not chunk_values:
+                    continue
+                metric_definitions.append({ "Name": name, "Unit": unit })
+                document[name] = chunk_values[0] if len(chunk_values) == 1 else chunk_values
+            document["_aws"] = {
+                "Timestamp": timestamp_ms,
+                "CloudWatchMetrics": [{
+                    "Namespace": NAMESPACE,
+                    "Dimensions": [ sorted(dimensions) ],
+                    "Metrics": metric_definitions
+                }]
+            }
+            documents.append(document)
+    return documents
+
+def write_emf_documents(metrics, timestamp_ms):
+    for document in create_emf_documents(metrics, timestamp_ms):
+        # EMF needs the plain JSON document on a line of its own, so this goes to stdout, not through the logger.
+        print(json.dumps(document, separators=(",", ":")))
+
+def flush(LOGGER, force=False):
+    global _METRICS, _LAST_FLUSH_AT
+    try:
+        flush_interval_secs = float(os.environ.get(ENV_METRICS_FLUSH_INTERVAL_SECS, "0"))
+    except ValueError:
+        flush_interval_secs = 0
+    with _LOCK:
+        if not force and time.monotonic() - _LAST_FLUSH_AT < flush_interval_secs:
+            return 0
+        metrics = _METRICS
+        _METRICS = {}
+        _LAST_FLUSH_AT = time.monotonic()
+        top_customers_count = get_top_customers_count()
+        top_customers = _TOP_CUSTOMERS.top(top_customers_count) if top_customers_count > 0 else []
+        _TOP_CUSTOMERS.clear()
+
+    try:
+        timestamp_ms = int(round(time.time() * 1000))
+        write_emf_documents(metrics, timestamp_ms)
+        if top_customers:
+            # Customer IDs are far too many for metric dimensions, so the top customers are just a report in the logs.
+            print(json.dumps({ "report": "top-customers", "timestamp": timestamp_ms, "top-customers": top_customers }))
+    except Exception as ex:
+        # Metrics are nice to have, they must never break the request.
+        LOGGER.exception("Something went wrong with writing the metrics.")
+        LOGGER.exception(ex)
+        return 0
+    else:
+        return 1
+
+# ---------------------------------------------------------------------------------------------------------------------
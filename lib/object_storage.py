@@ -0,0 +1,148 @@
+import os
+import shutil
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Object storage for jobs that work on files in S3: a bucket, or a local directory tree standing in for it (keys are
+# relative paths), so that the jobs can be run and checked locally.
+# ---------------------------------------------------------------------------------------------------------------------
+
+class S3Storage:
+
+    # DeleteObjects takes up to 1000 keys per call.
+    MAX_KEYS_PER_DELETE = 1000
+
+    def __init__(self, s3_client, bucket_name):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+
+    def list_prefixes(self, prefix):
+        prefixes = []
+        for page in self.s3_client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket_name, Prefix=prefix, Delimiter="/"):
+            prefixes.extend(common_prefix["Prefix"] for common_prefix in page.get("CommonPrefixes", []))
+        return prefixes
+
+    def list_objects(self, prefix, recursive=False):
+        # Returns { key: size } of the objects right below the prefix - or anywhere below it.
+        objects = {}
+        arguments = { "Bucket": self.bucket_name, "Prefix": prefix }
+        if not recursive:
+            arguments["Delimiter"] = "/"
+        for page in self.s3_client.get_paginator("list_objects_v2").paginate(**arguments):
+            objects.update((content["Key"], content["Size"]) for content in page.get("Contents", []))
+        return objects
+
+    def download(self, key, path):
+        self.s3_client.download_file(self.bucket_name, key, path)
+
+    def upload(self, path, key):
+        self.s3_client.upload_file(path, self.bucket_name, key)
+
+    def get_bytes(self, key):
+        try:
+            return self.s3_client.get_object(Bucket=self.bucket_name, Key=key)["Body"].read()
+        except self.s3_client.exceptions.NoSuchKey:
+            return None
+
+    def get_range(self, key, start, length=None):
+        # A negative start reads the last bytes of the object, e.g. a footer. Like get_bytes, None if there's no object.
+        byte_range = "bytes=%d" % start if start < 0 else "bytes=%d-%d" % (start, start + length - 1)
+        try:
+            return self.s3_client.get_object(Bucket=self.bucket_name, Key=key, Range=byte_range)["Body"].read()
+        except self.s3_client.exceptions.NoSuchKey:
+            return None
+
+    def put_bytes(self, key, data, content_type="application/octet-stream"):
+        self.s3_client.put_object(Bucket=self.bucket_name, Key=key, Body=data, ContentType=content_type)
+
+    def get_text(self, key):
+        data = self.get_bytes(key)
+        return data.decode("utf-8") if data is not None else None
+
+    def put_text(self, key, text):
+        self.put_bytes(key, text.encode("utf-8"), "application/json")
+
+    def delete(self, keys):
+        for start in range(0, len(keys), self.MAX_KEYS_PER_DELETE):
+            response = self.s3_client.delete_objects(Bucket=self.bucket_name, Delete={
+                "Objects": [ { "Key": key } for key in keys[start:start + self.MAX_KEYS_PER_DELETE] ],
+                "Quiet": True
+            })
+            if response.get("Errors"):
+                raise RuntimeError("Deleting %d objects failed: %s" % (len(response["Errors"]), response["Errors"][:3]))
+
+class LocalStorage:
+
+    def __init__(self, root):
+        self.root = root
+
+    def get_path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def get_upload_path(self, key):
+        # Hidden, so that an interrupted upload isn't taken for an object.
+        path = self.get_path(key)
+        return os.path.join(os.path.dirname(path), "." + os.path.basename(path) + ".upload")
+
+    def list_prefixes(self, prefix):
+        directory = self.get_path(prefix)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(prefix + name + "/" for name in os.listdir(directory) if os.path.isdir(os.path.join(directory, name)))
+
+    def list_objects(self, prefix, recursive=False):
+        directory = self.get_path(prefix)
+        if not os.path.isdir(directory):
+            return {}
+        objects = {}
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path) and not name.startswith("."):
+                objects[prefix + name] = os.path.getsize(path)
+            elif recursive and os.path.isdir(path):
+                objects.update(self.list_objects(prefix + name + "/", recursive))
+        return objects
+
+    def download(self, key, path):
+        shutil.copyfile(self.get_path(key), path)
+
+    def upload(self, path, key):
+        os.makedirs(os.path.dirname(self.get_path(key)), exist_ok=True)
+        # Like S3, an object is there as a whole or not at all.
+        shutil.copyfile(path, self.get_upload_path(key))
+        os.replace(self.get_upload_path(key), self.get_path(key))
+
+    def get_bytes(self, key):
+        if not os.path.isfile(self.get_path(key)):
+            return None
+        with open(self.get_path(key), "rb") as data_file:
+            return data_file.read()
+
+    def get_range(self, key, start, length=None):
+        if not os.path.isfile(self.get_path(key)):
+            return None
+        with open(self.get_path(key), "rb") as data_file:
+            if start < 0:
+                data_file.seek(max(0, os.path.getsize(self.get_path(key)) + start))
+                return data_file.read()
+            data_file.seek(start)
+            return data_file.read(length)
+
+    def put_bytes(self, key, data, content_type=None):
+        os.makedirs(os.path.dirname(self.get_path(key)), exist_ok=True)
+        with open(self.get_upload_path(key), "wb") as data_file:
+            data_file.write(data)
+        os.replace(self.get_upload_path(key), self.get_path(key))
+
+    def get_text(self, key):
+        data = self.get_bytes(key)
+        return data.decode("utf-8") if data is not None else None
+
+    def put_text(self, key, text):
+        self.put_bytes(key, text.encode("utf-8"))
+
+    def delete(self, keys):
+        for key in keys:
+            if os.path.isfile(self.get_path(key)):
+                os.remove(self.get_path(key))
+
+# ---------------------------------------------------------------------------------------------------------------------
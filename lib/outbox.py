@@ -0,0 +1,123 @@
+import os
+import random
+import datetime
+from botocore.exceptions import ClientError
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Transactional outbox on a DynamoDB table: an item that still needs to be published carries a pending marker, which
+# is written together with the item in one put. The marker attributes make up a sparse GSI, so a sweeper finds the
+# pending items without scanning the table - and once the marker is removed, the item drops out of the index.
+# ---------------------------------------------------------------------------------------------------------------------
+
+ENV_OUTBOX_INDEX_NAME = "OUTBOX_INDEX_NAME"
+ENV_OUTBOX_SHARDS = "OUTBOX_SHARDS"
+ENV_OUTBOX_MAX_ATTEMPTS = "OUTBOX_MAX_ATTEMPTS"
+
+# Marker attributes, the first two are the key of the outbox index.
+ATTR_SHARD = "outbox-shard"
+ATTR_NEXT_ATTEMPT_AT = "outbox-next-attempt-at"
+ATTR_ATTEMPTS = "outbox-attempts"
+ATTR_STATUS = "outbox-status"
+ATTR_PUBLISHED_AT = "published-at"
+
+STATUS_FAILED = "FAILED"
+
+# Writes are spread over a few index partitions, the sweeper queries them one after the other.
+DEFAULT_SHARDS = 4
+DEFAULT_MAX_ATTEMPTS = 8
+
+# Retry schedule for failed publications: exponential backoff with jitter, 30 secs up to an hour.
+BACKOFF_BASE_SECS = 30
+BACKOFF_MAX_SECS = 3600
+
+def get_shards():
+    return max(1, int(os.environ.get(ENV_OUTBOX_SHARDS, DEFAULT_SHARDS)))
+
+def get_max_attempts():
+    return max(1, int(os.environ.get(ENV_OUTBOX_MAX_ATTEMPTS, DEFAULT_MAX_ATTEMPTS)))
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Create the pending marker for a new item (low-level DynamoDB attribute values, to be merged into the item).
+# ---------------------------------------------------------------------------------------------------------------------
+
+def create_pending_marker(now):
+    return {
+        ATTR_SHARD          : { "S": str(random.randrange(get_shards())) },
+        ATTR_NEXT_ATTEMPT_AT: { "S": now.isoformat() },
+        ATTR_ATTEMPTS       : { "N": "0" }
+    }
+
+def compute_next_attempt_at(now, attempts):
+    delay_secs = min(BACKOFF_MAX_SECS, BACKOFF_BASE_SECS * 2 ** max(0, attempts - 1))
+    return now + datetime.timedelta(seconds=random.uniform(delay_secs / 2, delay_secs))
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Query the items of a shard that are due, oldest first.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def query_due_items(LOGGER, ddb_client, table_name, shard, now, limit):
+    query_args = {
+        "TableName": table_name,
+        "IndexName": os.environ.get(ENV_OUTBOX_INDEX_NAME),
+        "KeyConditionExpression": "#shard = :shard AND #next <= :now",
+        "ExpressionAttributeNames": { "#shard": ATTR_SHARD, "#next": ATTR_NEXT_ATTEMPT_AT },
+        "ExpressionAttributeValues": { ":shard": { "S": str(shard) }, ":now": { "S": now.isoformat() } }
+    }
+    items = []
+    while len(items) < limit:
+        query_args["Limit"] = limit - len(items)
+        response = ddb_client.query(**query_args)
+        items.extend(response["Items"])
+        if "LastEvaluatedKey" not in response:
+            break
+        query_args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    LOGGER.debug("Found %d due items in outbox shard %s.", len(items), shard)
+    return items
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Settle an item: remove the marker once published, or reschedule it - until it runs out of attempts.
+# All updates are conditional on the marker we've seen, so overlapping sweeps don't step on each other's toes.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def update_seen_item(LOGGER, ddb_client, table_name, key, seen_item, update_expression, names, values):
+    names["#next"] = ATTR_NEXT_ATTEMPT_AT
+    values[":seen"] = seen_item[ATTR_NEXT_ATTEMPT_AT]
+    try:
+        ddb_client.update_item(
+            TableName = table_name,
+            Key = key,
+            UpdateExpression = update_expression,
+            ConditionExpression = "#next = :seen",
+            ExpressionAttributeNames = names,
+            ExpressionAttributeValues = values
+        )
+    except ClientError as ex:
+        if ex.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        LOGGER.debug("Outbox item %s was settled by someone else in the meantime.", key)
+        return False
+    return True
+
+def mark_published(LOGGER, ddb_client, table_name, key, seen_item, now):
+    return update_seen_item(LOGGER, ddb_client, table_name, key, seen_item,
+        "SET #published = :now REMOVE #shard, #next, #attempts",
+        { "#published": ATTR_PUBLISHED_AT, "#shard": ATTR_SHARD, "#attempts": ATTR_ATTEMPTS },
+        { ":now": { "S": now.isoformat() } })
+
+def mark_failed_attempt(LOGGER, ddb_client, table_name, key, seen_item, now):
+    attempts = int(seen_item.get(ATTR_ATTEMPTS, { "N": "0" })["N"]) + 1
+    if attempts >= get_max_attempts():
+        # Out of attempts: the item leaves the index, but stays easy to find for someone looking into it.
+        LOGGER.error("Giving up on publishing outbox item %s after %d attempts.", key, attempts)
+        update_seen_item(LOGGER, ddb_client, table_name, key, seen_item,
+            "SET #status = :failed, #attempts = :attempts REMOVE #shard, #next",
+            { "#status": ATTR_STATUS, "#attempts": ATTR_ATTEMPTS, "#shard": ATTR_SHARD },
+            { ":failed": { "S": STATUS_FAILED }, ":attempts": { "N": str(attempts) } })
+        return False
+    update_seen_item(LOGGER, ddb_client, table_name, key, seen_item,
+        "SET #next = :next, #attempts = :attempts",
+        { "#attempts": ATTR_ATTEMPTS },
+        { ":next": { "S": compute_next_attempt_at(now, attempts).isoformat() }, ":attempts": { "N": str(attempts) } })
+    return True
+
+# ---------------------------------------------------------------------------------------------------------------------
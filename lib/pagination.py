@@ -0,0 +1,85 @@
+import json
+import base64
+import decimal
+import datetime
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Globals.
+# ---------------------------------------------------------------------------------------------------------------------
+
+QSP_LIMIT = "limit"
+QSP_CURSOR = "cursor"
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Convert DynamoDB numbers (decimals) to plain JSON numbers.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def convert_decimals(value):
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, dict):
+        return { key: convert_decimals(item) for key, item in value.items() }
+    if isinstance(value, list):
+        return [ convert_decimals(item) for item in value ]
+    return value
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Encode the LastEvaluatedKey of a DynamoDB query as an opaque cursor for the client, and back.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def encode_cursor(last_evaluated_key):
+    if not last_evaluated_key:
+        return None
+    payload = json.dumps(convert_decimals(last_evaluated_key), separators=(",", ":"), sort_keys=True)
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor, expected_keys):
+    if not cursor:
+        return None
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        exclusive_start_key = json.loads(base64.urlsafe_b64decode(cursor + padding).decode("utf-8"))
+    except Exception as ex:
+        raise ValueError("Cursor is malformed.") from ex
+    # Only accept cursors that look like keys of the table we are going to query.
+    if not isinstance(exclusive_start_key, dict) or sorted(exclusive_start_key) != sorted(expected_keys):
+        raise ValueError("Cursor doesn't belong to this resource.")
+    return exclusive_start_key
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Extract the page size from the query string parameters.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def extract_limit(query_string_parameters, default_limit=DEFAULT_LIMIT, max_limit=MAX_LIMIT):
+    limit = query_string_parameters.get(QSP_LIMIT)
+    if limit is None:
+        return default_limit
+    try:
+        limit = int(limit)
+    except ValueError as ex:
+        raise ValueError("'" + QSP_LIMIT + "' must be an integer.") from ex
+    if limit < 1 or limit > max_limit:
+        raise ValueError("'" + QSP_LIMIT + "' must be between 1 and " + str(max_limit) + ".")
+    return limit
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Extract an optional range bound (ISO 8601 timestamp) from the query string parameters.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def extract_timestamp(query_string_parameters, name):
+    value = query_string_parameters.get(name)
+    if value is None:
+        return None
+    try:
+        timestamp = datetime.datetime.fromisoformat(value)
+    except ValueError as ex:
+        raise ValueError("'" + name + "' must be an ISO 8601 timestamp.") from ex
+    # We store naive UTC timestamps, so incoming timestamps with a time zone are normalized to that.
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+# ---------------------------------------------------------------------------------------------------------------------
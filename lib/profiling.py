@@ -0,0 +1,214 @@
+import os
+import io
+import sys
+import json
+import time
+import random
+import pstats
+import cProfile
+import threading
+import collections
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Globals.
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Share of invocations to profile without being asked to (0.0 - 1.0).
+ENV_PROFILING_SAMPLE_RATE = "PROFILING_SAMPLE_RATE"
+# Opt-in: profile invocations that ask for it. Anyone can send the header to a public API, and a profile costs
+# latency and log volume, so requests for a profile are ignored unless this is switched on.
+ENV_PROFILING_ON_REQUEST = "PROFILING_ON_REQUEST"
+# Profiler to use: "sampling" (collapsed stacks, low overhead) or "cprofile" (exact call counts, higher overhead).
+ENV_PROFILING_MODE = "PROFILING_MODE"
+ENV_PROFILING_SAMPLE_INTERVAL_MS = "PROFILING_SAMPLE_INTERVAL_MS"
+ENV_FUNCTION_NAME = "AWS_LAMBDA_FUNCTION_NAME"
+
+MODE_SAMPLING = "sampling"
+MODE_CPROFILE = "cprofile"
+
+# Ways to ask for a profile of a single invocation: an HTTP header for API calls, a message attribute for SNS/SQS.
+HEADER_PROFILE = "x-wr-profile"
+MESSAGE_ATTRIBUTE_PROFILE = "profile"
+MESSAGE_ATTRIBUTE_CORRELATION_ID = "correlation-id"
+QSP_CORRELATION_ID = "correlation-id"
+
+# Log events are limited to 256 KB, so only the heaviest stacks make it into the profile record.
+MAX_PROFILE_LINES = 500
+
+# The environment doesn't change during the life of a container, so we only look at it once.
+try:
+    _SAMPLE_RATE = float(os.environ.get(ENV_PROFILING_SAMPLE_RATE, "0"))
+except ValueError:
+    _SAMPLE_RATE = 0.0
+_ON_REQUEST = os.environ.get(ENV_PROFILING_ON_REQUEST, "0").lower() in ("1", "true", "yes", "on")
+_MODE = os.environ.get(ENV_PROFILING_MODE, MODE_SAMPLING).lower()
+try:
+    _SAMPLE_INTERVAL_SECS = max(1, int(os.environ.get(ENV_PROFILING_SAMPLE_INTERVAL_MS, "5"))) / 1000
+except ValueError:
+    _SAMPLE_INTERVAL_SECS = 0.005
+
+# Correlation ID of the invocation being profiled - handlers that create or find one tell us about it.
+_CORRELATION_ID = None
+_PROFILING = False
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Let the profile record know which correlation ID the invocation belongs to. Costs nothing if we don't profile.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def annotate_correlation_id(correlation_id):
+    global _CORRELATION_ID
+    if _PROFILING:
+        _CORRELATION_ID = correlation_id
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Check whether an invocation asks for being profiled, and find its correlation ID if it comes with one.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def iterate_message_attributes(event):
+    # Message attributes of SNS records, SQS records and SNS messages wrapped into SQS records.
+    for record in event.get("Records") or []:
+        if not isinstance(record, dict):
+            continue
+        if "Sns" in record:
+            for name, attribute in (record["Sns"].get("MessageAttributes") or {}).items():
+                yield name, attribute.get("Value")
+        elif "messageAttributes" in record:
+            for name, attribute in (record.get("messageAttributes") or {}).items():
+                yield name, attribute.get("stringValue")
+            try:
+                body = json.loads(record.get("body") or "{}")
+            except ValueError:
+                continue
+            if isinstance(body, dict):
+                for name, attribute in (body.get("MessageAttributes") or {}).items():
+                    yield name, attribute.get("Value")
+
+def is_requested(event):
+    if not isinstance(event, dict):
+        return False
+    headers = event.get("headers")
+    if headers:
+        for name, value in headers.items():
+            if name.lower() == HEADER_PROFILE and str(value).lower() == "true":
+                return True
+    if "Records" in event:
+        for name, value in iterate_message_attributes(event):
+            if name == MESSAGE_ATTRIBUTE_PROFILE and str(value).lower() == "true":
+                return True
+    return False
+
+def extract_correlation_id(event):
+    if not isinstance(event, dict):
+        return None
+    correlation_id = (event.get("queryStringParameters") or {}).get(QSP_CORRELATION_ID)
+    if correlation_id is None and "Records" in event:
+        for name, value in iterate_message_attributes(event):
+            if name == MESSAGE_ATTRIBUTE_CORRELATION_ID:
+                return value
+    return correlation_id
+
+def should_profile(event):
+    # The cheap checks first: without a sample rate and without profiling on request, that's it.
+    if _SAMPLE_RATE > 0 and random.random() < _SAMPLE_RATE:
+        return True
+    return _ON_REQUEST and is_requested(event)
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Sampling profiler: a thread that looks at the handler's stack every few milliseconds and counts collapsed stacks.
+# ---------------------------------------------------------------------------------------------------------------------
+
+class SamplingProfiler:
+
+    def __init__(self, interval_secs):
+        self.interval_secs = interval_secs
+        self.target_thread_id = threading.get_ident()
+        self.stacks = collections.Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval_secs):
+            frame = sys._current_frames().get(self.target_thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(os.path.basename(code.co_filename) + ":" + code.co_name)
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def collapsed_stacks(self):
+        # Brendan Gregg's collapsed format ("frame;frame;frame count"), ready for flamegraph.pl and friends.
+        return [ stack + " " + str(count) for stack, count in self.stacks.most_common(MAX_PROFILE_LINES) ]
+
+# ---------------------------------------------------------------------------------------------------------------------
+# cProfile output condensed to "caller;callee cumulative-microseconds" lines - cProfile only knows about direct
+# callers, not full stacks, so these are edges of the call graph rather than real stacks.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def collapse_cprofile(profile):
+    stats = pstats.Stats(profile, stream=io.StringIO())
+    lines = []
+    for (filename, line, name), (cc, nc, tt, ct, callers) in stats.stats.items():
+        callee = os.path.basename(filename) + ":" + name
+        if not callers:
+            lines.append((ct, callee))
+        for (caller_filename, caller_line, caller_name), caller_stats in callers.items():
+            lines.append((caller_stats[3], os.path.basename(caller_filename) + ":" + caller_name + ";" + callee))
+    lines.sort(reverse=True)
+    return [ frames + " " + str(int(cumulative * 1000000)) for cumulative, frames in lines[:MAX_PROFILE_LINES] ]
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Call a handler - under a profiler if asked for, otherwise just like that.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def call_handler(LOGGER, handler, event, context):
+    global _CORRELATION_ID, _PROFILING
+    if not should_profile(event):
+        return handler(event, context)
+
+    _PROFILING = True
+    _CORRELATION_ID = extract_correlation_id(event)
+    mode = MODE_CPROFILE if _MODE == MODE_CPROFILE else MODE_SAMPLING
+    started_at = time.perf_counter()
+    if mode == MODE_CPROFILE:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    else:
+        profiler = SamplingProfiler(_SAMPLE_INTERVAL_SECS)
+        profiler.start()
+    try:
+        return handler(event, context)
+    finally:
+        duration_ms = (time.perf_counter() - started_at) * 1000
+        try:
+            if mode == MODE_CPROFILE:
+                profiler.disable()
+                collapsed_stacks = collapse_cprofile(profiler)
+            else:
+                profiler.stop()
+                collapsed_stacks = profiler.collapsed_stacks()
+            # The profile goes into the function's log as a record of its own, findable by correlation ID.
+            print(json.dumps({
+                "report": "profile",
+                "function-name": os.environ.get(ENV_FUNCTION_NAME, "NONE"),
+                "request-id": getattr(context, "aws_request_id", None),
+                "correlation-id": _CORRELATION_ID,
+                "mode": mode,
+                "duration-ms": round(duration_ms, 3),
+                "collapsed-stacks": collapsed_stacks
+            }, separators=(",", ":")))
+        except Exception as ex:
+            LOGGER.exception("Something went wrong with writing the profile.")
+            LOGGER.exception(ex)
+        _PROFILING = False
+        _CORRELATION_ID = None
+
+# ---------------------------------------------------------------------------------------------------------------------
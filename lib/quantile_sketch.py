@@ -0,0 +1,183 @@
+import sys
+import json
+import math
+import time
+import array
+import random
+import struct
+
+# ---------------------------------------------------------------------------------------------------------------------
+# KLL quantile sketch (Karnin, Lang, Liberty): a stack of compactors, where level h holds values of weight 2^h. When a
+# level is full, it is sorted and every other value (random offset) moves up one level - half the values, twice the
+# weight. Memory is bounded by k (roughly 3k values regardless of how many were added), ranks are off by about
+# 1.7 / k of the count at most, and two sketches merge by concatenating their levels, so sketches kept by different
+# containers add up to the sketch of all values.
+# ---------------------------------------------------------------------------------------------------------------------
+
+DEFAULT_K = 200
+# Capacity of a level relative to the level above.
+CAPACITY_DECAY = 2.0 / 3.0
+
+# Serialized: format version, k, count, number of levels, then the level sizes and all values as 32 bit floats.
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<BHQB")
+
+_RANDOM = random.Random()
+
+class KllSketch:
+
+    __slots__ = ("k", "n", "levels", "_capacities", "_max_size", "_size", "_rng")
+
+    def __init__(self, k=DEFAULT_K, rng=None):
+        self.k = k
+        self.n = 0
+        self.levels = [[]]
+        self._rng = rng or _RANDOM
+        self._update_capacities()
+
+    def _update_capacities(self):
+        height = len(self.levels)
+        self._capacities = [ int(math.ceil(CAPACITY_DECAY ** (height - level - 1) * self.k)) + 1 for level in range(height) ]
+        self._max_size = sum(self._capacities)
+        self._size = sum(len(values) for values in self.levels)
+
+    def _compact(self):
+        # Compacts the lowest level that is full - one level at a time keeps the error low.
+        for level, values in enumerate(self.levels):
+            if len(values) >= self._capacities[level]:
+                if level + 1 == len(self.levels):
+                    self.levels.append([])
+                values.sort()
+                odd = len(values) % 2
+                self.levels[level + 1].extend(values[odd + self._rng.randint(0, 1)::2])
+                del values[odd:]
+                self._update_capacities()
+                return
+
+    def update(self, value):
+        self.levels[0].append(value)
+        self.n += 1
+        self._size += 1
+        if self._size >= self._max_size:
+            self._compact()
+
+    def merge(self, other):
+        if other.k != self.k:
+            raise ValueError("Can't merge sketches with different k (" + str(self.k) + " and " + str(other.k) + ").")
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for level, values in enumerate(other.levels):
+            self.levels[level].extend(values)
+        self.n += other.n
+        self._update_capacities()
+        while self._size >= self._max_size:
+            self._compact()
+        return self
+
+    def copy(self):
+        sketch = KllSketch(self.k, self._rng)
+        return sketch.merge(self)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    # Queries.
+    # -----------------------------------------------------------------------------------------------------------------
+
+    def get_weighted_values(self):
+        weighted_values = [ (value, 1 << level) for level, values in enumerate(self.levels) for value in values ]
+        weighted_values.sort()
+        return weighted_values
+
+    def quantile(self, q):
+        # The smallest value with at least a share of q of all values at or below it (None for an empty sketch).
+        weighted_values = self.get_weighted_values()
+        if not weighted_values:
+            return None
+        total_weight = sum(weight for _, weight in weighted_values)
+        target = q * total_weight
+        cumulative_weight = 0
+        for value, weight in weighted_values:
+            cumulative_weight += weight
+            if cumulative_weight >= target:
+                return value
+        return weighted_values[-1][0]
+
+    def rank(self, value):
+        # The estimated share of values at or below the given one.
+        total_weight = 0
+        weight_below = 0
+        for level, values in enumerate(self.levels):
+            total_weight += len(values) << level
+            weight_below += sum(1 for other in values if other <= value) << level
+        return weight_below / total_weight if total_weight else 0.0
+
+    # -----------------------------------------------------------------------------------------------------------------
+    # Compact binary serialization, e.g. for a DynamoDB binary attribute.
+    # -----------------------------------------------------------------------------------------------------------------
+
+    def to_bytes(self):
+        values = array.array("f")
+        for level_values in self.levels:
+            values.extend(level_values)
+        return (HEADER.pack(FORMAT_VERSION, self.k, self.n, len(self.levels))
+            + struct.pack("<" + str(len(self.levels)) + "H", *[ len(level_values) for level_values in self.levels ])
+            + values.tobytes())
+
+    @classmethod
+    def from_bytes(cls, data, rng=None):
+        version, k, n, height = HEADER.unpack_from(data)
+        if version != FORMAT_VERSION:
+            raise ValueError("Unsupported sketch format version " + str(version) + ".")
+        sizes = struct.unpack_from("<" + str(height) + "H", data, HEADER.size)
+        values = array.array("f")
+        values.frombytes(data[HEADER.size + 2 * height:])
+        sketch = cls(k, rng)
+        sketch.n = n
+        sketch.levels = []
+        start = 0
+        for size in sizes:
+            sketch.levels.append(values[start:start + size].tolist())
+            start += size
+        sketch._update_capacities()
+        return sketch
+
+    def __repr__(self):
+        return "KllSketch(k=" + str(self.k) + ", n=" + str(self.n) + ", retained=" + str(self._size) + ")"
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Check accuracy and throughput against exact quantiles, e.g. python quantile_sketch.py 1000000 (number of values).
+# ---------------------------------------------------------------------------------------------------------------------
+
+def benchmark(count, k=DEFAULT_K, parts=8, seed=4711):
+    rng = random.Random(seed)
+    values = [ rng.lognormvariate(3.5, 0.6) for _ in range(count) ]
+
+    started_at = time.perf_counter()
+    sketches = [ KllSketch(k, rng) for _ in range(parts) ]
+    for index, value in enumerate(values):
+        sketches[index % parts].update(value)
+    update_secs = time.perf_counter() - started_at
+    # Like containers merging their sketches into the stored one.
+    merged = KllSketch(k, rng)
+    for sketch in sketches:
+        merged = KllSketch.from_bytes(merged.merge(sketch).to_bytes(), rng)
+
+    exact = sorted(values)
+    max_rank_error = 0.0
+    for q in [ 0.5, 0.9, 0.95, 0.99, 0.999 ]:
+        estimate = merged.quantile(q)
+        exact_rank = sum(1 for value in exact if value <= estimate) / count
+        max_rank_error = max(max_rank_error, abs(exact_rank - q))
+    return {
+        "values": count,
+        "k": k,
+        "retained": sum(len(level_values) for level_values in merged.levels),
+        "serialized-bytes": len(merged.to_bytes()),
+        "max-rank-error": round(max_rank_error, 5),
+        "updates-per-sec": int(count / update_secs)
+    }
+
+if __name__ == "__main__":
+    for count in ([ int(sys.argv[1]) ] if len(sys.argv) > 1 else [ 10000, 100000, 1000000 ]):
+        print(json.dumps(benchmark(count)))
+
+# ---------------------------------------------------------------------------------------------------------------------
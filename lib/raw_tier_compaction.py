@@ -0,0 +1,392 @@
+import os
+import re
+import json
+import shutil
+import datetime
+import tempfile
+import pyarrow
+import pyarrow.compute
+import pyarrow.parquet
+import lambda_events
+import object_storage
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Compaction of the raw tier: the delivery stream leaves many small Parquet objects per partition and day, which
+# queries pay for with a request and a footer read each. Compaction merges the objects of a partition into a few
+# large files, sorted by publication time and compressed, and records what it did in a manifest.
+#
+# A partition is compacted in generations:
+# 1. The new objects are sorted into runs on local scratch, a run at a time, and the runs are merged with the files of
+#    the previous generation (which are sorted already) - batch by batch, never a whole partition in memory.
+# 2. The merged files of the new generation are uploaded next to the objects they replace.
+# 3. The manifest is written - this is the point of no return.
+# 4. The replaced objects (new objects, previous generation) are deleted.
+# A rerun repeats what's missing: files of a generation that never got its manifest are dropped, objects the manifest
+# replaced are deleted, and a partition without new objects is left alone. Queries ignore the manifest, as it starts
+# with an underscore - but they see the new generation next to the replaced objects for the moment between 3 and 4.
+# ---------------------------------------------------------------------------------------------------------------------
+
+MANIFEST_NAME = "_compaction_manifest.json"
+MANIFEST_VERSION = 1
+COMPACTED_NAME_FORMAT = "compacted-g%04d-%05d.parquet"
+COMPACTED_NAME_PATTERN = re.compile(r"^compacted-g(\d{4})-(\d{5})\.parquet$")
+
+# Sort order: publication time, event ID as the tie breaker so that reruns write the very same files.
+SORT_COLUMNS = [ lambda_events.get_column_name("published-at"), lambda_events.get_column_name("event-id") ]
+SORT_KEY_SEPARATOR = "\x1f"
+
+# Runs are sorted in memory, so their input is limited (Parquet size of the objects going into one run).
+RUN_MAX_BYTES = 64 * 1024 * 1024
+# The merge holds a batch per run, and merges in several passes if there are more runs than that.
+MERGE_BATCH_ROWS = 8192
+MAX_MERGE_FAN_IN = 64
+# Output files: large enough to take the per-file overhead out of queries, small enough to be split across readers.
+TARGET_FILE_BYTES = 256 * 1024 * 1024
+ROW_GROUP_ROWS = 128 * 1024
+# The compacted files are read far more often than they are written, so they get the better ratio.
+COMPRESSION = "zstd"
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Sorted tables: a sort key per row, and tables conformed to the schema of the partition.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def get_sort_keys(table):
+    return pyarrow.compute.binary_join_element_wise(
+        *[ pyarrow.compute.fill_null(table.column(column).cast(pyarrow.string()), "") for column in SORT_COLUMNS ],
+        SORT_KEY_SEPARATOR)
+
+def sort_table(table):
+    return table.take(pyarrow.compute.sort_indices(get_sort_keys(table)))
+
+def conform(table, schema):
+    # Columns are only ever added at the end of the schema, older files just lack the newer ones.
+    columns = []
+    for field in schema:
+        if field.name in table.column_names:
+            columns.append(table.column(field.name).cast(field.type))
+        else:
+            columns.append(pyarrow.nulls(table.num_rows, field.type))
+    return pyarrow.Table.from_arrays(columns, schema=schema)
+
+class SortedFileWriter:
+
+    # Writes sorted tables into a sequence of Parquet files, starting a new file once the current one is large enough.
+    def __init__(self, schema, create_path, compression, target_file_bytes=None):
+        self.schema = schema
+        self.create_path = create_path
+        self.compression = compression
+        self.target_file_bytes = target_file_bytes
+        self.writer = None
+        self.pending = []
+        self.pending_rows = 0
+        self.files = []
+
+    def write(self, table):
+        self.pending.append(table)
+        self.pending_rows += table.num_rows
+        if self.pending_rows >= ROW_GROUP_ROWS:
+            self.flush()
+
+    def flush(self):
+        if self.pending_rows == 0:
+            return
+        table = pyarrow.concat_tables(self.pending)
+        self.pending = []
+        self.pending_rows = 0
+        if self.writer is None:
+            path = self.create_path(len(self.files))
+            self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression=self.compression)
+            self.files.append({ "path": path, "rows": 0, "first": None, "last": None })
+        self.writer.write_table(table, row_group_size=ROW_GROUP_ROWS)
+        current = self.files[-1]
+        current["rows"] += table.num_rows
+        keys = get_sort_keys(table.select(SORT_COLUMNS))
+        current["first"] = current["first"] or keys[0].as_py()
+        current["last"] = keys[-1].as_py()
+        if self.target_file_bytes is not None and os.path.getsize(current["path"]) >= self.target_file_bytes:
+            self.close_file()
+
+    def close_file(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def close(self):
+        self.flush()
+        self.close_file()
+        return self.files
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Sort runs and merge them.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def write_runs(paths, schema, create_path):
+    # Sorts the (unsorted) files into runs of up to RUN_MAX_BYTES, returns the paths of the runs.
+    runs = []
+    tables = []
+    size = 0
+    for index, path in enumerate(paths):
+        tables.append(conform(pyarrow.parquet.ParquetFile(path).read(), schema))
+        size += os.path.getsize(path)
+        # The objects are on scratch only until they are in a run.
+        os.remove(path)
+        if size >= RUN_MAX_BYTES or index == len(paths) - 1:
+            run_path = create_path(len(runs))
+            pyarrow.parquet.write_table(sort_table(pyarrow.concat_tables(tables)), run_path,
+                row_group_size=MERGE_BATCH_ROWS, compression="none")
+            runs.append(run_path)
+            tables = []
+            size = 0
+    return runs
+
+def read_batches(path, schema):
+    for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=MERGE_BATCH_ROWS):
+        table = conform(pyarrow.Table.from_batches([ batch ]), schema)
+        yield table, get_sort_keys(table)
+
+def merge_runs(paths, writer, schema):
+    # Merges sorted runs batch-wise: everything up to the smallest last key of the current batches can be written, as
+    # any row still to come is at least as large. Each step uses up at least one batch.
+    heads = []
+    for path in paths:
+        batches = read_batches(path, schema)
+        head = next(batches, None)
+        if head is not None:
+            heads.append([ head[0], head[1], batches ])
+    while heads:
+        bound = min(keys[-1].as_py() for _, keys, _ in heads)
+        taken = []
+        for head in heads:
+            table, keys, _ = head
+            count = pyarrow.compute.sum(pyarrow.compute.less_equal(keys, bound)).as_py() or 0
+            if count > 0:
+                taken.append(table.slice(0, count))
+                head[0], head[1] = table.slice(count), keys.slice(count)
+        writer.write(sort_table(pyarrow.concat_tables(taken)))
+        remaining = []
+        for head in heads:
+            while head[0].num_rows == 0:
+                refill = next(head[2], None)
+                if refill is None:
+                    break
+                head[0], head[1] = refill
+            if head[0].num_rows > 0:
+                remaining.append(head)
+        heads = remaining
+
+def merge_all(runs, schema, scratch, output_writer):
+    # Merges in passes of MAX_MERGE_FAN_IN runs until the last pass fits into one.
+    merge_pass = 0
+    while len(runs) > MAX_MERGE_FAN_IN:
+        merged = []
+        for start in range(0, len(runs), MAX_MERGE_FAN_IN):
+            prefix = os.path.join(scratch, "merge-%02d-%05d" % (merge_pass, start))
+            writer = SortedFileWriter(schema, lambda index: "%s-%05d.parquet" % (prefix, index), "none")
+            merge_runs(runs[start:start + MAX_MERGE_FAN_IN], writer, schema)
+            merged.extend(written["path"] for written in writer.close())
+            for run in runs[start:start + MAX_MERGE_FAN_IN]:
+                os.remove(run)
+        runs = merged
+        merge_pass += 1
+    merge_runs(runs, output_writer, schema)
+    return output_writer.close()
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Compact a partition.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def get_name(key):
+    return key.rsplit("/", 1)[-1]
+
+def read_manifest(storage, partition):
+    text = storage.get_text(partition + MANIFEST_NAME)
+    return json.loads(text) if text else None
+
+def create_manifest(partition, generation, inputs, outputs):
+    return {
+        "version": MANIFEST_VERSION,
+        "partition": partition,
+        "generation": generation,
+        "compacted-at": datetime.datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "sort-columns": SORT_COLUMNS,
+        "compression": COMPRESSION,
+        "inputs": inputs,
+        "outputs": outputs,
+        "rows": sum(output["rows"] for output in outputs)
+    }
+
+def compact_partition(LOGGER, storage, partition, scratch_root=None):
+    # Returns a summary of what was done: the generation, and the numbers of input and output files, rows and bytes.
+    # Object keys are never reused - the delivery stream's contain a random ID - so a key the manifest knows is the
+    # object the manifest knows.
+    manifest = read_manifest(storage, partition)
+    generation = manifest["generation"] if manifest else 0
+    committed = set(output["key"] for output in manifest["outputs"]) if manifest else set()
+    replaced = set(replaced_object["key"] for replaced_object in manifest["inputs"]) if manifest else set()
+
+    objects = storage.list_objects(partition)
+    leftovers = [ key for key in objects if key in replaced and key not in committed ]
+    orphans = [ key for key in objects if COMPACTED_NAME_PATTERN.match(get_name(key)) and key not in committed and key not in replaced ]
+    new_objects = [ key for key in objects if key not in committed and key not in replaced and key not in orphans
+        and not get_name(key).startswith(("_", ".")) ]
+    if leftovers or orphans:
+        LOGGER.info("Partition %s: deleting %d replaced objects and %d files of an unfinished generation.", partition, len(leftovers), len(orphans))
+        storage.delete(leftovers + orphans)
+    summary = { "partition": partition, "generation": generation, "inputs": 0, "outputs": 0, "rows": 0, "input-bytes": 0, "output-bytes": 0 }
+    if not new_objects:
+        LOGGER.debug("Partition %s: nothing new to compact.", partition)
+        return summary
+
+    generation += 1
+    sorted_keys = sorted(committed)
+    inputs = [ { "key": key, "size": objects[key] } for key in sorted_keys + new_objects ]
+    input_keys = [ key for key in sorted_keys + new_objects ]
+    scratch = tempfile.mkdtemp(prefix="compaction-", dir=scratch_root)
+    try:
+        # Download first, the schema of the partition covers all of its files.
+        paths = {}
+        for index, key in enumerate(input_keys):
+            paths[key] = os.path.join(scratch, "input-%05d.parquet" % index)
+            storage.download(key, paths[key])
+        schema = pyarrow.unify_schemas([ pyarrow.parquet.read_schema(paths[key]) for key in input_keys ])
+
+        runs = [ paths[key] for key in sorted_keys ]
+        runs += write_runs([ paths[key] for key in new_objects ], schema, lambda index: os.path.join(scratch, "run-%05d.parquet" % index))
+        output_writer = SortedFileWriter(schema, lambda index: os.path.join(scratch, COMPACTED_NAME_FORMAT % (generation, index)),
+            COMPRESSION, TARGET_FILE_BYTES)
+        written = merge_all(runs, schema, scratch, output_writer)
+
+        outputs = []
+        for output in written:
+            key = partition + get_name(output["path"])
+            storage.upload(output["path"], key)
+            outputs.append({ "key": key, "size": os.path.getsize(output["path"]), "rows": output["rows"],
+                "first": output["first"], "last": output["last"] })
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    storage.put_text(partition + MANIFEST_NAME, json.dumps(create_manifest(partition, generation, inputs, outputs), indent=2))
+    storage.delete(input_keys)
+    summary.update({
+        "generation": generation,
+        "inputs": len(inputs),
+        "outputs": len(outputs),
+        "rows": sum(output["rows"] for output in outputs),
+        "input-bytes": sum(objects[key] for key in input_keys),
+        "output-bytes": sum(output["size"] for output in outputs)
+    })
+    LOGGER.info("Partition %s: generation %d, %d objects compacted into %d files.", partition, generation, len(inputs), len(outputs))
+    return summary
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Compact the partitions of a day, across event types and services.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def list_partitions(storage, prefix, date):
+    partitions = []
+    for event_type_prefix in storage.list_prefixes(prefix):
+        for service_prefix in storage.list_prefixes(event_type_prefix):
+            partition = service_prefix + "date=" + date + "/"
+            if storage.list_objects(partition):
+                partitions.append(partition)
+    return partitions
+
+def compact_date(LOGGER, storage, prefix, date, scratch_root=None):
+    summaries = []
+    for partition in list_partitions(storage, prefix, date):
+        try:
+            summaries.append(compact_partition(LOGGER, storage, partition, scratch_root))
+        except Exception as ex:
+            # The partition stays as it is, and the next run tries again.
+            LOGGER.exception("Something went wrong with compacting partition %s.", partition)
+            LOGGER.exception(ex)
+            summaries.append({ "partition": partition, "error": str(ex) })
+    return summaries
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Compact a local directory tree, e.g. python raw_tier_compaction.py <root> <prefix> <date> - or simulate a day of
+# small objects in a temporary directory, compact them and check the result, e.g. python raw_tier_compaction.py 200000.
+# ---------------------------------------------------------------------------------------------------------------------
+
+ARROW_TYPES = { "string": pyarrow.string(), "int": pyarrow.int32(), "list<string>": pyarrow.list_(pyarrow.string()) }
+
+def create_catalog_schema():
+    return pyarrow.schema([ (lambda_events.get_column_name(field), ARROW_TYPES[field_type])
+        for field, field_type in lambda_events.FIELD_TYPES if field not in lambda_events.PARTITION_FIELDS ]
+        + [ (lambda_events.FIELD_EVENT, pyarrow.string()) ])
+
+def write_small_objects(storage, prefix, date, notifications, objects_per_partition, wave):
+    schema = create_catalog_schema()
+    rows_per_partition = {}
+    for text in notifications:
+        fields, message = lambda_events.normalize(text)
+        partition = "%sevent_type=%s/service=%s/date=%s/" % (prefix, fields["event-type"], fields["service"], fields["date"])
+        rows = rows_per_partition.setdefault(partition, [])
+        rows.append(dict([ (lambda_events.get_column_name(field), fields[field]) for field in lambda_events.FIELDS
+            if field not in lambda_events.PARTITION_FIELDS ] + [ (lambda_events.FIELD_EVENT, message) ]))
+    for partition, rows in rows_per_partition.items():
+        os.makedirs(storage.get_path(partition), exist_ok=True)
+        size = max(1, len(rows) // objects_per_partition)
+        for start in range(0, len(rows), size):
+            pyarrow.parquet.write_table(pyarrow.Table.from_pylist(rows[start:start + size], schema=schema),
+                storage.get_path(partition + "stream-%s-%d-%06d" % (date, wave, start)), compression="snappy")
+    return sum(len(rows) for rows in rows_per_partition.values())
+
+def check_partition(storage, partition):
+    manifest = read_manifest(storage, partition)
+    keys = []
+    for output in manifest["outputs"]:
+        keys.extend(get_sort_keys(pyarrow.parquet.read_table(storage.get_path(output["key"]))).to_pylist())
+    assert keys == sorted(keys), "Partition %s is not sorted." % partition
+    assert sorted(storage.list_objects(partition)) == sorted([ output["key"] for output in manifest["outputs"] ] + [ partition + MANIFEST_NAME ])
+    return len(keys)
+
+def simulate(count, directory, objects_per_partition=200, seed=4711):
+    import time
+    import random
+    import logging
+    logging.basicConfig(level=logging.WARNING)
+    logger = logging.getLogger("simulation")
+    storage = object_storage.LocalStorage(directory)
+    prefix = "dev-wrbs-dlin-LambdaEventIngestionStream/"
+    date = "2026-10-19"
+    rng = random.Random(seed)
+    notifications = [ lambda_events.create_notification(rng, index, date)[0] for index in range(count) ]
+    rng.shuffle(notifications)
+    rows = write_small_objects(storage, prefix, date, notifications[:count * 9 // 10], objects_per_partition, 1)
+
+    results = { "events": count }
+    started_at = time.perf_counter()
+    summaries = compact_date(logger, storage, prefix, date)
+    results["compaction-ms"] = round((time.perf_counter() - started_at) * 1000)
+    results["objects"] = sum(summary["inputs"] for summary in summaries)
+    results["files"] = sum(summary["outputs"] for summary in summaries)
+    results["input-bytes"] = sum(summary["input-bytes"] for summary in summaries)
+    results["output-bytes"] = sum(summary["output-bytes"] for summary in summaries)
+    assert sum(check_partition(storage, summary["partition"]) for summary in summaries) == rows
+
+    # A rerun without new objects leaves everything as it is.
+    assert all(summary["generation"] == 1 and summary["inputs"] == 0 for summary in compact_date(logger, storage, prefix, date))
+
+    # Late objects make for a new generation, together with the files of the previous one.
+    rows += write_small_objects(storage, prefix, date, notifications[count * 9 // 10:], objects_per_partition // 10, 2)
+    started_at = time.perf_counter()
+    summaries = compact_date(logger, storage, prefix, date)
+    results["late-compaction-ms"] = round((time.perf_counter() - started_at) * 1000)
+    assert all(summary["generation"] == (2 if summary["inputs"] else 1) for summary in summaries)
+    results["late-objects"] = sum(summary["inputs"] for summary in summaries)
+    assert sum(check_partition(storage, summary["partition"]) for summary in summaries) == rows
+    results["rows"] = rows
+    return results
+
+if __name__ == "__main__":
+    import sys
+    import logging
+    if len(sys.argv) == 4:
+        logging.basicConfig(level=logging.INFO)
+        print(json.dumps(compact_date(logging.getLogger("compaction"), object_storage.LocalStorage(sys.argv[1]), sys.argv[2], sys.argv[3]), indent=2))
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            print(json.dumps(simulate(int(sys.argv[1]) if len(sys.argv) > 1 else 100000, directory)))
+
+# ---------------------------------------------------------------------------------------------------------------------
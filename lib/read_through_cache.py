@@ -0,0 +1,157 @@
+import json
+import time
+import collections
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Globals.
+# ---------------------------------------------------------------------------------------------------------------------
+
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_TTL_SECS = 3600
+# Misses are only remembered briefly, the item might just not have been written yet.
+DEFAULT_NEGATIVE_TTL_SECS = 30
+
+# Outcomes of a lookup, also used as the names of the hit/miss counters.
+OUTCOME_LOCAL_HIT = "local-hit"
+OUTCOME_SHARED_HIT = "shared-hit"
+OUTCOME_NEGATIVE_HIT = "negative-hit"
+OUTCOME_MISS = "miss"
+OUTCOMES = [OUTCOME_LOCAL_HIT, OUTCOME_SHARED_HIT, OUTCOME_NEGATIVE_HIT, OUTCOME_MISS]
+
+# Marker for "we know there is no such item", since None is what the loader returns for that.
+_NOT_FOUND = object()
+# How the marker travels through the shared tier, which only stores strings.
+_NOT_FOUND_SERIALIZED = "null"
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Per-container LRU cache with a TTL per entry.
+# ---------------------------------------------------------------------------------------------------------------------
+
+class LruTtlCache:
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        # key -> (expires_at, value), least recently used first.
+        self.entries = collections.OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl_secs):
+        self.entries[key] = (time.monotonic() + ttl_secs, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Stand-in for a shared cache tier (e.g. ElastiCache) - anything with get(key) and set(key, value, ttl_secs) on string
+# values will do. This one only lives as long as the process, which is what local runs and tests need.
+# ---------------------------------------------------------------------------------------------------------------------
+
+class LocalSharedCache:
+
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.time():
+            del self.entries[key]
+            return None
+        return value
+
+    def set(self, key, value, ttl_secs):
+        self.entries[key] = (time.time() + ttl_secs, value)
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Two-level read-through cache: per-container LRU first, then the optional shared tier, then the loader.
+# ---------------------------------------------------------------------------------------------------------------------
+
+class ReadThroughCache:
+
+    def __init__(self, loader, max_entries=DEFAULT_MAX_ENTRIES, ttl_secs=DEFAULT_TTL_SECS,
+                 negative_ttl_secs=DEFAULT_NEGATIVE_TTL_SECS, shared_cache=None, key_prefix=""):
+        # The loader returns the value for a key, None if there is no such item, and raises on errors (which are
+        # never cached).
+        self.loader = loader
+        self.local_cache = LruTtlCache(max_entries)
+        self.shared_cache = shared_cache
+        self.ttl_secs = ttl_secs
+        self.negative_ttl_secs = negative_ttl_secs
+        self.key_prefix = key_prefix
+        self.counters = dict.fromkeys(OUTCOMES, 0)
+
+    def create_shared_key(self, key):
+        return self.key_prefix + json.dumps(key, separators=(",", ":"))
+
+    def get(self, LOGGER, key):
+        value, outcome = self.lookup(LOGGER, key)
+        self.counters[outcome] += 1
+        LOGGER.debug("Cache lookup for %s: %s", key, outcome)
+        return value
+
+    def lookup(self, LOGGER, key):
+        value = self.local_cache.get(key)
+        if value is _NOT_FOUND:
+            return None, OUTCOME_NEGATIVE_HIT
+        if value is not None:
+            return value, OUTCOME_LOCAL_HIT
+
+        if self.shared_cache is not None:
+            serialized = self.get_from_shared_cache(LOGGER, key)
+            if serialized == _NOT_FOUND_SERIALIZED:
+                self.local_cache.set(key, _NOT_FOUND, self.negative_ttl_secs)
+                return None, OUTCOME_NEGATIVE_HIT
+            if serialized is not None:
+                value = json.loads(serialized)
+                self.local_cache.set(key, value, self.ttl_secs)
+                return value, OUTCOME_SHARED_HIT
+
+        value = self.loader(key)
+        if value is None:
+            self.local_cache.set(key, _NOT_FOUND, self.negative_ttl_secs)
+            self.set_in_shared_cache(LOGGER, key, _NOT_FOUND_SERIALIZED, self.negative_ttl_secs)
+        else:
+            self.local_cache.set(key, value, self.ttl_secs)
+            self.set_in_shared_cache(LOGGER, key, json.dumps(value), self.ttl_secs)
+        return value, OUTCOME_MISS
+
+    def get_from_shared_cache(self, LOGGER, key):
+        try:
+            return self.shared_cache.get(self.create_shared_key(key))
+        except Exception as ex:
+            # The shared tier is an optimization only, so we simply fall through to the loader.
+            LOGGER.exception("Something went wrong with reading from the shared cache.")
+            LOGGER.exception(ex)
+            return None
+
+    def set_in_shared_cache(self, LOGGER, key, serialized, ttl_secs):
+        if self.shared_cache is None:
+            return
+        try:
+            self.shared_cache.set(self.create_shared_key(key), serialized, ttl_secs)
+        except Exception as ex:
+            LOGGER.exception("Something went wrong with writing to the shared cache.")
+            LOGGER.exception(ex)
+
+    def take_counters(self):
+        # Hand out the counters collected since the last call, e.g. to publish them as metrics.
+        counters = self.counters
+        self.counters = dict.fromkeys(OUTCOMES, 0)
+        return counters
+
+# ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,62 @@
+import sys
+import json
+import timeit
+import request_validation as rv
+import rfq_filters
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Schemas of the request payloads we accept.
+# ---------------------------------------------------------------------------------------------------------------------
+
+SUBMIT_RFQ_SCHEMA = {
+    "customer-id": rv.string(),
+    "from-location": rv.string(),
+    "to-location": rv.string(),
+    "timeout-in-secs": rv.number(minimum=1, maximum=900, integer=True),
+    # Optional RFQ constraints, see rfq_filters.
+    "max-price": rv.number(required=False, minimum=0, exclusive_minimum=True),
+    # The separator joins the goodies in the message attribute, so it can't be part of a goodie. A unicorn offers at
+    # most MAX_GOODIES_PER_UNICORN goodies, so more required goodies won't find a unicorn anyway.
+    "required-goodies": rv.string_list(required=False, max_items=rfq_filters.MAX_GOODIES_PER_UNICORN,
+        forbidden_characters=rfq_filters.GOODIES_KEY_SEPARATOR),
+    "unicorn-class": rv.string(required=False)
+}
+
+SUBMIT_RIDE_COMPLETION_SCHEMA = {
+    "unicorn-id": rv.string(),
+    "ride-id": rv.string(),
+    "customer-id": rv.string(),
+    "fare": rv.number(minimum=0),
+    "distance": rv.number(minimum=0),
+    "from": rv.string(required=False),
+    "to": rv.string(required=False)
+}
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Benchmark: validation cost per payload, e.g. python request_schemas.py ../1-business-services/*/events/*.json
+# ---------------------------------------------------------------------------------------------------------------------
+
+def benchmark(paths, number=100000):
+    validators = {
+        "submit-rfq": rv.compile_schema(SUBMIT_RFQ_SCHEMA),
+        "submit-ride-completion": rv.compile_schema(SUBMIT_RIDE_COMPLETION_SCHEMA)
+    }
+    for path in paths:
+        with open(path) as payload_file:
+            body = payload_file.read()
+        for name, validate in validators.items():
+            payload, violations = rv.parse_and_validate(validate, body)
+            parse_and_validate_us = timeit.timeit(lambda: rv.parse_and_validate(validate, body), number=number) / number * 1000000
+            validate_us = timeit.timeit(lambda: validate(payload), number=number) / number * 1000000
+            print(json.dumps({
+                "payload": path,
+                "schema": name,
+                "valid": not violations,
+                "parse-and-validate-us": round(parse_and_validate_us, 2),
+                "validate-us": round(validate_us, 2)
+            }))
+
+if __name__ == "__main__":
+    benchmark(sys.argv[1:])
+
+# ---------------------------------------------------------------------------------------------------------------------
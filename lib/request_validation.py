@@ -0,0 +1,113 @@
+import json
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Globals.
+# ---------------------------------------------------------------------------------------------------------------------
+
+BAD_REQUEST_INVALID_PAYLOAD = "Request body is invalid."
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Field specifications. Each one is compiled into a checker function that returns an error message or None.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def string(required=True, min_length=1, max_length=256, choices=None):
+    def compile_checker():
+        allowed = frozenset(choices) if choices is not None else None
+        def check(value):
+            if not isinstance(value, str):
+                return "must be a string"
+            if not min_length <= len(value) <= max_length:
+                return "must be " + str(min_length) + " to " + str(max_length) + " characters long"
+            if allowed is not None and value not in allowed:
+                return "must be one of " + ", ".join(sorted(allowed))
+            return None
+        return check
+    return required, compile_checker
+
+def number(required=True, minimum=None, maximum=None, exclusive_minimum=False, integer=False):
+    def compile_checker():
+        kind = "an integer" if integer else "a number"
+        types = (int,) if integer else (int, float)
+        def check(value):
+            # In Python, booleans are integers, but not in JSON.
+            if isinstance(value, bool) or not isinstance(value, types):
+                return "must be " + kind
+            if minimum is not None and (value <= minimum if exclusive_minimum else value < minimum):
+                return "must be " + ("greater than " if exclusive_minimum else "at least ") + str(minimum)
+            if maximum is not None and value > maximum:
+                return "must be at most " + str(maximum)
+            return None
+        return check
+    return required, compile_checker
+
+def string_list(required=True, max_items=20, max_length=256, forbidden_characters=""):
+    def compile_checker():
+        def check(value):
+            if not isinstance(value, list):
+                return "must be a list of strings"
+            if len(value) > max_items:
+                return "must have at most " + str(max_items) + " items"
+            for item in value:
+                if not isinstance(item, str) or not 1 <= len(item) <= max_length:
+                    return "must be a list of strings with 1 to " + str(max_length) + " characters each"
+                if any(character in item for character in forbidden_characters):
+                    return "must be a list of strings without " + ", ".join("'" + character + "'" for character in forbidden_characters)
+            return None
+        return check
+    return required, compile_checker
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Compile a schema (field name -> field specification) into a validator function - once, at cold start.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def compile_schema(schema):
+    checks = tuple( (name, required, compile_checker()) for name, (required, compile_checker) in schema.items() )
+
+    def validate(payload):
+        if not isinstance(payload, dict):
+            return [ { "field": None, "message": "must be a JSON object" } ]
+        violations = []
+        for name, required, check in checks:
+            value = payload.get(name)
+            if value is None:
+                if required:
+                    violations.append({ "field": name, "message": "is required" })
+                continue
+            message = check(value)
+            if message is not None:
+                violations.append({ "field": name, "message": message })
+        return violations
+
+    return validate
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Parse and validate a request body in one go.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def parse_and_validate(validate, body):
+    if not body:
+        return None, [ { "field": None, "message": "is required" } ]
+    try:
+        payload = json.loads(body)
+    except ValueError as ex:
+        return None, [ { "field": None, "message": "is no valid JSON: " + str(ex) } ]
+    return payload, validate(payload)
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Create the structured response for invalid requests.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def create_bad_request_response(LOGGER, violations):
+    LOGGER.info("Rejecting invalid request: %s", violations)
+    return {
+        "statusCode": 400,
+        "body": json.dumps({
+            "error-message": BAD_REQUEST_INVALID_PAYLOAD,
+            "violations": violations
+        }),
+        "headers": {
+            "Content-Type": "application/json"
+        }
+    }
+
+# ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,144 @@
+import json
+import itertools
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Globals.
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Optional RFQ constraints as they appear in the RFQ details submitted by the customer.
+RFQ_KEY_MAX_PRICE = "max-price"
+RFQ_KEY_REQUIRED_GOODIES = "required-goodies"
+RFQ_KEY_UNICORN_CLASS = "unicorn-class"
+
+# Message attributes that carry the RFQ constraints, so SNS can filter before any unicorn gets invoked.
+MSG_ATTR_MAX_PRICE = "max-price"
+MSG_ATTR_REQUIRED_GOODIES = "required-goodies"
+MSG_ATTR_UNICORN_CLASS = "unicorn-class"
+MSG_ATTR_INVITED_UNICORNS = "invited-unicorns"
+
+# Values used in message attributes if the customer didn't ask for a specific goodie or unicorn class.
+NO_GOODIES_REQUIRED = "NONE"
+ANY_UNICORN_CLASS = "ANY"
+# Value used in message attributes if the RFQ is open to all unicorns.
+ALL_UNICORNS_INVITED = "ALL"
+
+# Separator for the canonical goodies key, must not appear in goodie names.
+GOODIES_KEY_SEPARATOR = "+"
+
+# SNS allows 150 combinations of values per filter policy - the product of the number of values of each attribute.
+# A unicorn's policy allows 2 (max price) x 2 (class) x 2 (invitation) x 2^n (subsets of its n goodies), which leaves
+# room for 4 goodies (128 combinations).
+MAX_FILTER_POLICY_COMBINATIONS = 150
+MAX_GOODIES_PER_UNICORN = 4
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Extract the optional constraints from the RFQ details.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def extract_rfq_constraints(LOGGER, rfq_details):
+    constraints = {}
+
+    max_price = rfq_details.get(RFQ_KEY_MAX_PRICE)
+    if max_price is not None:
+        if isinstance(max_price, bool) or not isinstance(max_price, (int, float)) or max_price <= 0:
+            raise ValueError("'" + RFQ_KEY_MAX_PRICE + "' must be a positive number.")
+        constraints[RFQ_KEY_MAX_PRICE] = max_price
+
+    required_goodies = rfq_details.get(RFQ_KEY_REQUIRED_GOODIES, [])
+    if not isinstance(required_goodies, list) or not all(isinstance(goodie, str) for goodie in required_goodies):
+        raise ValueError("'" + RFQ_KEY_REQUIRED_GOODIES + "' must be a list of goodie names.")
+    if any(GOODIES_KEY_SEPARATOR in goodie for goodie in required_goodies):
+        raise ValueError("Goodie names in '" + RFQ_KEY_REQUIRED_GOODIES + "' must not contain '" + GOODIES_KEY_SEPARATOR + "'.")
+    constraints[RFQ_KEY_REQUIRED_GOODIES] = sorted(set(required_goodies))
+
+    unicorn_class = rfq_details.get(RFQ_KEY_UNICORN_CLASS, ANY_UNICORN_CLASS)
+    if not isinstance(unicorn_class, str) or not unicorn_class:
+        raise ValueError("'" + RFQ_KEY_UNICORN_CLASS + "' must be a non-empty string.")
+    constraints[RFQ_KEY_UNICORN_CLASS] = unicorn_class
+
+    LOGGER.debug("rfq_constraints: %s", constraints)
+    return constraints
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Create a canonical key for a set of goodies.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def create_goodies_key(goodies):
+    # SNS filter policies can only check whether an attribute value is in a list of allowed values.
+    # "Unicorn offers all required goodies" is a subset check, so we encode the required goodies as one sorted key
+    # and let each subscription allow every subset of the goodies its unicorn is able to offer.
+    if not goodies:
+        return NO_GOODIES_REQUIRED
+    return GOODIES_KEY_SEPARATOR.join(sorted(set(goodies)))
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Create the message attributes for the RFQ constraints.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def create_constraint_message_attributes(LOGGER, constraints):
+    message_attributes = {
+        MSG_ATTR_REQUIRED_GOODIES: {
+            "DataType": "String",
+            "StringValue": create_goodies_key(constraints.get(RFQ_KEY_REQUIRED_GOODIES))
+        },
+        MSG_ATTR_UNICORN_CLASS: {
+            "DataType": "String",
+            "StringValue": constraints.get(RFQ_KEY_UNICORN_CLASS, ANY_UNICORN_CLASS)
+        }
+    }
+    # Without a price limit, the attribute is left out and subscription filter policies accept its absence.
+    if constraints.get(RFQ_KEY_MAX_PRICE) is not None:
+        message_attributes[MSG_ATTR_MAX_PRICE] = {
+            "DataType": "Number",
+            "StringValue": str(constraints[RFQ_KEY_MAX_PRICE])
+        }
+    LOGGER.debug("Constraint message attributes: %s", message_attributes)
+    return message_attributes
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Create the message attribute that tells which unicorns are invited to an RFQ (None means all of them).
+# ---------------------------------------------------------------------------------------------------------------------
+
+def create_invitation_message_attributes(LOGGER, invited_unicorns):
+    if not invited_unicorns:
+        invited_unicorns = [ALL_UNICORNS_INVITED]
+    message_attributes = {
+        MSG_ATTR_INVITED_UNICORNS: { "DataType": "String.Array", "StringValue": json.dumps(invited_unicorns) }
+    }
+    LOGGER.debug("Invitation message attributes: %s", message_attributes)
+    return message_attributes
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Create the SNS subscription filter policy for a unicorn from its capabilities.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def create_subscription_filter_policy(unicorn_id, unicorn_class, min_fare, goodies):
+    goodies = sorted(set(goodies))
+    if any(GOODIES_KEY_SEPARATOR in goodie for goodie in goodies):
+        raise ValueError("Goodie names must not contain '" + GOODIES_KEY_SEPARATOR + "'.")
+    if len(goodies) > MAX_GOODIES_PER_UNICORN:
+        # Every subset of the goodies is a value of its own, the policy would exceed what SNS accepts.
+        raise ValueError("A unicorn can offer at most " + str(MAX_GOODIES_PER_UNICORN) + " goodies in its filter policy, "
+            + "there are " + str(len(goodies)) + ".")
+    goodies_keys = [NO_GOODIES_REQUIRED]
+    for size in range(1, len(goodies) + 1):
+        for subset in itertools.combinations(goodies, size):
+            goodies_keys.append(create_goodies_key(subset))
+
+    return {
+        MSG_ATTR_MAX_PRICE: [{"numeric": [">=", min_fare]}, {"exists": False}],
+        MSG_ATTR_REQUIRED_GOODIES: goodies_keys,
+        MSG_ATTR_UNICORN_CLASS: [ANY_UNICORN_CLASS, unicorn_class],
+        MSG_ATTR_INVITED_UNICORNS: [ALL_UNICORNS_INVITED, unicorn_id]
+    }
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Print the filter policy for a unicorn, e.g. to paste it into the unicorn management service template.
+#   python rfq_filters.py <unicorn-id> <unicorn-class> <min-fare> [<goodie> ...]
+# ---------------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    import sys
+    print(json.dumps(create_subscription_filter_policy(sys.argv[1], sys.argv[2], float(sys.argv[3]), sys.argv[4:]), indent=2))
+
+# ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,53 @@
+import os
+import uuid
+import datetime
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Globals.
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Layout of a UUIDv7: 48 bits Unix timestamp in milliseconds, 4 bits version, 12 bits random, 2 bits variant, 62 bits
+# random. Since the timestamp comes first, the string representations sort in time order - just what a sort key needs.
+UUID_VERSION = 7
+UUID_VARIANT = 0b10
+
+TIMESTAMP_BITS = 48
+RAND_A_BITS = 12
+RAND_B_BITS = 62
+
+MAX_TIMESTAMP_MS = (1 << TIMESTAMP_BITS) - 1
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Convert a timestamp to milliseconds since the epoch (naive timestamps are taken as UTC, like all of ours).
+# ---------------------------------------------------------------------------------------------------------------------
+
+def to_epoch_millis(timestamp):
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+    return min(max(int(timestamp.timestamp() * 1000), 0), MAX_TIMESTAMP_MS)
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Assemble a UUIDv7 from its parts.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def assemble_id(timestamp_ms, rand_a, rand_b):
+    value = timestamp_ms
+    value = (value << 4) | UUID_VERSION
+    value = (value << RAND_A_BITS) | rand_a
+    value = (value << 2) | UUID_VARIANT
+    value = (value << RAND_B_BITS) | rand_b
+    return str(uuid.UUID(int=value))
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Create a new time-ordered ID for the given timestamp (or now).
+# ---------------------------------------------------------------------------------------------------------------------
+
+def create_time_ordered_id(timestamp=None):
+    if timestamp is None:
+        timestamp = datetime.datetime.utcnow()
+    random_bits = int.from_bytes(os.urandom(10), "big")
+    rand_a = random_bits >> (80 - RAND_A_BITS)
+    rand_b = random_bits & ((1 << RAND_B_BITS) - 1)
+    return assemble_id(to_epoch_millis(timestamp), rand_a, rand_b)
+
+# ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,485 @@
+import os
+import re
+import json
+import gzip
+import zlib
+import time
+import heapq
+import bisect
+import random
+import struct
+import shutil
+import hashlib
+import datetime
+import tempfile
+import collections
+import concurrent.futures
+import lambda_events
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Trace index: an inverted index from the IDs an event is about (correlation, customer and unicorn IDs) to where the
+# event was logged, so that all events of an RFQ or a ride can be found without searching the logs.
+#
+# - Postings (ID + event location) are sent to a delivery stream as the events are logged, which drops them into
+#   hourly prefixes of the index bucket as gzipped NDJSON objects.
+# - Every few minutes, the postings of an hour are merged into the hour's segment: a file of compressed blocks of
+#   postings sorted by ID, with a sparse index (first ID of each block) and a Bloom filter of its IDs in the footer.
+#   Segments are written in generations and replaced as a whole, with a manifest - like the raw tier compaction.
+# - A lookup checks the (cached) footers of the segments of the days in question and reads just the block(s) of the
+#   segments that have the ID - plus the postings that haven't been merged yet.
+# ---------------------------------------------------------------------------------------------------------------------
+
+ID_FIELDS = [ ("correlation-id", "correlation-ids"), ("customer-id", "customer-ids"), ("unicorn-id", "unicorn-ids") ]
+ID_KEY_SEPARATOR = ":"
+
+POSTINGS_PREFIX = "postings/"
+SEGMENTS_PREFIX = "segments/"
+MANIFEST_NAME = "_manifest.json"
+MANIFEST_VERSION = 1
+SEGMENT_NAME_FORMAT = "segment-g%04d.trix"
+SEGMENT_NAME_PATTERN = re.compile(r"^segment-g(\d{4})\.trix$")
+
+# Segment layout: magic, blocks (zlib compressed NDJSON), footer (zlib compressed JSON), trailer.
+SEGMENT_MAGIC = b"TRIX1"
+SEGMENT_TRAILER = struct.Struct(">QI5s")
+SEGMENT_VERSION = 1
+BLOCK_POSTINGS = 256
+# About 1% false positives.
+BLOOM_BITS_PER_ID = 10
+BLOOM_HASHES = 7
+
+# Firehose PutRecordBatch takes up to 500 records per call, the ones that failed are sent again.
+MAX_RECORDS_PER_PUT = 500
+MAX_PUT_ATTEMPTS = 4
+PUT_BACKOFF_SECS = 0.05
+
+# Footers (sparse index and Bloom filter) of the segments looked into lately - segments never change.
+MAX_CACHED_SEGMENTS = 256
+READ_THREADS = 16
+# An hour whose objects are replaced while we read them is listed and read again - compactions are minutes apart.
+MAX_LOOKUP_ATTEMPTS = 3
+HOUR_PATTERN = re.compile(r"/date=([^/]+)/hour=([^/]+)/")
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Postings: an ID and the location of an event that is about it.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def get_id_key(id_name, id_value):
+    return id_name + ID_KEY_SEPARATOR + id_value
+
+def create_postings(fields, log_group, log_stream, logged_at):
+    # Takes the flat fields of an event (lambda_events), and where and when (epoch millis) it was logged.
+    location = {
+        "published-at": fields["published-at"],
+        "event-id": fields["event-id"],
+        "event-type": fields["event-type"],
+        "service": fields["service"],
+        "log-group": log_group,
+        "log-stream": log_stream,
+        "logged-at": logged_at
+    }
+    postings = []
+    for id_name, field in ID_FIELDS:
+        for id_value in fields[field]:
+            postings.append(dict(location, id=get_id_key(id_name, id_value)))
+    return postings
+
+def get_sort_key(posting):
+    return posting["id"], posting["published-at"], posting["event-id"]
+
+def encode_posting(posting):
+    return json.dumps(posting, separators=(",", ":")) + "\n"
+
+def decode_postings(data):
+    # Delivered objects are gzipped, blocks are not.
+    if data[:2] == b"\x1f\x8b":
+        data = gzip.decompress(data)
+    return [ json.loads(line) for line in data.decode("utf-8").splitlines() if line ]
+
+def put_postings(LOGGER, firehose_client, stream_name, postings):
+    # One record per posting - the stream concatenates them into NDJSON. Raises if some couldn't be put after the last
+    # attempt, so that the event is delivered again (postings are deduplicated when they are merged).
+    records = [ { "Data": encode_posting(posting).encode("utf-8") } for posting in postings ]
+    for start in range(0, len(records), MAX_RECORDS_PER_PUT):
+        chunk = records[start:start + MAX_RECORDS_PER_PUT]
+        for attempt in range(1, MAX_PUT_ATTEMPTS + 1):
+            response = firehose_client.put_record_batch(DeliveryStreamName=stream_name, Records=chunk)
+            if not response.get("FailedPutCount"):
+                break
+            chunk = [ record for record, result in zip(chunk, response["RequestResponses"]) if "ErrorCode" in result ]
+            LOGGER.warning("%d postings were not put (attempt #%d).", len(chunk), attempt)
+            if attempt == MAX_PUT_ATTEMPTS:
+                raise RuntimeError("%d postings could not be put into %s." % (len(chunk), stream_name))
+            time.sleep(random.uniform(0, PUT_BACKOFF_SECS * 2 ** attempt))
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Bloom filter of the IDs of a segment.
+# ---------------------------------------------------------------------------------------------------------------------
+
+class BloomFilter:
+
+    def __init__(self, bits, hashes=BLOOM_HASHES, data=None):
+        self.bits = bits
+        self.hashes = hashes
+        self.data = bytearray(data) if data is not None else bytearray((bits + 7) // 8)
+
+    @staticmethod
+    def create(ids):
+        return BloomFilter(max(64, ids * BLOOM_BITS_PER_ID))
+
+    def get_positions(self, value):
+        digest = hashlib.blake2b(value.encode("utf-8"), digest_size=16).digest()
+        first, second = struct.unpack(">QQ", digest)
+        return [ (first + index * second) % self.bits for index in range(self.hashes) ]
+
+    def add(self, value):
+        for position in self.get_positions(value):
+            self.data[position >> 3] |= 1 << (position & 7)
+
+    def might_contain(self, value):
+        return all(self.data[position >> 3] & (1 << (position & 7)) for position in self.get_positions(value))
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Write and read segments.
+# ---------------------------------------------------------------------------------------------------------------------
+
+class SegmentWriter:
+
+    # Takes postings in sort order, drops duplicates (the same event delivered twice), and writes blocks as they fill.
+    def __init__(self, segment_file, expected_ids):
+        self.segment_file = segment_file
+        self.segment_file.write(SEGMENT_MAGIC)
+        self.offset = len(SEGMENT_MAGIC)
+        self.bloom_filter = BloomFilter.create(expected_ids)
+        self.blocks = []
+        self.block = []
+        self.last_sort_key = None
+        self.postings = 0
+        self.ids = 0
+
+    def write(self, posting):
+        sort_key = get_sort_key(posting)
+        if sort_key == self.last_sort_key:
+            return
+        if self.last_sort_key is None or sort_key[0] != self.last_sort_key[0]:
+            self.bloom_filter.add(posting["id"])
+            self.ids += 1
+        self.last_sort_key = sort_key
+        self.block.append(posting)
+        self.postings += 1
+        if len(self.block) >= BLOCK_POSTINGS:
+            self.flush()
+
+    def flush(self):
+        if not self.block:
+            return
+        data = zlib.compress("".join(encode_posting(posting) for posting in self.block).encode("utf-8"))
+        self.segment_file.write(data)
+        self.blocks.append([ self.block[0]["id"], self.block[-1]["id"], self.offset, len(data) ])
+        self.offset += len(data)
+        self.block = []
+
+    def close(self):
+        self.flush()
+        footer = zlib.compress(json.dumps({
+            "version": SEGMENT_VERSION,
+            "postings": self.postings,
+            "ids": self.ids,
+            "blocks": self.blocks,
+            "bloom-bits": self.bloom_filter.bits,
+            "bloom-hashes": self.bloom_filter.hashes,
+            "bloom-filter": self.bloom_filter.data.hex()
+        }, separators=(",", ":")).encode("utf-8"))
+        self.segment_file.write(footer)
+        self.segment_file.write(SEGMENT_TRAILER.pack(self.offset, len(footer), SEGMENT_MAGIC))
+        return { "postings": self.postings, "ids": self.ids, "blocks": len(self.blocks), "bytes": self.offset + len(footer) + SEGMENT_TRAILER.size }
+
+class SegmentReader:
+
+    # Reads the footer right away, blocks as they are needed. read_range(start, length) reads bytes of the segment,
+    # a negative start the last bytes.
+    def __init__(self, read_range):
+        self.read_range = read_range
+        footer_offset, footer_length, magic = SEGMENT_TRAILER.unpack(read_range(-SEGMENT_TRAILER.size))
+        if magic != SEGMENT_MAGIC:
+            raise ValueError("Not a trace index segment.")
+        footer = json.loads(zlib.decompress(read_range(footer_offset, footer_length)))
+        self.postings = footer["postings"]
+        self.ids = footer["ids"]
+        self.blocks = footer["blocks"]
+        self.first_ids = [ block[0] for block in self.blocks ]
+        self.bloom_filter = BloomFilter(footer["bloom-bits"], footer["bloom-hashes"], bytes.fromhex(footer["bloom-filter"]))
+
+    def read_block(self, index):
+        _, _, offset, length = self.blocks[index]
+        return decode_postings(zlib.decompress(self.read_range(offset, length)))
+
+    def might_contain(self, id_key):
+        return self.bloom_filter.might_contain(id_key)
+
+    def lookup(self, id_key):
+        if not self.might_contain(id_key):
+            return []
+        # The postings of an ID may begin at the end of the block before the first block starting with it.
+        index = max(0, bisect.bisect_left(self.first_ids, id_key) - 1)
+        postings = []
+        while index < len(self.blocks) and self.blocks[index][0] <= id_key:
+            if self.blocks[index][1] >= id_key:
+                postings.extend(posting for posting in self.read_block(index) if posting["id"] == id_key)
+            index += 1
+        return postings
+
+    def iterate(self):
+        for index in range(len(self.blocks)):
+            for posting in self.read_block(index):
+                yield posting
+
+def open_local_segment(path):
+    def read_range(start, length=None):
+        with open(path, "rb") as segment_file:
+            segment_file.seek(start, os.SEEK_END if start < 0 else os.SEEK_SET)
+            return segment_file.read() if start < 0 else segment_file.read(length)
+    return SegmentReader(read_range)
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Merge the postings of an hour into its segment.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def get_hour_prefix(prefix, date, hour):
+    return "%sdate=%s/hour=%s/" % (prefix, date, hour)
+
+def get_name(key):
+    return key.rsplit("/", 1)[-1]
+
+def get_date_and_hour(key):
+    match = HOUR_PATTERN.search(key)
+    return match.group(1), match.group(2)
+
+def compact_hour(LOGGER, storage, date, hour, scratch_root=None):
+    # Returns a summary of what was done: the generation, and the numbers of postings objects and postings.
+    postings_prefix = get_hour_prefix(POSTINGS_PREFIX, date, hour)
+    segments_prefix = get_hour_prefix(SEGMENTS_PREFIX, date, hour)
+    manifest_text = storage.get_text(segments_prefix + MANIFEST_NAME)
+    manifest = json.loads(manifest_text) if manifest_text else None
+    generation = manifest["generation"] if manifest else 0
+    segment_key = manifest["segment"] if manifest else None
+    replaced = set(manifest["inputs"]) if manifest else set()
+
+    # Delivered object keys contain a random ID, they are never reused.
+    objects = storage.list_objects(postings_prefix)
+    leftovers = [ key for key in objects if key in replaced ]
+    new_objects = [ key for key in objects if key not in replaced ]
+    stale_segments = [ key for key in storage.list_objects(segments_prefix) if SEGMENT_NAME_PATTERN.match(get_name(key)) and key != segment_key ]
+    if leftovers or stale_segments:
+        LOGGER.info("Hour %s: deleting %d merged postings objects and %d stale segments.", segments_prefix, len(leftovers), len(stale_segments))
+        storage.delete(leftovers + stale_segments)
+    summary = { "date": date, "hour": hour, "generation": generation, "inputs": 0, "postings": 0, "bytes": 0 }
+    if not new_objects:
+        return summary
+
+    # The new postings of a few minutes are sorted in memory, the segment is merged in as it is read.
+    new_postings = []
+    for key in new_objects:
+        new_postings.extend(decode_postings(storage.get_bytes(key)))
+    new_postings.sort(key=get_sort_key)
+    generation += 1
+    new_segment_key = segments_prefix + SEGMENT_NAME_FORMAT % generation
+    scratch = tempfile.mkdtemp(prefix="trace-index-", dir=scratch_root)
+    try:
+        sources = [ iter(new_postings) ]
+        expected_ids = len(new_postings)
+        if segment_key:
+            storage.download(segment_key, os.path.join(scratch, "previous.trix"))
+            previous = open_local_segment(os.path.join(scratch, "previous.trix"))
+            sources.append(previous.iterate())
+            expected_ids += previous.ids
+        with open(os.path.join(scratch, "segment.trix"), "wb") as segment_file:
+            writer = SegmentWriter(segment_file, expected_ids)
+            for posting in heapq.merge(*sources, key=get_sort_key):
+                writer.write(posting)
+            written = writer.close()
+        storage.upload(os.path.join(scratch, "segment.trix"), new_segment_key)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    storage.put_text(segments_prefix + MANIFEST_NAME, json.dumps({
+        "version": MANIFEST_VERSION,
+        "generation": generation,
+        "segment": new_segment_key,
+        "compacted-at": datetime.datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "inputs": sorted(new_objects),
+        "postings": written["postings"],
+        "ids": written["ids"]
+    }, indent=2))
+    storage.delete(new_objects + ([ segment_key ] if segment_key else []))
+    summary.update({ "generation": generation, "inputs": len(new_objects), "postings": written["postings"], "bytes": written["bytes"] })
+    LOGGER.info("Hour %s: generation %d, %d postings objects merged, %d postings.", segments_prefix, generation, len(new_objects), written["postings"])
+    return summary
+
+def list_pending_hours(storage, date):
+    return [ prefix.rstrip("/").rsplit("=", 1)[-1] for prefix in storage.list_prefixes("%sdate=%s/" % (POSTINGS_PREFIX, date)) ]
+
+def compact_dates(LOGGER, storage, dates, scratch_root=None):
+    summaries = []
+    for date in dates:
+        for hour in list_pending_hours(storage, date):
+            try:
+                summaries.append(compact_hour(LOGGER, storage, date, hour, scratch_root))
+            except Exception as ex:
+                # The postings stay where they are, and the next run tries again.
+                LOGGER.exception("Something went wrong with compacting the trace index of %s %s.", date, hour)
+                LOGGER.exception(ex)
+                summaries.append({ "date": date, "hour": hour, "error": str(ex) })
+    return summaries
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Look up the postings of an ID.
+# ---------------------------------------------------------------------------------------------------------------------
+
+SEGMENT_READERS = collections.OrderedDict()
+
+def read_segment_range(storage, key, start, length=None):
+    data = storage.get_range(key, start, length)
+    if data is None:
+        # Replaced by the next generation and deleted since it was listed.
+        raise FileNotFoundError(key)
+    return data
+
+def get_segment_reader(storage, key):
+    reader = SEGMENT_READERS.get(key)
+    if reader is None:
+        reader = SegmentReader(lambda start, length=None: read_segment_range(storage, key, start, length))
+        SEGMENT_READERS[key] = reader
+        while len(SEGMENT_READERS) > MAX_CACHED_SEGMENTS:
+            SEGMENT_READERS.popitem(last=False)
+    else:
+        SEGMENT_READERS.move_to_end(key)
+    return reader
+
+def get_latest_segment(keys):
+    # A newer generation is a superset of the older one, whether its manifest is there yet or not.
+    segments = [ key for key in keys if SEGMENT_NAME_PATTERN.match(get_name(key)) ]
+    return max(segments) if segments else None
+
+def list_segments(storage, date):
+    # The latest segment per hour.
+    keys_per_hour = {}
+    for key in storage.list_objects("%sdate=%s/" % (SEGMENTS_PREFIX, date), recursive=True):
+        keys_per_hour.setdefault(key.rsplit("/", 1)[0], []).append(key)
+    return sorted(filter(None, (get_latest_segment(keys) for keys in keys_per_hour.values())))
+
+def list_hour(storage, date, hour):
+    # Postings first, segments second, see lookup.
+    tasks = [ (lookup_postings_object, key) for key in storage.list_objects(get_hour_prefix(POSTINGS_PREFIX, date, hour)) ]
+    segment_key = get_latest_segment(storage.list_objects(get_hour_prefix(SEGMENTS_PREFIX, date, hour)))
+    if segment_key:
+        tasks.append((lookup_segment, segment_key))
+    return tasks
+
+def lookup_segment(storage, key, id_key):
+    try:
+        return get_segment_reader(storage, key).lookup(id_key)
+    except Exception:
+        SEGMENT_READERS.pop(key, None)
+        raise
+
+def lookup_postings_object(storage, key, id_key):
+    data = storage.get_bytes(key)
+    if data is None:
+        # Merged into the hour's segment and deleted since it was listed.
+        raise FileNotFoundError(key)
+    return [ posting for posting in decode_postings(data) if posting["id"] == id_key ]
+
+def lookup(storage, id_name, id_value, dates):
+    # Returns the postings of the ID in the given days, one per event, in the order the events were published.
+    # A compaction may replace the segment and merge the postings objects of an hour between listing and reading
+    # them, so the hours with objects gone are listed and read again. Anything else that goes wrong is raised.
+    id_key = get_id_key(id_name, id_value)
+    # Postings objects are only deleted once the segment they were merged into has been written. Listing them before
+    # the segments means that a postings object missing from the listing is in a segment listed after it - listing
+    # the other way round could pair an old segment with a listing that lacks what was merged into the new one.
+    tasks = []
+    for date in dates:
+        tasks.extend((lookup_postings_object, key) for key in storage.list_objects("%sdate=%s/" % (POSTINGS_PREFIX, date), recursive=True))
+        tasks.extend((lookup_segment, key) for key in list_segments(storage, date))
+    postings = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=READ_THREADS) as executor:
+        for attempt in range(1, MAX_LOOKUP_ATTEMPTS + 1):
+            futures = [ (key, executor.submit(function, storage, key, id_key)) for function, key in tasks ]
+            replaced_hours = set()
+            for key, future in futures:
+                try:
+                    found = future.result()
+                except FileNotFoundError:
+                    replaced_hours.add(get_date_and_hour(key))
+                    continue
+                # What was read before the hour was replaced is valid all the same, the same postings just come again.
+                for posting in found:
+                    postings[posting["event-id"]] = posting
+            if not replaced_hours:
+                break
+            if attempt == MAX_LOOKUP_ATTEMPTS:
+                raise RuntimeError("The trace index of %d hours kept changing while looking up %s." % (len(replaced_hours), id_key))
+            tasks = [ task for date, hour in sorted(replaced_hours) for task in list_hour(storage, date, hour) ]
+    return sorted(postings.values(), key=lambda posting: (posting["published-at"], posting["event-id"]))
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Simulate a few hours of events in a temporary directory standing in for the index bucket: deliver their postings,
+# merge them, check lookups against the events and time them, e.g. python trace_index.py 100000 (number of events).
+# ---------------------------------------------------------------------------------------------------------------------
+
+def deliver_postings(storage, date, hour, minute, postings):
+    data = gzip.compress("".join(encode_posting(posting) for posting in postings).encode("utf-8"))
+    storage.put_bytes("%sstream-%s-%s-%02d-%08x" % (get_hour_prefix(POSTINGS_PREFIX, date, hour), date, hour, minute, random.getrandbits(32)), data)
+
+def simulate(count, directory, hours=3, deliveries_per_hour=12, seed=4711):
+    import logging
+    import object_storage
+    logging.basicConfig(level=logging.WARNING)
+    logger = logging.getLogger("simulation")
+    storage = object_storage.LocalStorage(directory)
+    rng = random.Random(seed)
+    random.seed(seed)
+    date = "2026-10-19"
+
+    expected = collections.defaultdict(set)
+    deliveries = hours * deliveries_per_hour
+    delivered = [ [] for _ in range(deliveries) ]
+    for index in range(count):
+        fields, _ = lambda_events.normalize(lambda_events.create_notification(rng, index, date)[0])
+        for posting in create_postings(fields, "/aws/lambda/dev-wrbs-lelo-fn", "2026/10/19/[$LATEST]abc", index):
+            delivered[index * deliveries // count].append(posting)
+            expected[posting["id"]].add(posting["event-id"])
+
+    results = { "events": count, "postings": sum(len(postings) for postings in delivered), "ids": len(expected) }
+    compaction_secs = 0
+    for delivery, postings in enumerate(delivered):
+        hour = "%02d" % (delivery // deliveries_per_hour)
+        deliver_postings(storage, date, hour, delivery % deliveries_per_hour, postings)
+        if delivery % 3 == 2:
+            started_at = time.perf_counter()
+            compact_dates(logger, storage, [ date ])
+            compaction_secs += time.perf_counter() - started_at
+    results["compaction-ms"] = round(compaction_secs * 1000)
+    results["segment-bytes"] = sum(storage.list_objects(SEGMENTS_PREFIX, recursive=True).values())
+    results["pending-objects"] = len(storage.list_objects(POSTINGS_PREFIX, recursive=True))
+    assert all(summary["inputs"] == 0 for summary in compact_dates(logger, storage, [ date ]) if summary["hour"] != "%02d" % (hours - 1))
+
+    samples = rng.sample(sorted(expected), 200)
+    for round_name in [ "cold", "warm" ]:
+        if round_name == "cold":
+            SEGMENT_READERS.clear()
+        started_at = time.perf_counter()
+        for id_key in samples:
+            id_name, id_value = id_key.split(ID_KEY_SEPARATOR, 1)
+            found = lookup(storage, id_name, id_value, [ date ])
+            assert set(posting["event-id"] for posting in found) == expected[id_key], id_key
+        results["lookup-%s-ms" % round_name] = round((time.perf_counter() - started_at) * 1000 / len(samples), 2)
+    return results
+
+if __name__ == "__main__":
+    import sys
+    with tempfile.TemporaryDirectory() as directory:
+        print(json.dumps(simulate(int(sys.argv[1]) if len(sys.argv) > 1 else 100000, directory)))
+
+# ---------------------------------------------------------------------------------------------------------------------
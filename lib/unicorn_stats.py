@@ -0,0 +1,154 @@
+import datetime
+import random
+import time
+import boto3
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Globals.
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Statistics are kept as counters per unicorn and day, so "rolling" just means summing up the most recent windows.
+STATS_WINDOW_DAYS = 7
+# Expired windows are removed by DynamoDB TTL a bit later than they stop being relevant.
+STATS_RETENTION_DAYS = STATS_WINDOW_DAYS + 1
+# Statistics only change slowly, so publishers may reuse them for a while before scanning the table again.
+STATS_CACHE_TTL_SECS = 60
+
+ATTR_UNICORN_ID = "unicorn-id"
+ATTR_STATS_WINDOW = "stats-window"
+ATTR_EXPIRES_AT = "expires-at"
+ATTR_ANSWER_COUNT = "answer-count"
+ATTR_LATE_COUNT = "late-count"
+ATTR_LATENCY_SUM_MS = "latency-sum-ms"
+ATTR_WIN_COUNT = "win-count"
+
+# Per-container cache for the aggregated statistics: (fetched_at, unicorn_stats).
+_STATS_CACHE = {}
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Determine the statistics window for a timestamp.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def get_stats_window(timestamp):
+    return timestamp.date().isoformat()
+
+def get_expires_at(timestamp):
+    expires_at = timestamp + datetime.timedelta(days=STATS_RETENTION_DAYS)
+    return int(expires_at.replace(tzinfo=datetime.timezone.utc).timestamp())
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Add counters to the statistics window of a unicorn.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def add_to_stats(LOGGER, table_name, unicorn_id, timestamp, counters):
+    try:
+        update_expression = "SET #expires_at = :expires_at ADD " + ", ".join(
+            "#c" + str(index) + " :c" + str(index) for index in range(len(counters))
+        )
+        expression_attribute_names = {"#expires_at": ATTR_EXPIRES_AT}
+        expression_attribute_values = {":expires_at": {"N": str(get_expires_at(timestamp))}}
+        for index, (name, value) in enumerate(counters.items()):
+            expression_attribute_names["#c" + str(index)] = name
+            expression_attribute_values[":c" + str(index)] = {"N": str(value)}
+
+        ddb_client = boto3.client("dynamodb")
+        ddb_client.update_item(
+            TableName = table_name,
+            Key = {
+                ATTR_UNICORN_ID  : { "S": unicorn_id },
+                ATTR_STATS_WINDOW: { "S": get_stats_window(timestamp) }
+            },
+            UpdateExpression = update_expression,
+            ExpressionAttributeNames = expression_attribute_names,
+            ExpressionAttributeValues = expression_attribute_values
+        )
+    except Exception as ex:
+        # Statistics are nice to have, they must never break the RFQ flow.
+        LOGGER.exception("Something went wrong with updating the statistics for unicorn %s.", unicorn_id)
+        LOGGER.exception(ex)
+        return 0
+    else:
+        LOGGER.debug("Statistics for unicorn %s successfully updated: %s", unicorn_id, counters)
+        return 1
+
+def record_rfq_response(LOGGER, table_name, unicorn_id, answered_at, latency_ms, is_late):
+    return add_to_stats(LOGGER, table_name, unicorn_id, answered_at, {
+        ATTR_ANSWER_COUNT: 1,
+        ATTR_LATE_COUNT: 1 if is_late else 0,
+        ATTR_LATENCY_SUM_MS: max(0, int(latency_ms))
+    })
+
+def record_rfq_win(LOGGER, table_name, unicorn_id, won_at):
+    return add_to_stats(LOGGER, table_name, unicorn_id, won_at, {ATTR_WIN_COUNT: 1})
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Fetch the rolling statistics for all unicorns (cached per container).
+# ---------------------------------------------------------------------------------------------------------------------
+
+def fetch_unicorn_stats(LOGGER, table_name):
+    cached = _STATS_CACHE.get(table_name)
+    if cached is not None and time.monotonic() - cached[0] < STATS_CACHE_TTL_SECS:
+        LOGGER.debug("Using cached unicorn statistics.")
+        return cached[1]
+
+    try:
+        LOGGER.debug("Fetch unicorn statistics from the database.")
+        first_window = get_stats_window(datetime.datetime.utcnow() - datetime.timedelta(days=STATS_WINDOW_DAYS - 1))
+
+        # The table holds at most a handful of windows per unicorn, so scanning it once a minute is cheap.
+        ddb_client = boto3.client("dynamodb")
+        paginator = ddb_client.get_paginator("scan")
+        unicorn_stats = {}
+        for page in paginator.paginate(
+            TableName = table_name,
+            FilterExpression = "#window >= :first_window",
+            ExpressionAttributeNames = {"#window": ATTR_STATS_WINDOW},
+            ExpressionAttributeValues = {":first_window": {"S": first_window}}
+        ):
+            for item in page["Items"]:
+                stats = unicorn_stats.setdefault(item[ATTR_UNICORN_ID]["S"], {
+                    ATTR_ANSWER_COUNT: 0, ATTR_LATE_COUNT: 0, ATTR_LATENCY_SUM_MS: 0, ATTR_WIN_COUNT: 0
+                })
+                for name in stats:
+                    if name in item:
+                        stats[name] += int(item[name]["N"])
+    except Exception as ex:
+        LOGGER.exception("Something went wrong with fetching the unicorn statistics.")
+        LOGGER.exception(ex)
+        return {}
+
+    LOGGER.debug("unicorn_stats: %s", unicorn_stats)
+    _STATS_CACHE[table_name] = (time.monotonic(), unicorn_stats)
+    return unicorn_stats
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Rank unicorns by the quality of their past answers.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def calculate_quality_score(stats):
+    answer_count = stats[ATTR_ANSWER_COUNT]
+    # Smooth the rates so that a unicorn with very few answers is neither a hero nor a villain right away.
+    win_rate = (stats[ATTR_WIN_COUNT] + 1) / (answer_count + 2)
+    on_time_rate = (answer_count - stats[ATTR_LATE_COUNT] + 1) / (answer_count + 2)
+    avg_latency_secs = stats[ATTR_LATENCY_SUM_MS] / answer_count / 1000 if answer_count else 0
+    return win_rate * on_time_rate / (1 + avg_latency_secs)
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Select the unicorns to invite to an RFQ; None means inviting all of them.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def select_unicorns(LOGGER, unicorn_stats, max_count, exploration_share):
+    # A share of RFQs goes out to everyone, which is how unicorns without statistics get traffic at all.
+    if random.random() < exploration_share:
+        LOGGER.debug("Exploration RFQ, inviting all unicorns.")
+        return None
+    if max_count <= 0 or len(unicorn_stats) <= max_count:
+        LOGGER.debug("Not enough known unicorns to select from, inviting all unicorns.")
+        return None
+
+    ranking = sorted(unicorn_stats, key=lambda unicorn_id: calculate_quality_score(unicorn_stats[unicorn_id]), reverse=True)
+    selected_unicorns = ranking[:max_count]
+    LOGGER.debug("selected_unicorns: %s", selected_unicorns)
+    return selected_unicorns
+
+# ---------------------------------------------------------------------------------------------------------------------
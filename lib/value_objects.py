@@ -0,0 +1,228 @@
+import sys
+import json
+import timeit
+import tracemalloc
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Base class for value objects that travel as JSON: the fields are only decoded when somebody asks for them, and the
+# JSON encoding is done at most once, no matter how often the object gets persisted, published or returned.
+# Value objects are immutable - don't change the dict you get from get_fields(), derive a new object instead.
+# ---------------------------------------------------------------------------------------------------------------------
+
+class JsonValueObject:
+
+    __slots__ = ("_encoded", "_fields")
+
+    def __init__(self, encoded=None, fields=None):
+        self._encoded = encoded
+        self._fields = fields
+
+    @classmethod
+    def from_json(cls, encoded):
+        return cls(encoded=encoded)
+
+    @classmethod
+    def from_fields(cls, fields):
+        return cls(fields=fields)
+
+    def get_fields(self):
+        if self._fields is None:
+            self._fields = json.loads(self._encoded)
+        return self._fields
+
+    def get(self, name, default=None):
+        return self.get_fields().get(name, default)
+
+    def to_json(self):
+        if self._encoded is None:
+            self._encoded = json.dumps(self._fields)
+        return self._encoded
+
+    def derive(self, additional_fields):
+        fields = dict(self.get_fields())
+        fields.update(additional_fields)
+        return type(self)(fields=fields)
+
+    def __repr__(self):
+        return type(self).__name__ + "(" + self.to_json() + ")"
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Request for quotes as submitted by a customer (plus the timestamps and correlation ID we add).
+# ---------------------------------------------------------------------------------------------------------------------
+
+class Rfq(JsonValueObject):
+
+    __slots__ = ()
+
+    @property
+    def customer_id(self):
+        return self.get_fields()["customer-id"]
+
+    @property
+    def correlation_id(self):
+        return self.get_fields()["correlation-id"]
+
+    @property
+    def from_location(self):
+        return self.get_fields()["from-location"]
+
+    @property
+    def to_location(self):
+        return self.get_fields()["to-location"]
+
+    @property
+    def timeout_in_secs(self):
+        return self.get_fields()["timeout-in-secs"]
+
+    @property
+    def submitted_at(self):
+        return self.get_fields()["submitted-at"]
+
+    @property
+    def timeout_at(self):
+        return self.get_fields()["timeout-at"]
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Quote of a unicorn in response to an RFQ.
+# ---------------------------------------------------------------------------------------------------------------------
+
+class Quote(JsonValueObject):
+
+    __slots__ = ()
+
+    @property
+    def price(self):
+        return self.get_fields().get("price")
+
+    @property
+    def submitted_at(self):
+        # The timestamps of the RFQ, echoed by the unicorn.
+        return self.get_fields().get("submitted-at")
+
+    @property
+    def timeout_at(self):
+        return self.get_fields().get("timeout-at")
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Completed ride as submitted by a unicorn (plus the timestamp and correlation ID we add).
+# ---------------------------------------------------------------------------------------------------------------------
+
+class CompletedRide(JsonValueObject):
+
+    __slots__ = ()
+
+    def get_unicorn_id(self):
+        return self.get_fields()["unicorn-id"]
+
+    def get_customer_id(self):
+        return self.get_fields()["customer-id"]
+
+    def get_ride_id(self):
+        return self.get_fields()["ride-id"]
+
+    def get_submitted_at(self):
+        return self.get_fields()["submitted-at"]
+
+    def get_correlation_id(self):
+        return self.get_fields()["correlation-id"]
+
+    def get_fare_as_string(self):
+        return str(self.get_fields()["fare"])
+
+    def get_distance_as_string(self):
+        return str(self.get_fields()["distance"])
+
+    def get_ride_details(self):
+        return self.get_fields()
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Encode a resource representation that embeds a value object, reusing the value object's encoding.
+# ---------------------------------------------------------------------------------------------------------------------
+
+def encode_with_embedded(data, name, value_object):
+    encoded = json.dumps(data)
+    if encoded == "{}":
+        return "{" + json.dumps(name) + ": " + value_object.to_json() + "}"
+    return encoded[:-1] + ", " + json.dumps(name) + ": " + value_object.to_json() + "}"
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Benchmark: allocations and time of the submit-RFQ flow (decode, extend, persist, publish, respond) with plain dicts
+# versus value objects - derived from the request body, or created from the decoded fields like the submit-RFQ handler
+# does. All flows persist and publish the same payload. Plus reading the fields of a quote, e.g.
+# python value_objects.py ../1-business-services/120-ride-booking-service/events/*.json
+# ---------------------------------------------------------------------------------------------------------------------
+
+RFQ_ADDITIONAL_FIELDS = {
+    "submitted-at": "2021-06-09T10:00:00.000000",
+    "correlation-id": "017a0a2f-2c00-7000-8000-000000000000",
+    "timeout-at": "2021-06-09T10:00:30.000000"
+}
+
+def run_dict_flow(body):
+    rfq_details = json.loads(body)
+    rfq_details.update(RFQ_ADDITIONAL_FIELDS)
+    persisted = json.dumps(rfq_details)
+    published = json.dumps(rfq_details)
+    responded = json.dumps({ "status": "running", "rfq": rfq_details })
+    return persisted, published, responded
+
+def run_value_object_flow(body):
+    rfq = Rfq.from_json(body).derive(RFQ_ADDITIONAL_FIELDS)
+    persisted = rfq.to_json()
+    published = rfq.to_json()
+    responded = encode_with_embedded({ "status": "running" }, "rfq", rfq)
+    return persisted, published, responded
+
+def run_value_object_from_fields_flow(body):
+    rfq_details = json.loads(body)
+    rfq_details.update(RFQ_ADDITIONAL_FIELDS)
+    rfq = Rfq.from_fields(rfq_details)
+    persisted = rfq.to_json()
+    published = rfq.to_json()
+    responded = encode_with_embedded({ "status": "running" }, "rfq", rfq)
+    return persisted, published, responded
+
+# An RFQ response as a unicorn sends it, for reading a quote's fields.
+QUOTE_BODY = json.dumps({
+    "unicorn-id": "unicorn-042",
+    "customer-id": "4711",
+    "price": 42.5,
+    "goodies": [ "FREE_DRINKS_NON_ALC" ],
+    "submitted-at": RFQ_ADDITIONAL_FIELDS["submitted-at"],
+    "timeout-at": RFQ_ADDITIONAL_FIELDS["timeout-at"]
+})
+
+def run_quote_flow(body):
+    quote = Quote.from_json(body)
+    return quote.price, quote.submitted_at, quote.timeout_at
+
+def measure(flow, body, number):
+    # Warm up first, so that interned strings and caches don't count against the first flow measured.
+    flow(body)
+    tracemalloc.start()
+    flow(body)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    seconds = timeit.timeit(lambda: flow(body), number=number)
+    return {
+        "peak-bytes-per-call": peak,
+        "us-per-call": round(seconds / number * 1000000, 2)
+    }
+
+def benchmark(paths, number=10000):
+    for path in paths:
+        with open(path) as payload_file:
+            body = payload_file.read()
+        print(json.dumps({
+            "payload": path,
+            "dicts": measure(run_dict_flow, body, number),
+            "value-objects": measure(run_value_object_flow, body, number),
+            "value-objects-from-fields": measure(run_value_object_from_fields_flow, body, number)
+        }))
+    assert run_quote_flow(QUOTE_BODY)[0] == 42.5
+    print(json.dumps({ "payload": "quote", "value-objects": measure(run_quote_flow, QUOTE_BODY, number) }))
+
+if __name__ == "__main__":
+    benchmark(sys.argv[1:])
+
+# ---------------------------------------------------------------------------------------------------------------------